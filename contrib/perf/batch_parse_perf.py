@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# pylint: skip-file
+"""Compare batch request parsing, validation and routing
+
+    python contrib/perf/batch_parse_perf.py
+
+- per item: validate the whole batch, then parse and route each request
+  separately, as jussi did before from_http_batch
+- single pass: jussi.request.jsonrpc.from_http_batch
+
+Batches are a mix of appbase, steemd and translated calls. JSON decoding of
+the body isn't included, see json_engine_perf.py
+"""
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from jussi import json  # noqa
+from jussi.request.http import HTTPRequest  # noqa
+from jussi.request.jsonrpc import from_http_batch  # noqa
+from jussi.request.jsonrpc import from_http_request  # noqa
+from jussi.upstream import _Upstreams  # noqa
+from jussi.validators import validate_jsonrpc_request  # noqa
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'DEV_config.json')
+
+REQUESTS = [
+    {'method': 'get_block', 'params': [25000000]},
+    {'method': 'condenser_api.get_block', 'params': [25000000]},
+    {'method': 'get_dynamic_global_properties'},
+    {'method': 'condenser_api.get_accounts', 'params': [['steemit']]},
+    {'method': 'call', 'params': ['database_api', 'get_block_header', [25000000]]},
+    {'method': 'follow_api.get_followers', 'params': ['steemit', None, 'blog', 10]},
+]
+
+
+def batch(size):
+    return [dict(REQUESTS[i % len(REQUESTS)], id=i, jsonrpc='2.0') for i in range(size)]
+
+
+def http_request(app):
+    request = HTTPRequest(b'/', {'x-jussi-request-id': '123'}, '1.1', 'POST', None)
+    request.app = app
+    return request
+
+
+def per_item(app, requests):
+    request = http_request(app)
+    validate_jsonrpc_request(requests)
+    return [from_http_request(request, i, r) for i, r in enumerate(requests)]
+
+
+def single_pass(app, requests):
+    return from_http_batch(http_request(app), requests)
+
+
+def bench(func, number):
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def main():
+    with open(CONFIG_FILE) as f:
+        upstreams = _Upstreams(json.loads(f.read()), validate=False)
+    app = SimpleNamespace(config=SimpleNamespace(upstreams=upstreams))
+
+    print('us per batch, lower is better\n')
+    print(f'{"batch size":<12}{"per item":>12}{"single pass":>14}{"speedup":>10}')
+    for size in (1, 10, 50):
+        requests = batch(size)
+        number = 20000 // size
+        before = bench(lambda: per_item(app, requests), number)
+        after = bench(lambda: single_pass(app, requests), number)
+        print(f'{size:<12}{before:>12.1f}{after:>14.1f}{before / after:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
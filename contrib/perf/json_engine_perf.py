@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# pylint: skip-file
+"""Compare the jussi.json engines that are installed
+
+    python contrib/perf/json_engine_perf.py
+
+- batch request parsing: a batch of 50 get_block requests, as bytes
+- urn key serialization: the params of the test suite's URN requests
+- block responses: parsing and serializing mainnet-shaped get_block
+  responses (see response_id_rewrite_perf.py)
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(os.path.dirname(__file__))
+
+from jussi import json  # noqa
+from response_id_rewrite_perf import generate_block  # noqa
+
+
+def batch_request(size=50):
+    return json.dumps_bytes([{'id': i, 'jsonrpc': '2.0', 'method': 'get_block',
+                              'params': [25000000 + i]} for i in range(size)])
+
+
+URN_PARAMS = [
+    [1000],
+    {'block_num': 23},
+    ['steemit', -1, 100],
+    {'account': 'steemit', 'start': -1, 'limit': 100},
+    ['/trending'],
+    [{'tag': 'steem', 'limit': 20, 'truncate_body': 1024}],
+    [['steemit', 'ned', 'sneak']],
+]
+
+
+def bench(func, number):
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def main():
+    random.seed(1)
+    batch = batch_request()
+    block_bytes = [generate_block(25000000 + i, 60) for i in range(20)]
+    blocks = [json.loads(b) for b in block_bytes]
+
+    cases = [
+        ('batch request loads (50)', lambda: json.loads(batch), 2000),
+        ('urn params dumps (x7)', lambda: [json.dumps(p) for p in URN_PARAMS], 20000),
+        ('block loads (x20)', lambda: [json.loads(b) for b in block_bytes], 50),
+        ('block dumps_bytes (x20)', lambda: [json.dumps_bytes(b) for b in blocks], 50),
+    ]
+
+    engines = json.available_engines()
+    print('us per call, lower is better\n')
+    print(f'{"":<28}' + ''.join(f'{e:>12}' for e in engines))
+    for name, func, number in cases:
+        row = []
+        for engine in engines:
+            json.set_engine(engine)
+            row.append(bench(func, number))
+        print(f'{name:<28}' + ''.join(f'{t:>12.1f}' for t in row))
+    json.set_engine(json.DEFAULT_ENGINE)
+
+
+if __name__ == '__main__':
+    main()
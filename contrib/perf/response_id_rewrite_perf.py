@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# pylint: skip-file
+"""Compare rewriting upstream response ids with jussi.scanner against
+decoding/re-encoding them with ujson
+
+    python contrib/perf/response_id_rewrite_perf.py
+    python contrib/perf/response_id_rewrite_perf.py --blocks blocks.jsonl
+
+--blocks is a file of raw get_block responses, one per line, eg:
+
+    for n in $(seq 25000000 25000100); do
+      curl -s -d "{\"id\":1,\"jsonrpc\":\"2.0\",\"method\":\"get_block\",\"params\":[$n]}" \
+        https://api.steemit.com; echo
+    done > blocks.jsonl
+
+without it, blocks shaped like mainnet blocks are generated.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+import ujson
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from jussi.request.jsonrpc import JSONRPCRequest  # noqa
+from jussi.scanner import rewrite_id  # noqa
+from jussi.upstream import Upstream  # noqa
+from jussi.urn import URN  # noqa
+from jussi.validators import is_valid_get_block_response  # noqa
+from jussi.validators import is_valid_get_block_response_raw  # noqa
+
+
+def random_hex(n):
+    return ''.join(random.choice('0123456789abcdef') for _ in range(n))
+
+
+def random_op():
+    kind = random.choice(['vote', 'vote', 'vote', 'comment', 'transfer', 'custom_json'])
+    if kind == 'vote':
+        return ['vote', {'voter': 'voter%d' % random.randint(0, 10000),
+                         'author': 'author%d' % random.randint(0, 10000),
+                         'permlink': 're-post-%s' % random_hex(12),
+                         'weight': 10000}]
+    if kind == 'comment':
+        return ['comment', {'parent_author': '', 'parent_permlink': 'steem',
+                            'author': 'author%d' % random.randint(0, 10000),
+                            'permlink': 'post-%s' % random_hex(12),
+                            'title': 'title ' * 8,
+                            'body': 'lorem ipsum dolor sit amet ' * random.randint(10, 200),
+                            'json_metadata': ujson.dumps({'tags': ['steem', 'life'],
+                                                          'app': 'steemit/0.1'})}]
+    if kind == 'transfer':
+        return ['transfer', {'from': 'a%d' % random.randint(0, 10000),
+                             'to': 'b%d' % random.randint(0, 10000),
+                             'amount': '1.000 STEEM', 'memo': random_hex(32)}]
+    return ['custom_json', {'required_auths': [],
+                            'required_posting_auths': ['a%d' % random.randint(0, 10000)],
+                            'id': 'follow',
+                            'json': ujson.dumps(['follow', {'follower': 'a', 'following': 'b',
+                                                            'what': ['blog']}])}]
+
+
+def generate_block(block_num, tx_count):
+    transactions = [{'ref_block_num': 1234, 'ref_block_prefix': 567890,
+                     'expiration': '2018-08-01T00:00:00',
+                     'operations': [random_op()], 'extensions': [],
+                     'signatures': [random_hex(130)],
+                     'transaction_id': random_hex(40),
+                     'block_num': block_num, 'transaction_num': i}
+                    for i in range(tx_count)]
+    return ujson.dumps({
+        'jsonrpc': '2.0',
+        'result': {
+            'previous': '%08x' % (block_num - 1) + random_hex(32),
+            'timestamp': '2018-08-01T00:00:00',
+            'witness': 'witness',
+            'transaction_merkle_root': random_hex(40),
+            'extensions': [],
+            'witness_signature': random_hex(130),
+            'transactions': transactions,
+            'block_id': '%08x' % block_num + random_hex(32),
+            'signing_key': 'STM' + random_hex(50),
+            'transaction_ids': [t['transaction_id'] for t in transactions]},
+        'id': 1}).encode()
+
+
+def get_block_request(block_num):
+    urn = URN('appbase', 'condenser_api', 'get_block', [block_num])
+    return JSONRPCRequest(1, '2.0', 'get_block', [block_num], urn,
+                          Upstream('http://localhost', 3, 3), None, None, 0, None, [])
+
+
+def decode_path(raw):
+    response = ujson.loads(raw)
+    response['id'] = 'client-id'
+    return ujson.dumps(response, ensure_ascii=False).encode()
+
+
+def scanner_path(raw):
+    return rewrite_id(raw, 'client-id', upstream_id=1)
+
+
+def bench(name, func, blocks, number):
+    elapsed = timeit.timeit(lambda: [func(raw) for raw in blocks], number=number)
+    per_block = elapsed / (number * len(blocks)) * 1e6
+    print(f'{name:<46} {per_block:10.1f} us/block')
+    return per_block
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=str, default=None)
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--tx-count', type=int, default=60)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.blocks:
+        with open(args.blocks, 'rb') as f:
+            blocks = [line.strip() for line in f if line.strip()]
+    else:
+        random.seed(1)
+        blocks = [generate_block(25000000 + i, args.tx_count) for i in range(args.count)]
+    requests = [get_block_request(int(ujson.loads(raw)['result']['block_id'][:8], 16))
+                for raw in blocks]
+    pairs = list(zip(requests, blocks))
+    size = sum(len(b) for b in blocks) / len(blocks)
+    print(f'{len(blocks)} blocks, {size / 1024:.1f} KiB average\n')
+
+    for raw in blocks:
+        assert ujson.loads(decode_path(raw)) == ujson.loads(scanner_path(raw))
+
+    print('id rewrite')
+    decoded = bench('  ujson loads + dumps', decode_path, blocks, args.number)
+    scanned = bench('  jussi.scanner.rewrite_id', scanner_path, blocks, args.number)
+    print(f'  speedup: {decoded / scanned:.1f}x\n')
+
+    print('get_block validation')
+    decoded = bench('  ujson loads + is_valid_get_block_response',
+                    lambda p: is_valid_get_block_response(p[0], ujson.loads(p[1])),
+                    pairs, args.number)
+    scanned = bench('  is_valid_get_block_response_raw',
+                    lambda p: is_valid_get_block_response_raw(*p), pairs, args.number)
+    print(f'  speedup: {decoded / scanned:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
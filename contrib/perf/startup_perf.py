@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# pylint: skip-file
+"""Measure jussi's cold start
+
+    python contrib/perf/startup_perf.py [upstream config] [workers] [runs]
+
+Starts `python -m jussi.serve` and reports the seconds until /health
+answers, the server is up, and until /ready answers 200, every worker's
+upstream connections are warm. Upstream urls aren't validated, and the
+config defaults to DEV_config.json, so the connections in it have to be
+reachable for /ready to turn 200.
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+CONFIG_FILE = os.path.join(ROOT, 'DEV_config.json')
+TIMEOUT = 60
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def is_ok(url):
+    # errors, eg 404s, are JSON-RPC error responses with status 200
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200 and json.loads(response.read())['status'] == 'OK'
+    except (urllib.error.URLError, ConnectionError, socket.timeout, ValueError, KeyError):
+        return False
+
+
+def start(config_file, workers):
+    port = free_port()
+    env = dict(os.environ,
+               JUSSI_UPSTREAM_CONFIG_FILE=os.path.abspath(config_file),
+               JUSSI_SERVER_PORT=str(port),
+               JUSSI_SERVER_WORKERS=str(workers),
+               JUSSI_TEST_UPSTREAM_URLS='false',
+               LOG_LEVEL='WARNING')
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'jussi.serve'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    health = ready = None
+    try:
+        while time.perf_counter() - started < TIMEOUT and ready is None:
+            elapsed = time.perf_counter() - started
+            if health is None and is_ok(f'http://127.0.0.1:{port}/health'):
+                health = elapsed
+            # with several workers, any one of them may answer
+            if health is not None and is_ok(f'http://127.0.0.1:{port}/ready'):
+                ready = elapsed
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return health, ready
+
+
+def main():
+    config_file = sys.argv[1] if len(sys.argv) > 1 else CONFIG_FILE
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    results = [start(config_file, workers) for _ in range(runs)]
+    print(f'{runs} runs, {workers} worker(s), seconds, lower is better\n')
+    for i, name in enumerate(('health', 'ready')):
+        times = [result[i] for result in results if result[i] is not None]
+        if not times:
+            print(f'{name:<8} timed out')
+            continue
+        print(f'{name:<8} median {statistics.median(times):.3f} '
+              f'min {min(times):.3f} max {max(times):.3f}')
+
+
+if __name__ == '__main__':
+    main()
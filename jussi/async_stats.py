@@ -2,6 +2,8 @@
 import asyncio
 from collections import deque
 from random import random
+from typing import Callable
+from typing import Dict
 from typing import List
 from typing import Tuple
 
@@ -39,10 +41,22 @@ class DatagramClientProtocol:
 
 
 class AsyncStatsClient:
-    """An asynchronous client for statsd."""
+    """An asynchronous client for statsd.
+
+    Stats are aggregated in memory and sent once per flush_interval, so
+    recording one is a dict update and formatting only happens at flush
+    time. Counters are summed, gauges keep their last value, sets their
+    unique values, and timings are sent as their mean, sampled at
+    1/count so statsd still counts every timing, with their max as a
+    "<stat>.max" gauge.
+
+    sample_rates maps stat name prefixes to the rate stats starting with
+    them are sampled at, the longest matching prefix wins.
+    """
 
     def __init__(self, host: str='127.0.0.1', port: int=8125, prefix: str=None,
-                 maxudpsize: int=512, loop=None):
+                 maxudpsize: int=512, loop=None, flush_interval: float=1.0,
+                 sample_rates: Dict[str, float]=None):
         """Create a new client."""
         self._host = host
         self._port = port
@@ -52,7 +66,20 @@ class AsyncStatsClient:
         self._protocol = None
         self._prefix = prefix
         self._maxudpsize = maxudpsize
-        self._stats = deque()
+        self._flush_interval = flush_interval
+        self._flush_task = None
+        self._sample_rates = dict(sample_rates or {})
+        # stat -> sample rate, resolved from _sample_rates once per stat
+        self._rates = dict()
+        # (stat, rate) -> count
+        self._counters = dict()
+        # (stat, rate) -> [count, sum, max], in milliseconds
+        self._timings = dict()
+        self._gauges = dict()
+        self._gauge_deltas = dict()
+        self._sets = dict()
+        # stat -> callable returning a gauge value, read at flush time
+        self._gauge_callbacks = dict()
         if prefix is not None:
             prefix = f'{prefix}.'
         else:
@@ -64,14 +91,55 @@ class AsyncStatsClient:
             DatagramClientProtocol, remote_addr=self._addr)
         self._transport = transport
         self._protocol = protocol
+        self._flush_task = asyncio.ensure_future(self._flush_periodically(),
+                                                 loop=self._loop)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval, loop=self._loop)
+            self.flush()
+
+    def close(self):
+        """flush what's left and stop flushing. The transport is left open,
+        closing it stops the event loop, see DatagramClientProtocol"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+
+    def sample_rate(self, stat: str) -> float:
+        rate = self._rates.get(stat)
+        if rate is None:
+            rate = 1.0
+            matched = -1
+            for prefix, prefix_rate in self._sample_rates.items():
+                if stat.startswith(prefix) and len(prefix) > matched:
+                    rate, matched = prefix_rate, len(prefix)
+            self._rates[stat] = rate
+        return rate
 
     def timing(self, stat: str, delta: float, rate=1):
-        """Send new timing information. `delta` is in milliseconds."""
-        self.put(stat, f'{delta:0.6f}|ms', rate)
+        """Record timing information. `delta` is in milliseconds."""
+        rate = min(rate, self.sample_rate(stat))
+        if rate < 1 and random() > rate:
+            return
+        key = (stat, rate)
+        summary = self._timings.get(key)
+        if summary is None:
+            self._timings[key] = [1, delta, delta]
+        else:
+            summary[0] += 1
+            summary[1] += delta
+            if delta > summary[2]:
+                summary[2] = delta
 
     def incr(self, stat: str, count=1, rate=1):
         """Increment a stat by `count`."""
-        self.put(stat, f'{count}|c', rate)
+        rate = min(rate, self.sample_rate(stat))
+        if rate < 1 and random() > rate:
+            return
+        key = (stat, rate)
+        self._counters[key] = self._counters.get(key, 0) + count
 
     def decr(self, stat: str, count=1, rate=1):
         """Decrement a stat by `count`."""
@@ -79,40 +147,72 @@ class AsyncStatsClient:
 
     def gauge(self, stat: str, value: int, rate=1, delta=False):
         """Set a gauge value."""
-        if value < 0 and not delta:
-            if rate < 1 and random() > rate:
-                return
-            self.put(stat, '0|g', 1)
-            self.put(stat, f'{value}|g', 1)
+        rate = min(rate, self.sample_rate(stat))
+        if rate < 1 and random() > rate:
+            return
+        if delta:
+            self._gauge_deltas[stat] = self._gauge_deltas.get(stat, 0) + value
         else:
-            prefix = '+' if delta and value >= 0 else ''
-            self.put(stat, f'{prefix}{value}|g', rate)
+            self._gauges[stat] = value
+            self._gauge_deltas.pop(stat, None)
+
+    def gauge_callback(self, stat: str, callback: Callable[[], float]):
+        """Set gauge stat to callback's result at each flush"""
+        self._gauge_callbacks[stat] = callback
 
     def set(self, stat: str, value, rate=1):
         """Set a set value."""
-        self.put(stat, f'{value}|s', rate)
-
-    def put(self, stat: str, value: str, rate: int) -> None:
-        """Send data to statsd."""
-        if rate < 1:
-            if random() > rate:
-                return
-            else:
-                value = f'{value}|@{rate}'
-        self._stats.append(f'{self._prefix}{stat}:{value}')
+        rate = min(rate, self.sample_rate(stat))
+        if rate < 1 and random() > rate:
+            return
+        self._sets.setdefault(stat, set()).add(value)
 
     def from_timings(self, timings: List[Tuple[float, str]]):
-        self._stats.extend(
-            f'{self._prefix}{t2[1]}:{((t2[0] - t1[0]) * 1000):0.6f}|ms' for t1, t2 in sliding_window(2, timings)
-        )
+        previous = timings[0][0]
+        for t, stat in timings[1:]:
+            self.timing(stat, (t - previous) * 1000)
+            previous = t
 
     def serialize_timings(self, timings: List[Tuple[float, str]]) -> List:
         return [f'{self._prefix}{t2[1]}:{((t2[0] - t1[0]) * 1000):0.6f}|ms' for t1,
                 t2 in sliding_window(2, timings)]
 
-    def _sendbatch(self, stats: deque = None):
+    def flush(self):
+        """send the stats aggregated since the last flush"""
+        for stat, callback in self._gauge_callbacks.items():
+            try:
+                self.gauge(stat, callback())
+            except Exception as e:
+                logger.error('statsd gauge callback error', stat=stat, exc_info=e)
+        stats = self._format_stats()
+        if stats and self._transport is not None:
+            self._sendbatch(stats)
+
+    def _format_stats(self) -> deque:
+        prefix = self._prefix
+        stats = deque()
+        for (stat, rate), count in self._counters.items():
+            stats.append(f'{prefix}{stat}:{count}|c{_rate(rate)}')
+        for (stat, rate), (count, total, max_delta) in self._timings.items():
+            stats.append(f'{prefix}{stat}:{total / count:0.6f}|ms|@{rate / count:g}')
+            stats.append(f'{prefix}{stat}.max:{max_delta:0.6f}|g')
+        for stat, value in self._gauges.items():
+            if value < 0:
+                stats.append(f'{prefix}{stat}:0|g')
+            stats.append(f'{prefix}{stat}:{value}|g')
+        for stat, value in self._gauge_deltas.items():
+            stats.append(f'{prefix}{stat}:{"+" if value >= 0 else ""}{value}|g')
+        for stat, values in self._sets.items():
+            stats.extend(f'{prefix}{stat}:{value}|s' for value in values)
+        self._counters = dict()
+        self._timings = dict()
+        self._gauges = dict()
+        self._gauge_deltas = dict()
+        self._sets = dict()
+        return stats
+
+    def _sendbatch(self, stats: deque):
         try:
-            stats = stats or self._stats
             data = stats.popleft()
             while stats:
                 # Use popleft to preserve the order of the stats.
@@ -130,5 +230,26 @@ class AsyncStatsClient:
         return self._transport is not None
 
 
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """parse "prefix=rate,prefix=rate", eg "fetch_ws=0.1,jrpc.inflight=1"
+
+    Raises ValueError for rates not in (0, 1]
+    """
+    sample_rates = dict()
+    for item in filter(None, (item.strip() for item in (value or '').split(','))):
+        prefix, sep, rate = item.rpartition('=')
+        if not sep or not prefix:
+            raise ValueError(f'sample rate {item!r} is expected to be prefix=rate')
+        rate = float(rate)
+        if not 0 < rate <= 1:
+            raise ValueError(f'sample rate of {prefix} is expected to be in (0, 1]')
+        sample_rates[prefix] = rate
+    return sample_rates
+
+
+def _rate(rate: float) -> str:
+    return '' if rate >= 1 else f'|@{rate:g}'
+
+
 def fmt_timings(timings: List[Tuple[float, str]]):
     return [f'{t2[1]}:{((t2[0] - t1[0]) * 1000):0.6f}|ms' for t1, t2 in sliding_window(2, timings)]
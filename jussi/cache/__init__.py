@@ -70,6 +70,16 @@ class HealthCheckedConnectionPool(ConnectionPool):
 
     # Per-instance overridable (see setup_caches below).
     in_use_max_age = POOL_IN_USE_MAX_AGE
+    reaped_count = 0
+
+    def stats(self) -> dict:
+        return {
+            'max_connections': self.max_connections,
+            'created': self._created_connections,
+            'available': len(self._available_connections),
+            'in_use': len(self._in_use_connections),
+            'reaped': self.reaped_count
+        }
 
     async def get_connection(self, command_name, *keys, **options):
         await self._reap_stuck_in_use()
@@ -127,6 +137,7 @@ class HealthCheckedConnectionPool(ConnectionPool):
                     c.__dict__.pop('_jussi_in_use_since', None)
         if not stuck:
             return
+        self.reaped_count += len(stuck)
         # Disconnect outside the lock — disconnect() awaits and we don't
         # want to block release()/get_connection() of other tasks.
         for c, _age in stuck:
@@ -93,7 +93,15 @@ class SimplerMaxTTLMemoryCache:
             del self._cache[next(iter(self._cache))]
 
     def clears(self) -> None:
-        self._cache = {}
+        # cleared in place, _keys, _values and _items are views of it
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            'keys': len(self._cache),
+            'max_size': self._max_size,
+            'max_ttl': self._max_ttl
+        }
 
     async def clear(self) -> None:
         return self.clears()
@@ -7,10 +7,7 @@ from typing import Optional
 from typing import Tuple
 from typing import Union
 
-
-from ujson import dumps
-from ujson import loads
-
+from ... import json
 from ...empty import Empty
 
 CacheTTLValue = Union[int, float, None]
@@ -32,12 +29,12 @@ class Cache:
 
     # pylint: disable=no-self-use
     def _pack(self, value) -> bytes:
-        return compress(dumps(value, ensure_ascii=False).encode('utf8'))
+        return compress(json.dumps_bytes(value))
 
     def _unpack(self, value: bytes) -> CacheResult:
         if not value:
             return None
-        return loads(decompress(value))
+        return json.loads(decompress(value))
 
     # pylint: enable=no-self-use
 
@@ -74,6 +71,11 @@ class Cache:
     async def delete(self, key):
         await self.client.delete(key)
 
+    def stats(self) -> dict:
+        # the stats of jussi's HealthCheckedConnectionPool
+        pool_stats = getattr(getattr(self.client, 'connection_pool', None), 'stats', None)
+        return pool_stats() if pool_stats is not None else {}
+
 
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
@@ -16,6 +16,8 @@ from jussi.errors import JussiInteralError
 from jussi.validators import is_get_block_request
 from jussi.validators import is_valid_get_block_response
 
+from ..metrics import CACHE_REQUESTS
+from ..metrics import METRICS
 from ..typedefs import BatchJrpcRequest
 from ..typedefs import BatchJrpcResponse
 from ..typedefs import JrpcRequest
@@ -55,6 +57,12 @@ class UncacheableResponse(JussiInteralError):
 SLOW_TIER = 1
 FAST_TIER = 2
 
+MEMORY_HIT = (CACHE_REQUESTS, 'memory', 'hit')
+MEMORY_MISS = (CACHE_REQUESTS, 'memory', 'miss')
+# every read cache is a redis server or replica
+REDIS_HIT = (CACHE_REQUESTS, 'redis', 'hit')
+REDIS_MISS = (CACHE_REQUESTS, 'redis', 'miss')
+
 
 class CacheGroup:
     # pylint: disable=unused-argument, too-many-arguments, no-else-return
@@ -111,7 +119,10 @@ class CacheGroup:
         memory_cache_results = self._memory_cache.mgets(keys)
         cache_iter = iter(memory_cache_results)
         results = [existing or next(cache_iter) for existing in results]
-        if all(results):
+        hits = sum(1 for result in results if result)
+        METRICS.incr(MEMORY_HIT, hits)
+        METRICS.incr(MEMORY_MISS, len(keys) - hits)
+        if hits == len(keys):
             return results
 
         # read from one cache at a time
@@ -122,6 +133,9 @@ class CacheGroup:
             cache_results = await cache.mget(missing)
             cache_iter = iter(cache_results)
             results = [existing or next(cache_iter) for existing in results]
+            cache_hits = sum(1 for result in cache_results if result)
+            METRICS.incr(REDIS_HIT, cache_hits)
+            METRICS.incr(REDIS_MISS, len(missing) - cache_hits)
             if all(results):
                 return results
         return results
@@ -152,6 +166,13 @@ class CacheGroup:
         for cache in self._all_caches:
             await cache.close()
 
+    def stats(self) -> dict:
+        return {
+            'memory': self._memory_cache.stats(),
+            'read_pools': [_cache_stats(cache) for cache in self._read_caches],
+            'write_pools': [_cache_stats(cache) for cache in self._write_caches]
+        }
+
     # jsonrpc related methods
     #
 
@@ -164,12 +185,17 @@ class CacheGroup:
         # try sync memory cache get first
         cached_response = self._memory_cache.gets(key)
         if cached_response is not None:
+            METRICS.incr(MEMORY_HIT)
             return merge_cached_response(request, cached_response)
+        METRICS.incr(MEMORY_MISS)
 
         # try async redis cache get
-        cached_response = await self.get(key)
-        if cached_response is not None:
-            return merge_cached_response(request, cached_response)
+        for cache in self._read_caches:
+            cached_response = await cache.get(key)
+            if cached_response is not None:
+                METRICS.incr(REDIS_HIT)
+                return merge_cached_response(request, cached_response)
+            METRICS.incr(REDIS_MISS)
         return None
 
     async def get_batch_jsonrpc_responses(self,
@@ -264,3 +290,8 @@ class CacheGroup:
             return jsonrpc_cache_key(request)
         else:
             return 'batch'
+
+
+def _cache_stats(cache) -> dict:
+    stats = getattr(cache, 'stats', None)
+    return stats() if stats is not None else {}
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+from collections import deque
+from time import perf_counter as perf
+from typing import Coroutine
+from typing import Optional
+
+import structlog
+
+from .errors import UpstreamOverloadedError
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# AIMD (additive increase/multiplicative decrease) concurrency limiting
+#
+# Every upstream url gets its own limiter. The limit is the number of requests
+# allowed in flight to that upstream at once. It grows by one per successful,
+# well-utilised response and shrinks by ``backoff_ratio`` whenever a request
+# times out or the recent latency rises above ``latency_tolerance`` times the
+# usual latency. Both are moving averages of every response's latency, over
+# about ``short_window`` and ``window_size`` responses, so an upstream serving
+# a steady mix of cheap and expensive methods isn't mistaken for a congested
+# one, as it would be if single responses were compared to the fastest.
+# Requests over the limit wait in a bounded FIFO queue; once that queue is
+# full, requests are shed with a JSONRPC error instead of piling up inside
+# the upstream. Cancelled requests, eg of a disconnected client or of a batch
+# with a failed item, only free their slot: cancellation says nothing about
+# the upstream.
+# -------------------
+
+DEFAULT_INITIAL_LIMIT = 32
+DEFAULT_MIN_LIMIT = 4
+DEFAULT_MAX_LIMIT = 512
+DEFAULT_MAX_QUEUE_SIZE = 1024
+DEFAULT_BACKOFF_RATIO = 0.9
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_WINDOW_SIZE = 500
+DEFAULT_SHORT_WINDOW = 25
+
+DROPPED_EXCEPTIONS = (asyncio.TimeoutError,
+                      concurrent.futures.TimeoutError)
+
+# pylint: disable=too-many-instance-attributes,too-many-arguments
+
+
+class AIMDConcurrencyLimiter:
+    """Adaptive in-flight request limit for a single upstream"""
+
+    __slots__ = ('url',
+                 '_loop',
+                 '_limit',
+                 '_min_limit',
+                 '_max_limit',
+                 '_max_queue_size',
+                 '_backoff_ratio',
+                 '_latency_tolerance',
+                 '_long_alpha',
+                 '_short_alpha',
+                 '_long_rtt',
+                 '_short_rtt',
+                 '_short_window',
+                 '_since_decrease',
+                 '_inflight',
+                 '_waiters',
+                 'shed_count',
+                 'drop_count')
+
+    def __init__(self,
+                 url: str,
+                 initial_limit: int=DEFAULT_INITIAL_LIMIT,
+                 min_limit: int=DEFAULT_MIN_LIMIT,
+                 max_limit: int=DEFAULT_MAX_LIMIT,
+                 max_queue_size: int=DEFAULT_MAX_QUEUE_SIZE,
+                 backoff_ratio: float=DEFAULT_BACKOFF_RATIO,
+                 latency_tolerance: float=DEFAULT_LATENCY_TOLERANCE,
+                 window_size: int=DEFAULT_WINDOW_SIZE,
+                 short_window: int=DEFAULT_SHORT_WINDOW,
+                 loop=None) -> None:
+        if min_limit <= 0:
+            raise ValueError('min_limit is expected to be greater than zero')
+        if min_limit > max_limit:
+            raise ValueError('min_limit is greater than max_limit')
+        if max_queue_size < 0:
+            raise ValueError('max_queue_size is expected to be greater than or equal zero')
+        if not 0 < backoff_ratio < 1:
+            raise ValueError('backoff_ratio is expected to be between zero and one')
+        if not 0 < short_window < window_size:
+            raise ValueError('short_window is expected to be between zero and window_size')
+
+        self.url = url
+        self._loop = loop or asyncio.get_event_loop()
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._max_queue_size = max_queue_size
+        self._backoff_ratio = backoff_ratio
+        self._latency_tolerance = latency_tolerance
+        # exponential moving averages, the last window_size (short_window)
+        # responses weigh ~86% of the long (short) average
+        self._long_alpha = 2 / (window_size + 1)
+        self._short_alpha = 2 / (short_window + 1)
+        self._long_rtt = None
+        self._short_rtt = None
+        self._short_window = short_window
+        self._since_decrease = 0
+        self._inflight = 0
+        self._waiters = deque()
+        self.shed_count = 0
+        self.drop_count = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self._inflight < self.limit and not self._waiters:
+            self._inflight += 1
+            return
+
+        if len(self._waiters) >= self._max_queue_size:
+            self.shed_count += 1
+            raise UpstreamOverloadedError(url=self.url,
+                                          limit=self.limit,
+                                          queue_size=len(self._waiters))
+
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # a slot was handed to us after we were cancelled,
+                # so pass it along to the next waiter
+                self._inflight -= 1
+                self._wake_waiters()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self, rtt: Optional[float], dropped: bool=False) -> None:
+        """free a slot, without touching the limit if rtt is None"""
+        self._inflight -= 1
+        if rtt is not None:
+            self._update_limit(rtt, dropped)
+        self._wake_waiters()
+
+    async def run(self, coro: Coroutine):
+        """await ``coro`` once a slot is available, measuring its latency"""
+        try:
+            await self.acquire()
+        except BaseException:
+            coro.close()
+            raise
+        start = perf()
+        rtt = None  # type: Optional[float]
+        dropped = False
+        try:
+            result = await coro
+            rtt = perf() - start
+            return result
+        except asyncio.CancelledError:
+            raise
+        except DROPPED_EXCEPTIONS:
+            rtt = perf() - start
+            dropped = True
+            raise
+        except BaseException:
+            rtt = perf() - start
+            raise
+        finally:
+            self.release(rtt, dropped=dropped)
+
+    def _update_limit(self, rtt: float, dropped: bool) -> None:
+        if not dropped:
+            if self._long_rtt is None:
+                self._long_rtt = self._short_rtt = rtt
+            else:
+                # the long average follows the upstream if it has become
+                # permanently slower (or faster)
+                self._long_rtt += self._long_alpha * (rtt - self._long_rtt)
+                self._short_rtt += self._short_alpha * (rtt - self._short_rtt)
+            # the short average lags, so it decreases the limit at most once
+            # per short window, timeouts decrease it every time
+            self._since_decrease += 1
+            dropped = (self._since_decrease >= self._short_window and
+                       self._short_rtt > self._long_rtt * self._latency_tolerance)
+
+        if dropped:
+            self._since_decrease = 0
+            self.drop_count += 1
+            self._limit = max(self._min_limit, self._limit * self._backoff_ratio)
+        elif (self._inflight + 1) * 2 >= self._limit:
+            # only grow the limit while it is actually being used
+            self._limit = min(self._max_limit, self._limit + 1)
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._inflight += 1
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            'url': self.url,
+            'limit': self.limit,
+            'inflight': self._inflight,
+            'queued': len(self._waiters),
+            'short_rtt': self._short_rtt,
+            'long_rtt': self._long_rtt,
+            'shed': self.shed_count,
+            'dropped': self.drop_count
+        }
@@ -13,6 +13,8 @@ from funcy.decorators import decorator
 from sanic import response
 
 from .async_stats import fmt_timings
+from .metrics import ERRORS
+from .metrics import METRICS
 from .typedefs import HTTPRequest
 from .typedefs import HTTPResponse
 from .typedefs import JrpcRequest
@@ -228,6 +230,7 @@ class JsonRpcError(JussiInteralError):
 
     def to_sanic_response(self) -> HTTPResponse:
         self.log()
+        METRICS.incr((ERRORS, str(self.code)))
         error = {
             'jsonrpc': '2.0',
             'id': self.jrpc_request_id,
@@ -310,27 +313,30 @@ class UpstreamResponseError(JsonRpcError):
                 data['request_data'] = self.jsonrpc_request.to_dict()
         except Exception:
             pass
-        # include the real client IP for openresty blocking.
-        # openresty's real_ip_header already restores the true client IP
-        # to $remote_addr, then passes it as X-Real-IP to jussi.
-        # X-Forwarded-For ($proxy_add_x_forwarded_for) contains the full
-        # proxy chain and is used as fallback.
+        # include the real client IP for openresty blocking
         try:
             if self.http_request:
-                xri = self.http_request.headers.get('X-Real-IP', '')
-                if xri:
-                    data['client_ip'] = xri
-                else:
-                    xff = self.http_request.headers.get('X-Forwarded-For', '')
-                    if xff:
-                        data['client_ip'] = xff.split(',')[0].strip()
-                    else:
-                        data['client_ip'] = getattr(self.http_request, 'ip', 'unknown')
+                data['client_ip'] = self.http_request.client_ip
         except Exception:
             pass
         return data
 
 
+class UpstreamOverloadedError(JsonRpcError):
+    code = 1150
+    message = 'Upstream overloaded, request queue of {queue_size} is full'
+
+
+class UpstreamUnavailableError(JsonRpcError):
+    code = 1160
+    message = 'Upstream {url} unavailable, unable to connect'
+
+
+class PriorityQueueFullError(JsonRpcError):
+    code = 1151
+    message = 'Too many queued {priority} requests, request queue of {queue_size} is full'
+
+
 class InvalidNamespaceError(JsonRpcError):
     code = 1200
     message = 'Invalid JSONRPC method namespace {namespace}'
@@ -364,6 +370,10 @@ class JussiAccountHistoryLimitsError(JsonRpcError):
     code = 1701
     message = 'Account History request exceeded limit. The max limit is 100. Your limit is {your_limit}'
 
+class JussiRateLimitError(JsonRpcError):
+    code = 1702
+    message = 'Rate limit {name} of {rate} requests per second exceeded'
+
 class JussiCustomJsonOpLengthError(JsonRpcError):
     code = 1800
     message = 'Custom JSON operation size limit of {size_limit} exceeded'
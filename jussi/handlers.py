@@ -2,25 +2,41 @@
 import asyncio
 import concurrent.futures
 import datetime
+import os
 from time import perf_counter as perf
 from typing import Coroutine
+from typing import List
+from urllib.parse import parse_qs
 
-import cytoolz
 import structlog
 
 from async_timeout import timeout
 from sanic import response
-from ujson import loads
 from websockets.exceptions import ConnectionClosed
 
-from .empty import _empty
+from .cache.ttl import TTL
 from .errors import InvalidUpstreamURL
 from .errors import RequestTimeoutError
 from .errors import UpstreamResponseError
+from .merge import group_vector_requests
+from .merge import merge_requests
+from .merge import split_response
+from .metrics import METRICS
+from .metrics import read_snapshots
+from .metrics import render
+from .profiler import DEFAULT_INTERVAL as DEFAULT_PROFILE_INTERVAL
+from .profiler import DEFAULT_SECONDS as DEFAULT_PROFILE_SECONDS
+from .profiler import MAX_SECONDS as MAX_PROFILE_SECONDS
+from .profiler import MIN_INTERVAL as MIN_PROFILE_INTERVAL
+from .profiler import ProfilerBusy
+from .profiler import format_collapsed
+from .scanner import join_batch
+from .scanner import rewrite_id
+from .streaming import is_streamable_response
+from .streaming import stream_upstream_response
 from .typedefs import HTTPRequest
 from .typedefs import HTTPResponse
 from .typedefs import SingleJrpcRequest
-from .typedefs import SingleJrpcResponse
 
 logger = structlog.get_logger(__name__)
 
@@ -34,15 +50,19 @@ async def handle_jsonrpc(http_request: HTTPRequest) -> HTTPResponse:
     async with timeout(http_request.request_timeout):
         if http_request.is_single_jrpc:
 
-            jsonrpc_response = await dispatch_single(http_request,
-                                                     http_request.jsonrpc)
+            jsonrpc_response = await dispatch_single(
+                http_request,
+                http_request.jsonrpc,
+                allow_streaming=http_request.app.config.args.upstream_streaming)
+            if isinstance(jsonrpc_response, response.StreamingHTTPResponse):
+                http_request.timings.append((perf(), 'handle_jsonrpc.exit'))
+                return jsonrpc_response
         else:
 
-            futures = [dispatch_single(http_request, request)
-                       for request in http_request.jsonrpc]
-            jsonrpc_response = await asyncio.gather(*futures)
+            jsonrpc_response = join_batch(await dispatch_batch(http_request))
         http_request.timings.append((perf(), 'handle_jsonrpc.exit'))
-        return response.json(jsonrpc_response)
+        # upstream responses are already serialized, see fetch_ws/fetch_http
+        return response.raw(jsonrpc_response, content_type='application/json')
 
 
 async def healthcheck(http_request: HTTPRequest) -> HTTPResponse:
@@ -54,139 +74,157 @@ async def healthcheck(http_request: HTTPRequest) -> HTTPResponse:
         'jussi_num': http_request.app.config.last_irreversible_block_num
     })
 
-# pylint: disable=protected-access, too-many-locals, no-member, unused-variable
+
+async def ready(http_request: HTTPRequest) -> HTTPResponse:
+    """200 once the worker's upstream connections are warm, 503 before"""
+    config = http_request.app.config
+    if not config.get('ready'):
+        return response.json({'status': 'starting',
+                              'warmups': len(config.get('warmups', []))},
+                             status=503)
+    return response.json({
+        'status': 'OK',
+        'ready_after': config.ready_after
+    })
+
+
+async def metrics(http_request: HTTPRequest) -> HTTPResponse:
+    """Prometheus metrics of every worker"""
+    snapshot = METRICS.snapshot()
+    metrics_dir = http_request.app.config.get('metrics_dir')
+    # the other workers' snapshots are read and merged off the event loop
+    text = await asyncio.get_event_loop().run_in_executor(
+        None, _render_metrics, snapshot, metrics_dir)
+    return response.text(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _render_metrics(snapshot: dict, metrics_dir: str) -> str:
+    return render([snapshot] + read_snapshots(metrics_dir, exclude_pid=os.getpid()))
 
 
 async def monitor(http_request: HTTPRequest) -> HTTPResponse:
-    app = http_request.app
-    import inspect
+    """runtime stats registered by each subsystem, see jussi.runtime"""
+    config = http_request.app.config
+    data = {
+        'source_commit': config.args.source_commit,
+        'docker_tag': config.args.docker_tag,
+        'jussi_num': config.last_irreversible_block_num
+    }
+    data.update(config.runtime_stats.collect())
+    return response.json(data)
 
-    cache_data = []
-    try:
-        cache_group = app.config.cache_group
-        cache_data.append({
-            'cache.memory_cache': {
-                'keys': len(cache_group._memory_cache._keys)
-            }
-        })
-        for i, cache in enumerate(cache_group._read_caches):
-            data = {
-                'read_cache.pool.available': len(cache.client.connection_pool._available_connections),
-                'read_cache.pool.in_use': len(cache.client.connection_pool._in_use_connections)
-            }
-            cache_data.append(data)
-        for i, cache in enumerate(cache_group._write_caches):
-            data = {
-                'write_cache.pool.available': len(cache.client.connection_pool._available_connections),
-                'write_cache.pool.in_use': len(cache.client.connection_pool._in_use_connections)
-            }
-            cache_data.append(data)
-    except Exception as e:
-        logger.error('error adding cache info', e=e)
 
-    server_data = dict()
+async def reload_upstream_config(http_request: HTTPRequest) -> HTTPResponse:
+    """reload the upstream config file of the worker serving this request,
+    SIGHUP reloads it in every worker"""
+    from .reload import reload_upstreams
     try:
-        frames = inspect.stack()
-        server_frame = [f for f in frames if f.filename.endswith('sanic/server.py')][0]
-        server = server_frame.frame.f_locals
-        server_data = {
-            'connections': len(server['connections']),
-            'pid': str(server['pid']),
-            'state': str(server['state'])
-        }
-        del frames
-        del server_frame
-        del server
+        changes = await reload_upstreams(http_request.app)
     except Exception as e:
-        logger.error('error adding cache info', e=e)
+        logger.error('upstream reload failed, keeping current config', e=e)
+        return response.json({'status': 'error', 'error': str(e)}, status=500)
+    return response.json({
+        'status': 'OK',
+        'pid': os.getpid(),
+        'changes': changes.to_dict()
+    })
 
-    ws_pools = []
-    pools = http_request.app.config.websocket_pools
-    try:
-        for url, pool in pools.items():
-            data = {
-                'url': url,
-                'queue': pool._queue.qsize,
-                'in_use': len([ch._in_use for ch in pool._holders if ch._in_use is not None]),
-                'ws_read_q_sizes': [ch._con.messages.qsize() for ch in pool._holders if ch._con]
-            }
-            ws_pools.append(data)
-    except Exception as e:
-        logger.error('error adding cache info', e=e)
 
-    async_data = dict()
+async def profile(http_request: HTTPRequest) -> HTTPResponse:
+    """collapsed stacks of a sampling profile of the worker serving this
+    request, or of every worker with ?workers=all"""
+    config = http_request.app.config
+    query = parse_qs(http_request.query_string or '')
     try:
-        tasks = asyncio.tasks.Task.all_tasks()
-        grouped_tasks = cytoolz.groupby(lambda t: t._state, tasks)
-        for k, v in grouped_tasks.items():
-            grouped_tasks[k] = len(v)
-        async_data = {
-            'tasks.count': len(tasks),
-            'tasks': grouped_tasks
-        }
-    except Exception as e:
-        logger.error('error adding cache info', e=e)
-    data = {
-        'source_commit': http_request.app.config.args.source_commit,
-        'docker_tag': http_request.app.config.args.docker_tag,
-        'jussi_num': http_request.app.config.last_irreversible_block_num,
-        'asyncio': async_data,
-        'cache': cache_data,
-        'server': server_data,
-        'ws_pools': ws_pools
-
-    }
-    return response.json(data)
-# pylint: enable=protected-access, too-many-locals, no-member, unused-variable
+        seconds = float(query.get('seconds', [DEFAULT_PROFILE_SECONDS])[0])
+        interval = float(query.get('interval', [DEFAULT_PROFILE_INTERVAL])[0])
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or interval < MIN_PROFILE_INTERVAL:
+            raise ValueError(f'seconds is expected to be in (0, {MAX_PROFILE_SECONDS}] '
+                             f'and interval at least {MIN_PROFILE_INTERVAL}')
+    except ValueError as e:
+        return response.json({'status': 'error', 'error': str(e)}, status=400)
+    try:
+        if query.get('workers', [''])[0] == 'all':
+            stacks = await config.profiler.profile_workers(seconds, interval,
+                                                           config.args.server_workers)
+        else:
+            stacks = await config.profiler.profile(seconds, interval)
+    except ProfilerBusy as e:
+        return response.json({'status': 'error', 'error': str(e)}, status=409)
+    return response.text(format_collapsed(stacks))
 
 # pylint: disable=no-value-for-parameter, too-many-locals, too-many-branches, too-many-statements
 
 
 async def fetch_ws(http_request: HTTPRequest,
-                   jrpc_request: SingleJrpcRequest) -> SingleJrpcResponse:
+                   jrpc_request: SingleJrpcRequest) -> bytes:
     jrpc_request.timings.append((perf(), 'fetch_ws.enter'))
     pools = http_request.app.config.websocket_pools
     pool = pools[jrpc_request.upstream.url]
     upstream_request = jrpc_request.to_upstream_request()
+    conn = await pool.acquire()
+    jrpc_request.timings.append((perf(), 'fetch_ws.acquire'))
     try:
-        conn = await pool.acquire()
-        jrpc_request.timings.append((perf(), 'fetch_ws.acquire'))
         await conn.send(upstream_request)
         jrpc_request.timings.append((perf(), 'fetch_ws.send'))
         upstream_response_json = await conn.recv()
         jrpc_request.timings.append((perf(), 'fetch_ws.response'))
-        upstream_response = loads(upstream_response_json)
-        await pool.release(conn)
-        assert int(upstream_response.get('id')) == jrpc_request.upstream_id
-        # JSON-RPC requests without "id" (notifications) store _empty as the id,
-        # which ujson cannot serialize. Convert to None (-> null in JSON).
-        upstream_response['id'] = jrpc_request.id if jrpc_request.id is not _empty else None
-        jrpc_request.timings.append((perf(), 'fetch_ws.exit'))
-        return upstream_response
-
+    except asyncio.CancelledError:
+        # the request timed out or the client went away. The connection is
+        # still fine once the response to this request, which may have been
+        # sent even if send() was cancelled, is out of the way
+        pool.drain(conn, jrpc_request.upstream_id)
+        raise
     except Exception as e:
         try:
             conn.terminate()
-        except NameError:
-            pass
         except Exception as e:
             logger.error('error while closing connection', e=e)
         raise e
+    await pool.release(conn)
+    # swap the upstream id for the request's id without decoding the
+    # response, JSON-RPC notifications (no "id") get a null id
+    upstream_response = rewrite_id(upstream_response_json,
+                                   jrpc_request.id,
+                                   upstream_id=jrpc_request.upstream_id)
+    jrpc_request.timings.append((perf(), 'fetch_ws.exit'))
+    return upstream_response
 
 # pylint: enable=no-value-for-parameter, too-many-locals, too-many-branches, too-many-statements
 
 
 async def fetch_http(http_request: HTTPRequest,
-                     jrpc_request: SingleJrpcRequest) -> SingleJrpcResponse:
+                     jrpc_request: SingleJrpcRequest,
+                     allow_streaming: bool=False) -> bytes:
     jrpc_request.timings.append((perf(), 'fetch_http.enter'))
-    session = http_request.app.config.aiohttp['session']
+    aio = http_request.app.config.aiohttp
+    url = jrpc_request.upstream.url
+    session = aio['sessions'].get(url) or aio['session']
     upstream_request = jrpc_request.to_upstream_request(as_json=False)
 
-    async with session.post(jrpc_request.upstream.url,
-                            json=upstream_request,
-                            headers=jrpc_request.upstream_headers) as resp:
+    batcher = aio['batchers'].get(url)
+    if batcher is not None and jrpc_request.upstream.ttl != TTL.NO_CACHE:
+        return await fetch_http_batched(http_request, jrpc_request,
+                                        batcher, upstream_request)
+
+    headers = jrpc_request.upstream_headers
+    remaining = jrpc_request.remaining
+    if remaining is not None:
+        # let the upstream know how long jussi will wait for it
+        headers['x-jussi-timeout-ms'] = str(max(int(remaining * 1000), 0))
+    resp = await session.post(aio['request_urls'].get(url, url),
+                              json=upstream_request,
+                              headers=headers)
+    try:
         jrpc_request.timings.append((perf(), 'fetch_http.response'))
-        resp_body = await resp.text()
+        if allow_streaming and is_streamable_response(http_request, jrpc_request, resp):
+            streaming_response = await stream_upstream_response(http_request,
+                                                                jrpc_request,
+                                                                resp)
+            # the streaming response now owns resp and releases it when done
+            resp = None
+            return streaming_response
+        resp_body = await resp.read()
         if not resp_body or not resp_body.strip():
             raise UpstreamResponseError(
                 http_request=http_request,
@@ -194,7 +232,8 @@ async def fetch_http(http_request: HTTPRequest,
                 reason=f'upstream returned empty body with HTTP {resp.status}'
             )
         try:
-            upstream_response = loads(resp_body)
+            # Same as fetch_ws: swap the id without decoding the response
+            upstream_response = rewrite_id(resp_body, jrpc_request.id)
         except Exception as e:
             raise UpstreamResponseError(
                 http_request=http_request,
@@ -205,20 +244,168 @@ async def fetch_http(http_request: HTTPRequest,
             logger.warning('upstream returned non-200 status',
                            status=resp.status,
                            request_id=jrpc_request.jussi_request_id)
-    # Same as fetch_ws: convert _empty to None for JSON serialization
-    upstream_response['id'] = jrpc_request.id if jrpc_request.id is not _empty else None
+    finally:
+        if resp is not None:
+            resp.release()
     jrpc_request.timings.append((perf(), 'fetch_http.exit'))
     return upstream_response
 # pylint: enable=no-value-for-parameter
 
 
+async def fetch_http_batched(http_request: HTTPRequest,
+                             jrpc_request: SingleJrpcRequest,
+                             batcher,
+                             upstream_request: dict) -> bytes:
+    # uncacheable requests, eg broadcasts, aren't batched so a slow one
+    # can't hold up the rest of its batch
+    try:
+        resp_body = await batcher.fetch(upstream_request,
+                                        jussi_request_id=jrpc_request.jussi_request_id,
+                                        deadline=jrpc_request.deadline)
+    except ValueError as e:
+        raise UpstreamResponseError(
+            http_request=http_request,
+            jrpc_request=jrpc_request,
+            reason=f'upstream returned an invalid batch response: {e!r}'
+        )
+    jrpc_request.timings.append((perf(), 'fetch_http.batch_response'))
+    try:
+        upstream_response = rewrite_id(resp_body, jrpc_request.id)
+    except Exception as e:
+        raise UpstreamResponseError(
+            http_request=http_request,
+            jrpc_request=jrpc_request,
+            reason=f'upstream returned invalid JSON: {e!r}'
+        )
+    jrpc_request.timings.append((perf(), 'fetch_http.exit'))
+    return upstream_response
+
+
 def dispatch_single(http_request: HTTPRequest,
-                    jrpc_request) -> Coroutine:
+                    jrpc_request,
+                    allow_streaming: bool=False) -> Coroutine:
     # pylint: disable=unexpected-keyword-arg
     if jrpc_request.upstream.url.startswith('ws'):
         response = fetch_ws(http_request, jrpc_request)
     elif jrpc_request.upstream.url.startswith('http'):
-        response = fetch_http(http_request, jrpc_request)
+        response = fetch_http(http_request, jrpc_request,
+                              allow_streaming=allow_streaming)
     else:
         raise InvalidUpstreamURL(url=jrpc_request.upstream.url, reason='scheme')
+
+    limiters = getattr(http_request.app.config, 'upstream_limiters', None)
+    if limiters:
+        limiter = limiters.get(jrpc_request.upstream.url)
+        if limiter:
+            response = limiter.run(response)
+
+    scheduler = getattr(http_request.app.config, 'upstream_scheduler', None)
+    if scheduler:
+        priority = http_request.app.config.upstreams.priority(jrpc_request.urn)
+        response = scheduler.run(priority, response)
+
+    if jrpc_request.deadline is not None:
+        response = run_until_deadline(jrpc_request, response)
     return response
+
+
+async def dispatch_batch(http_request: HTTPRequest) -> List[bytes]:
+    """dispatch the requests of a batch, fetching identical cacheable
+    requests only once and merging vector requests, eg get_accounts
+
+    Duplicates get a copy of the first request's response with their own id.
+    Uncacheable requests, eg broadcasts, are always dispatched.
+    """
+    jrpc_requests = []
+    # index in jrpc_requests of the request answering each batch item
+    sources = []
+    # urn -> index in jrpc_requests
+    unique = dict()
+    for jrpc_request in http_request.jsonrpc:
+        if jrpc_request.upstream.ttl != TTL.NO_CACHE:
+            source = unique.get(jrpc_request.urn)
+            if source is not None:
+                sources.append(source)
+                continue
+            unique[jrpc_request.urn] = len(jrpc_requests)
+        sources.append(len(jrpc_requests))
+        jrpc_requests.append(jrpc_request)
+
+    groups = group_vector_requests(jrpc_requests)
+    coros = []
+    for group in groups:
+        if len(group) == 1:
+            coros.append(dispatch_single(http_request, jrpc_requests[group[0]]))
+        else:
+            coros.append(dispatch_merged(http_request,
+                                         [jrpc_requests[i] for i in group]))
+    responses = [None] * len(jrpc_requests)
+    for group, group_responses in zip(groups, await gather_or_cancel(coros)):
+        if len(group) == 1:
+            responses[group[0]] = group_responses
+        else:
+            for i, group_response in zip(group, group_responses):
+                responses[i] = group_response
+
+    if len(responses) == len(sources):
+        return responses
+    batch_responses = []
+    dispatched = set()
+    for jrpc_request, source in zip(http_request.jsonrpc, sources):
+        if source in dispatched:
+            batch_responses.append(rewrite_id(responses[source], jrpc_request.id))
+        else:
+            dispatched.add(source)
+            batch_responses.append(responses[source])
+    return batch_responses
+
+
+async def dispatch_merged(http_request: HTTPRequest,
+                          jrpc_requests: List[SingleJrpcRequest]) -> List[bytes]:
+    """fetch vector requests as one upstream call, see jussi.merge"""
+    merged_request = merge_requests(jrpc_requests)
+    merged_response = await dispatch_single(http_request, merged_request)
+    try:
+        return split_response(merged_request, jrpc_requests, merged_response)
+    except Exception as e:
+        raise UpstreamResponseError(
+            http_request=http_request,
+            jrpc_request=merged_request,
+            reason=f'unable to split merged response: {e!r}'
+        )
+
+
+async def run_until_deadline(jrpc_request: SingleJrpcRequest, coro: Coroutine):
+    """await ``coro``, raising asyncio.TimeoutError once the request's
+    deadline has passed, including time spent queued for an upstream
+    """
+    remaining = jrpc_request.remaining
+    if remaining <= 0:
+        coro.close()
+        jrpc_request.timings.append((perf(), 'run_until_deadline.expired'))
+        raise asyncio.TimeoutError()
+    async with timeout(remaining):
+        return await coro
+
+
+async def gather_or_cancel(coros: List[Coroutine]) -> list:
+    """like asyncio.gather, but once any batch item fails, eg by missing its
+    deadline, the batch can't succeed so the items still in flight are
+    cancelled instead of occupying upstream connections
+    """
+    futures = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        done, pending = await asyncio.wait(futures,
+                                           return_when=asyncio.FIRST_EXCEPTION)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    for future in pending:
+        future.cancel()
+    errors = [future.exception() for future in futures
+              if future in done and not future.cancelled()
+              and future.exception() is not None]
+    if errors:
+        raise errors[0]
+    return [future.result() for future in futures]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""JSON codec used for everything jussi parses and serializes
+
+The engine is selected once at startup with ``set_engine`` (see
+``--json_engine``). Use the module's functions through the module, eg
+``json.loads(...)`` after ``from jussi import json``, so the selected
+engine is used instead of the one bound at import time.
+
+- ``loads`` accepts ``bytes`` or ``str``, decoding bytes without first
+  decoding them to ``str`` when the engine supports it
+- ``dumps`` returns ``str``
+- ``dumps_bytes`` returns UTF-8 ``bytes``, without an intermediate ``str``
+  when the engine supports it
+
+Serialized output is compact and non-ASCII characters aren't escaped.
+Engines differ in details such as whether "/" is escaped, so URN cache keys
+containing "/" change when the engine changes.
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+from typing import Union
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_ENGINE = 'ujson'
+
+Codec = Tuple[Callable[[Union[bytes, str]], Any],
+              Callable[[Any], str],
+              Callable[[Any], bytes]]
+
+
+def _ujson() -> Codec:
+    import ujson
+
+    def dumps(obj) -> str:
+        return ujson.dumps(obj, ensure_ascii=False)
+
+    def dumps_bytes(obj) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False).encode()
+
+    return ujson.loads, dumps, dumps_bytes
+
+
+def _orjson() -> Codec:
+    import orjson
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    return orjson.loads, dumps, orjson.dumps
+
+
+def _rapidjson() -> Codec:
+    import rapidjson
+
+    def dumps(obj) -> str:
+        return rapidjson.dumps(obj, ensure_ascii=False)
+
+    def dumps_bytes(obj) -> bytes:
+        return rapidjson.dumps(obj, ensure_ascii=False).encode()
+
+    return rapidjson.loads, dumps, dumps_bytes
+
+
+def _simdjson() -> Codec:
+    # simdjson only parses, serialize with ujson
+    import simdjson
+    _, dumps, dumps_bytes = _ujson()
+    return simdjson.loads, dumps, dumps_bytes
+
+
+ENGINES = {
+    'ujson': _ujson,
+    'orjson': _orjson,
+    'rapidjson': _rapidjson,
+    'simdjson': _simdjson
+}  # type: Dict[str, Callable[[], Codec]]
+
+engine = DEFAULT_ENGINE
+loads, dumps, dumps_bytes = ENGINES[DEFAULT_ENGINE]()
+
+
+def set_engine(name: str) -> None:
+    """use the named engine, raises ImportError if it isn't installed"""
+    # pylint: disable=global-statement
+    global engine, loads, dumps, dumps_bytes
+    if name not in ENGINES:
+        raise ValueError(f'unknown json engine {name}, expected one of {sorted(ENGINES)}')
+    loads, dumps, dumps_bytes = ENGINES[name]()
+    engine = name
+    logger.info('using json engine', engine=name)
+
+
+def available_engines() -> list:
+    available = []
+    for name, codec in ENGINES.items():
+        try:
+            codec()
+        except ImportError:
+            continue
+        available.append(name)
+    return available
@@ -1,23 +1,78 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import json
+import atexit
+import functools
+import os
+import signal
+import ssl
 import sys
-from functools import partial
+from time import perf_counter as perf
+from typing import Optional
 from urllib.parse import urlparse
 
 import aiohttp
 import async_timeout
-import ujson
+import structlog
 
 from jussi.ws.pool import Pool
 
+from . import json
 from .cache import setup_caches
+from .concurrency import AIMDConcurrencyLimiter
+from .looplag import LoopLagMonitor
+from .metrics import METRICS
+from .metrics import SNAPSHOT_INTERVAL
+from .metrics import create_metrics_dir
+from .metrics import remove_metrics_dir
+from .metrics import snapshot_path
+from .microbatch import DEFAULT_MAX_SIZE as DEFAULT_MICRO_BATCH_MAX_SIZE
+from .microbatch import DEFAULT_WINDOW as DEFAULT_MICRO_BATCH_WINDOW
+from .microbatch import MicroBatcher
+from .ratelimit import RateLimiter
+from .ratelimit import RedisTokenBuckets
+from .ratelimit import SharedTokenBuckets
+from .ratelimit import parse_rate_limits
+from .runtime import RuntimeStats
+from .runtime import server_stats
+from .scheduler import PriorityScheduler
 from .typedefs import WebApp
 from .upstream import _Upstreams
+from .upstream import is_unix_socket_url
+from .upstream import parse_unix_socket_url
+from .utils import nowait_task_stats
+
+logger = structlog.get_logger(__name__)
 
 
 def setup_listeners(app: WebApp) -> WebApp:
     # pylint: disable=unused-argument, unused-variable
+    @app.listener('before_server_start')
+    def setup_readiness(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_readiness', when='before_server_start')
+        # connection warmups, awaited concurrently once the server is up
+        app.config.startup_time = perf()
+        app.config.warmups = []
+        app.config.ready = False
+        app.config.ready_after = None
+
+    @app.listener('before_server_start')
+    def setup_runtime_stats(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_runtime_stats', when='before_server_start')
+        # the subsystems set up below register their own stats, see /monitor
+        runtime_stats = app.config.runtime_stats = RuntimeStats()
+        runtime_stats.register('server', server_stats)
+        runtime_stats.register('asyncio', functools.partial(asyncio_stats, loop))
+        runtime_stats.register('post_response_tasks', nowait_task_stats)
+
+    @app.listener('before_server_start')
+    def setup_json_engine(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_json_engine', engine=app.config.args.json_engine,
+                    when='before_server_start')
+        json.set_engine(app.config.args.json_engine)
+
     @app.listener('before_server_start')
     def setup_debug(app: WebApp, loop) -> None:
         logger = app.config.logger
@@ -31,102 +86,163 @@ def setup_listeners(app: WebApp) -> WebApp:
     @app.listener('before_server_start')
     def setup_upstreams(app: WebApp, loop) -> None:
         logger = app.config.logger
-        logger.info('setup_upstreams', when='before_server_start')
+        logger.info('setup_upstreams', when='before_server_start',
+                    preloaded='upstreams' in app.config)
+        if 'upstreams' not in app.config:
+            load_upstream_config(app)
+
+    @app.listener('before_server_start')
+    def setup_upstream_limiters(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_upstream_limiters', when='before_server_start')
         args = app.config.args
-        upstream_config_file = args.upstream_config_file
-        with open(upstream_config_file) as f:
-            upstream_config = json.load(f)
-        try:
-            app.config.upstreams = _Upstreams(upstream_config,
-                                              validate=args.test_upstream_urls)
-        except Exception as e:
-            logger.error('Bad upstream in config', e=e)
-            sys.exit(127)
+        limiters = dict()
+        if args.upstream_concurrency_limit:
+            for url in app.config.upstreams.urls:
+                limiters[url] = make_upstream_limiter(url, args, loop)
+        app.config.upstream_limiters = limiters
+        app.config.runtime_stats.register(
+            'upstream_limits', functools.partial(upstream_limiter_stats, app))
+
+    @app.listener('before_server_start')
+    def setup_upstream_scheduler(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_upstream_scheduler', when='before_server_start')
+        args = app.config.args
+        app.config.upstream_scheduler = make_upstream_scheduler(
+            app.config.upstreams, args, loop)
+        app.config.runtime_stats.register(
+            'upstream_scheduler', functools.partial(upstream_scheduler_stats, app))
 
     @app.listener('before_server_start')
     def setup_aiohttp_session(app: WebApp, loop) -> None:
-        """use one session for http connection pooling
+        """use one session per http upstream url for connection pooling
         """
         logger = app.config.logger
         logger.info('setup_aiohttp_session', when='before_server_start')
-        tcp_connector = aiohttp.TCPConnector()
-
-        aio = dict(session=aiohttp.ClientSession(
-            connector=tcp_connector,
-            skip_auto_headers=['User-Agent'],
-            loop=loop,
-            json_serialize=partial(ujson.dumps, ensure_ascii=False),
-            headers={'Content-Type': 'application/json'}))
+        args = app.config.args
+        upstreams = app.config.upstreams
+
+        # share one ssl context so certificates are loaded once per worker
+        ssl_context = ssl.create_default_context()
+        sessions = dict()
+        # http+unix urls are requested as http://localhost/... over the socket
+        request_urls = dict()
+        batchers = dict()
+        prewarm = []
+        for url in upstreams.urls:
+            if not url.startswith('http'):
+                continue
+            session, request_url, batcher, warmups = make_http_session(
+                url, upstreams, args, loop, ssl_context)
+            sessions[url] = session
+            if request_url is not None:
+                request_urls[url] = request_url
+            if batcher is not None:
+                batchers[url] = batcher
+            prewarm.extend(warmups)
+
+        # fallback for urls not listed in the upstream config,
+        # eg, JUSSI_ACCOUNT_TRANSFER_STEEMD_URL
+        aio = dict(session=make_client_session(aiohttp.TCPConnector(loop=loop), loop),
+                   sessions=sessions,
+                   request_urls=request_urls,
+                   batchers=batchers)
         app.config.aiohttp = aio
+        app.config.warmups.extend(prewarm)
+        app.config.runtime_stats.register('http_pools', functools.partial(http_pool_stats, app))
+        app.config.runtime_stats.register('micro_batches',
+                                          functools.partial(micro_batch_stats, app))
 
     @app.listener('before_server_start')
-    async def setup_websocket_connection_pools(app: WebApp, loop) -> None:
+    def setup_websocket_connection_pools(app: WebApp, loop) -> None:
         logger = app.config.logger
         logger.info('setup_websocket_connection_pools', when='before_server_start')
         args = app.config.args
         upstream_urls = app.config.upstreams.urls
 
         pools = dict()
-        ws_connect_kwargs = dict(
-            max_queue=args.websocket_queue_size,
-            max_size=args.websocket_max_msg_size,
-            read_limit=args.websocket_read_limit,
-            write_limit=args.websocket_write_limit
-        )
         for url in upstream_urls:
             if url.startswith('ws'):
-                logger.info('creating websocket pool',
-                            pool_min_size=args.websocket_pool_minsize,
-                            pool_maxsize=args.websocket_pool_maxsize,
-                            max_queries_per_conn=0,
-                            url=url,
-                            **ws_connect_kwargs
-                            )
-                pools[url] = await Pool(
-                    args.websocket_pool_minsize,  # minsize of pool
-                    args.websocket_pool_maxsize,  # maxsize of pool
-                    0,  # max queries per conn (0 means unlimited)
-                    loop,  # event_loop
-                    url,  # connection url
-                    # all kwargs are passed to websocket connection
-                    **ws_connect_kwargs
-                )
+                # connections are opened while the server starts
+                pools[url] = start_websocket_pool(url, args, loop)
+                app.config.warmups.append(pools[url].wait_connected())
 
-        # pylint: disable=protected-access
         app.config.websocket_pools = pools
+        app.config.runtime_stats.register('ws_pools', functools.partial(websocket_pool_stats, app))
+
+    @app.listener('before_server_start')
+    def setup_upstream_reload(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_upstream_reload',
+                    reload_route=app.config.args.upstream_reload_route,
+                    when='before_server_start')
+        from .reload import on_reload_signal
+        try:
+            loop.add_signal_handler(signal.SIGHUP, on_reload_signal, app, loop)
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning('unable to reload upstreams on SIGHUP', e=e)
+        if app.config.args.upstream_reload_route is True:
+            from jussi.handlers import reload_upstream_config
+            app.add_route(reload_upstream_config, '/admin/reload', methods=['POST'])
 
     @app.listener('before_server_start')
-    async def setup_caching(app: WebApp, loop) -> None:
+    def setup_profiler(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_profiler', profiler_route=app.config.args.profiler_route,
+                    when='before_server_start')
+        if app.config.args.profiler_route is True:
+            from .profiler import Profiler
+            from jussi.handlers import profile
+            profiler = app.config.profiler = Profiler(loop, app.config.get('metrics_dir'))
+            if profiler.profile_dir is not None:
+                try:
+                    loop.add_signal_handler(signal.SIGUSR2, profiler.on_profile_signal)
+                except (NotImplementedError, RuntimeError) as e:
+                    logger.warning('unable to profile on SIGUSR2', e=e)
+            app.add_route(profile, '/admin/profile', methods=['GET'])
+
+    @app.listener('before_server_start')
+    def setup_caching(app: WebApp, loop) -> None:
         logger = app.config.logger
         logger.info('setup_caching', when='before_server_start')
         args = app.config.args
         cache_group = setup_caches(app, loop)
         app.config.cache_group = cache_group
+        app.config.runtime_stats.register('cache', cache_group.stats)
         app.config.last_irreversible_block_num = 20_000_000
-        try:
-            lirb = await cache_group.get('last_irreversible_block_num')
-            if lirb is not None:
-                app.config.last_irreversible_block_num = lirb
-        except Exception as e:
-            logger.exception('setup_caching error', e=e)
-        logger.info('setup_caching',
-                    lirb=app.config.last_irreversible_block_num)
+        # also opens the first redis connection
+        app.config.warmups.append(read_last_irreversible_block_num(app))
         app.config.cache_read_timeout = args.cache_read_timeout
 
     @app.listener('before_server_start')
-    async def setup_limits(app: WebApp, loop) -> None:
+    def setup_limits(app: WebApp, loop) -> None:
         logger = app.config.logger
         logger.info('setup_limits', when='before_server_start')
         args = app.config.args
-        config_file = args.upstream_config_file
-        with open(config_file) as f:
-            config = json.load(f)
+        config = app.config.upstream_config
         app.config.limits = config.get('limits', {'accounts_blacklist': set(), 'account_history_limit': 100})
 
         app.config.jsonrpc_batch_size_limit = args.jsonrpc_batch_size_limit
 
     @app.listener('before_server_start')
-    async def setup_statsd(app: WebApp, loop) -> None:
+    def setup_rate_limits(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_rate_limits', when='before_server_start')
+        args = app.config.args
+        if 'rate_limit_buckets' not in app.config:
+            create_rate_limit_buckets(app)
+        app.config.rate_limit_redis = None
+        if args.rate_limit_redis_url:
+            app.config.rate_limit_redis = RedisTokenBuckets(args.rate_limit_redis_url)
+        app.config.rate_limiter = make_rate_limiter(
+            parse_rate_limits(app.config.limits.get('rate_limits')),
+            app.config.rate_limit_buckets,
+            app.config.rate_limit_redis)
+        app.config.runtime_stats.register('rate_limits', functools.partial(rate_limit_stats, app))
+
+    @app.listener('before_server_start')
+    def setup_statsd(app: WebApp, loop) -> None:
         logger = app.config.logger
         logger.info('setup_statsd', when='before_server_start')
         args = app.config.args
@@ -135,16 +251,75 @@ def setup_listeners(app: WebApp) -> WebApp:
             url = urlparse(args.statsd_url)
             port = url.port or 8125
             from .async_stats import AsyncStatsClient
-            app.config.statsd_client = AsyncStatsClient(host=url.hostname,
-                                                        port=port,
-                                                        prefix='jussi')
-            await app.config.statsd_client.init()
+            app.config.statsd_client = AsyncStatsClient(
+                host=url.hostname,
+                port=port,
+                prefix='jussi',
+                loop=loop,
+                flush_interval=args.statsd_flush_interval,
+                sample_rates=args.statsd_sample_rates)
+            # read once per flush rather than on every response
+            app.config.statsd_client.gauge_callback(
+                'tasks', lambda: len(asyncio.Task.all_tasks(loop=loop)))
+            app.config.warmups.append(app.config.statsd_client.init())
             logger.info('setup_statsd',
                         statsd_hostname=url.hostname,
                         statsd_port=port,
                         prefix='jussi',
+                        flush_interval=args.statsd_flush_interval,
+                        sample_rates=args.statsd_sample_rates,
                         client=app.config.statsd_client)
 
+    @app.listener('before_server_start')
+    def setup_metrics(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('setup_metrics', metrics_dir=app.config.get('metrics_dir'),
+                    when='before_server_start')
+        METRICS.clear()
+
+    @app.listener('after_server_start')
+    def start_metrics_snapshots(app: WebApp, loop) -> None:
+        app.config.metrics_task = None
+        if app.config.get('metrics_dir'):
+            app.config.metrics_task = asyncio.ensure_future(
+                write_metrics_snapshots(app.config.metrics_dir, SNAPSHOT_INTERVAL, loop),
+                loop=loop)
+
+    @app.listener('before_server_stop')
+    def stop_metrics_snapshots(app: WebApp, loop) -> None:
+        if app.config.metrics_task is not None:
+            app.config.metrics_task.cancel()
+            write_metrics_snapshot(app.config.metrics_dir)
+
+    @app.listener('after_server_start')
+    def start_loop_lag_monitor(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        args = app.config.args
+        logger.info('start_loop_lag_monitor', interval=args.loop_lag_interval,
+                    threshold=args.loop_lag_threshold, when='after_server_start')
+        app.config.loop_lag_monitor = None
+        if args.loop_lag_interval:
+            monitor = app.config.loop_lag_monitor = LoopLagMonitor(
+                loop, interval=args.loop_lag_interval, threshold=args.loop_lag_threshold)
+            monitor.start()
+            app.config.runtime_stats.register('loop_lag', monitor.stats)
+
+    @app.listener('before_server_stop')
+    def stop_loop_lag_monitor(app: WebApp, loop) -> None:
+        if app.config.loop_lag_monitor is not None:
+            app.config.loop_lag_monitor.stop()
+
+    @app.listener('after_server_start')
+    def start_warmups(app: WebApp, loop) -> None:
+        logger = app.config.logger
+        logger.info('start_warmups', warmups=len(app.config.warmups),
+                    when='after_server_start')
+        app.config.warmup_task = asyncio.ensure_future(warm_up(app), loop=loop)
+
+    @app.listener('before_server_stop')
+    def cancel_warmups(app: WebApp, loop) -> None:
+        app.config.warmup_task.cancel()
+
     @app.listener('after_server_stop')
     async def close_websocket_connection_pools(app: WebApp, loop) -> None:
         logger = app.config.logger
@@ -158,8 +333,22 @@ def setup_listeners(app: WebApp) -> WebApp:
     async def close_aiohttp_session(app: WebApp, loop) -> None:
         logger = app.config.logger
         logger.info('close_aiohttp_session', when='after_server_stop')
-        session = app.config.aiohttp['session']
-        await session.close()
+        aio = app.config.aiohttp
+        for batcher in aio['batchers'].values():
+            batcher.close()
+        for session in aio['sessions'].values():
+            await session.close()
+        await aio['session'].close()
+
+    @app.listener('after_server_stop')
+    async def close_statsd(app: WebApp, loop) -> None:
+        if app.config.statsd_client is not None:
+            app.config.statsd_client.close()
+
+    @app.listener('after_server_stop')
+    async def close_rate_limit_redis(app: WebApp, loop) -> None:
+        if app.config.rate_limit_redis is not None:
+            await app.config.rate_limit_redis.close()
 
     @app.listener('after_server_stop')
     async def shutdown_caching(app: WebApp, loop) -> None:
@@ -169,3 +358,272 @@ def setup_listeners(app: WebApp) -> WebApp:
         await cache_group.close()
 
     return app
+
+
+def load_upstream_config(app: WebApp) -> None:
+    """parse the upstream config file and build the routing tables
+
+    Called in the main process before the workers are forked, so they share
+    the result, and by setup_upstreams otherwise
+    """
+    args = app.config.args
+    with open(args.upstream_config_file) as f:
+        upstream_config = json.loads(f.read())
+    try:
+        upstreams = _Upstreams(upstream_config, validate=args.test_upstream_urls)
+        parse_rate_limits(upstream_config.get('limits', {}).get('rate_limits'))
+    except Exception as e:
+        logger.error('Bad upstream in config', e=e)
+        sys.exit(127)
+    app.config.upstream_config = upstream_config
+    app.config.upstreams = upstreams
+
+
+def create_rate_limit_buckets(app: WebApp) -> None:
+    """called in the main process before the workers are forked, so they
+    share the buckets, and by setup_rate_limits otherwise"""
+    app.config.rate_limit_buckets = SharedTokenBuckets(app.config.args.rate_limit_slots)
+
+
+# runtime stats providers, see jussi.runtime
+
+
+def asyncio_stats(loop) -> dict:
+    return {'tasks': len(asyncio.Task.all_tasks(loop=loop))}
+
+
+def upstream_limiter_stats(app: WebApp) -> list:
+    return [limiter.stats() for limiter in app.config.upstream_limiters.values()]
+
+
+def upstream_scheduler_stats(app: WebApp) -> Optional[dict]:
+    scheduler = app.config.upstream_scheduler
+    return scheduler.stats() if scheduler else None
+
+
+def http_pool_stats(app: WebApp) -> list:
+    # pylint: disable=protected-access
+    # aiohttp connectors have no public stats
+    stats = []
+    for url, session in app.config.aiohttp['sessions'].items():
+        connector = session.connector
+        stats.append({
+            'url': url,
+            'limit': connector.limit,
+            'acquired': len(connector._acquired),
+            'idle': sum(len(conns) for conns in connector._conns.values()),
+            'waiting': sum(len(waiters) for waiters in connector._waiters.values())
+        })
+    return stats
+
+
+def micro_batch_stats(app: WebApp) -> list:
+    return [batcher.stats() for batcher in app.config.aiohttp['batchers'].values()]
+
+
+def websocket_pool_stats(app: WebApp) -> list:
+    stats = []
+    for url, pool in app.config.websocket_pools.items():
+        pool_stats = pool.stats()
+        pool_stats['url'] = url
+        stats.append(pool_stats)
+    return stats
+
+
+def rate_limit_stats(app: WebApp) -> Optional[dict]:
+    rate_limiter = app.config.rate_limiter
+    return rate_limiter.stats() if rate_limiter else None
+
+
+def setup_metrics_dir(app: WebApp) -> None:
+    """called in the main process before several workers are forked, they
+    write snapshots of their metrics to the directory for /metrics to merge,
+    and profiles for /admin/profile?workers=all"""
+    if app.config.args.server_workers > 1:
+        app.config.metrics_dir = create_metrics_dir()
+        atexit.register(remove_metrics_dir, app.config.metrics_dir)
+
+
+async def write_metrics_snapshots(metrics_dir: str, interval: float, loop) -> None:
+    while True:
+        await asyncio.sleep(interval, loop=loop)
+        write_metrics_snapshot(metrics_dir)
+
+
+def write_metrics_snapshot(metrics_dir: str) -> None:
+    try:
+        METRICS.write_snapshot(snapshot_path(metrics_dir, os.getpid()))
+    except Exception as e:
+        logger.error('error writing metrics snapshot', e=e)
+
+
+def make_rate_limiter(rules, buckets, redis_buckets=None):
+    if not rules:
+        return None
+    logger.info('creating rate limiter', rules=rules, redis=redis_buckets is not None)
+    return RateLimiter(rules, buckets, redis_buckets)
+
+
+async def warm_up(app: WebApp) -> None:
+    """run the startup warmups concurrently, then mark the worker ready.
+    Warmups still running after warmup_timeout are given up on, a down
+    upstream doesn't keep the worker out of rotation"""
+    timeout = app.config.args.warmup_timeout
+    results = await asyncio.gather(
+        *[asyncio.wait_for(warmup, timeout) for warmup in app.config.warmups],
+        return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error('warmup failed', e=result)
+    app.config.warmups = []
+    app.config.ready = True
+    app.config.ready_after = perf() - app.config.startup_time
+    logger.info('ready', ready_after=app.config.ready_after)
+
+
+async def read_last_irreversible_block_num(app: WebApp) -> None:
+    try:
+        lirb = await app.config.cache_group.get('last_irreversible_block_num')
+        if lirb is not None:
+            app.config.last_irreversible_block_num = lirb
+    except Exception as e:
+        logger.exception('setup_caching error', e=e)
+    logger.info('setup_caching', lirb=app.config.last_irreversible_block_num)
+
+
+async def prewarm_http_session(session, url: str) -> None:
+    """open an idle keep-alive connection to url before serving requests"""
+    try:
+        async with session.head(url) as resp:
+            await resp.release()
+    except Exception as e:
+        logger.info('unable to prewarm http connection', url=url, e=e)
+
+
+def make_client_session(connector, loop) -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=connector,
+        skip_auto_headers=['User-Agent'],
+        loop=loop,
+        json_serialize=json.dumps,
+        headers={'Content-Type': 'application/json'})
+
+
+def http_pool_config(url: str, upstreams: _Upstreams, args) -> dict:
+    """connection pool settings for an http upstream url, the
+    JUSSI_HTTP_POOL_* defaults updated by the upstream's "http_pool" """
+    pool_config = dict(limit=args.http_pool_limit,
+                       keepalive_timeout=args.http_pool_keepalive_timeout,
+                       dns_cache_ttl=args.http_pool_dns_cache_ttl,
+                       prewarm=args.http_pool_prewarm)
+    pool_config.update(upstreams.http_pool(url))
+    return pool_config
+
+
+def make_http_session(url: str, upstreams: _Upstreams, args, loop, ssl_context):
+    """session, request url (None unless url is http+unix), micro batcher
+    (or None) and prewarm coroutines for an http upstream url"""
+    pool_config = http_pool_config(url, upstreams, args)
+    logger.info('creating http connection pool', url=url, **pool_config)
+    request_url = None
+    if is_unix_socket_url(url):
+        socket_path, request_url = parse_unix_socket_url(url)
+        connector = aiohttp.UnixConnector(
+            path=socket_path,
+            limit=pool_config['limit'],
+            keepalive_timeout=pool_config['keepalive_timeout'],
+            loop=loop)
+    else:
+        connector = aiohttp.TCPConnector(
+            limit=pool_config['limit'],
+            keepalive_timeout=pool_config['keepalive_timeout'],
+            use_dns_cache=pool_config['dns_cache_ttl'] > 0,
+            ttl_dns_cache=pool_config['dns_cache_ttl'] or None,
+            ssl=ssl_context if url.startswith('https') else None,
+            loop=loop)
+    session = make_client_session(connector, loop)
+    batcher = make_micro_batcher(url, upstreams, session, request_url, loop)
+    prewarm = [prewarm_http_session(session, request_url or url)
+               for _ in range(pool_config['prewarm'])]
+    return session, request_url, batcher, prewarm
+
+
+def make_micro_batcher(url: str, upstreams: _Upstreams, session,
+                       request_url: str, loop):
+    micro_batch = upstreams.micro_batch(url)
+    if not micro_batch:
+        return None
+    logger.info('creating micro batcher', url=url, **micro_batch)
+    return MicroBatcher(
+        url,
+        session,
+        request_url=request_url,
+        window=micro_batch.get('window_ms',
+                               DEFAULT_MICRO_BATCH_WINDOW * 1000) / 1000,
+        max_size=micro_batch.get('max_size', DEFAULT_MICRO_BATCH_MAX_SIZE),
+        loop=loop)
+
+
+async def make_websocket_pool(url: str, args, loop) -> Pool:
+    """a websocket pool with its minsize connections open"""
+    return await new_websocket_pool(url, args, loop)
+
+
+def start_websocket_pool(url: str, args, loop) -> Pool:
+    """a websocket pool opening its minsize connections in the background"""
+    pool = new_websocket_pool(url, args, loop)
+    pool.start()
+    return pool
+
+
+def new_websocket_pool(url: str, args, loop) -> Pool:
+    ws_connect_kwargs = dict(
+        max_queue=args.websocket_queue_size,
+        max_size=args.websocket_max_msg_size,
+        read_limit=args.websocket_read_limit,
+        write_limit=args.websocket_write_limit
+    )
+    logger.info('creating websocket pool',
+                pool_min_size=args.websocket_pool_minsize,
+                pool_maxsize=args.websocket_pool_maxsize,
+                max_queries_per_conn=0,
+                idle_timeout=args.websocket_pool_idle_timeout,
+                ping_interval=args.websocket_pool_ping_interval,
+                url=url,
+                **ws_connect_kwargs
+                )
+    return Pool(
+        args.websocket_pool_minsize,  # minsize of pool
+        args.websocket_pool_maxsize,  # maxsize of pool
+        0,  # max queries per conn (0 means unlimited)
+        loop,  # event_loop
+        url,  # connection url
+        pool_idle_timeout=args.websocket_pool_idle_timeout,
+        pool_ping_interval=args.websocket_pool_ping_interval,
+        pool_ping_timeout=args.websocket_pool_ping_timeout,
+        pool_grow_wait=args.websocket_pool_grow_wait,
+        pool_drain_timeout=args.websocket_pool_drain_timeout,
+        # all kwargs are passed to websocket connection
+        **ws_connect_kwargs
+    )
+
+
+def make_upstream_limiter(url: str, args, loop) -> AIMDConcurrencyLimiter:
+    return AIMDConcurrencyLimiter(
+        url,
+        initial_limit=args.upstream_concurrency_initial_limit,
+        min_limit=args.upstream_concurrency_min_limit,
+        max_limit=args.upstream_concurrency_max_limit,
+        max_queue_size=args.upstream_concurrency_queue_size,
+        latency_tolerance=args.upstream_concurrency_latency_tolerance,
+        loop=loop)
+
+
+def make_upstream_scheduler(upstreams: _Upstreams, args, loop):
+    if not args.upstream_scheduler:
+        return None
+    return PriorityScheduler(
+        upstreams.priority_classes,
+        concurrency=args.upstream_scheduler_concurrency,
+        max_queue_size=args.upstream_scheduler_queue_size,
+        loop=loop)
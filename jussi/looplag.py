@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+from typing import Tuple
+
+import structlog
+
+from .metrics import LOOP_LAG
+from .metrics import LOOP_STALLS
+from .metrics import METRICS
+from .request.http import HTTPRequest
+from .request.jsonrpc import JSONRPCRequest
+from .urn import method_name
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Event loop lag
+#
+# A sampler task sleeps for interval and records how late it wakes up, the
+# time the loop spent running other callbacks, into a histogram. Each wake up
+# is also a heartbeat for a watchdog thread: when the loop hasn't beaten for
+# threshold past its interval, the loop is stuck in a callback, and the
+# watchdog logs the loop thread's stack, with the id of the request found in
+# its frames, once per stall. Only the loop's thread records metrics, the lag
+# histogram is the worker's jussi_event_loop_lag_seconds series.
+# -------------------
+
+DEFAULT_INTERVAL = 0.1
+DEFAULT_THRESHOLD = 0.25
+STACK_LIMIT = 40
+
+
+class LoopLagMonitor:
+    """Samples the event loop's scheduling delay, and captures the stack of
+    callbacks blocking it for longer than threshold"""
+
+    def __init__(self, loop, interval: float=DEFAULT_INTERVAL,
+                 threshold: float=DEFAULT_THRESHOLD) -> None:
+        if interval <= 0 or threshold <= 0:
+            raise ValueError('interval and threshold are expected to be greater than zero')
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = METRICS.histogram((LOOP_LAG,))
+        self.lag_max = 0.0
+        self.stalls = 0
+        self.last_stall = None  # type: Optional[dict]
+        self._loop = loop
+        self._loop_thread_id = None  # type: Optional[int]
+        self._beat = time.monotonic()
+        self._captured_beat = None  # type: Optional[float]
+        self._task = None
+        self._watchdog = None  # type: Optional[threading.Thread]
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """start sampling, called from the loop's thread"""
+        self._loop_thread_id = threading.get_ident()
+        # METRICS.clear() drops the series the monitor was created with
+        self.lag = METRICS.histogram((LOOP_LAG,))
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._sample(), loop=self._loop)
+        self._watchdog = threading.Thread(target=self._watch, name='jussi-loop-watchdog',
+                                          daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self) -> None:
+        interval = self.interval
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval, loop=self._loop)
+            self._beat = now = time.monotonic()
+            self.record(max(0.0, now - start - interval))
+
+    def record(self, lag: float) -> None:
+        self.lag.observe(lag)
+        if lag > self.lag_max:
+            self.lag_max = lag
+        if lag >= self.threshold:
+            self.stalls += 1
+            METRICS.incr((LOOP_STALLS,))
+            logger.warning('event loop lag', lag=round(lag, 6), threshold=self.threshold)
+
+    def _watch(self) -> None:
+        # the heartbeat is late by interval when the loop is idle
+        limit = self.interval + self.threshold
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked >= limit and beat != self._captured_beat:
+                self._captured_beat = beat
+                self.capture(blocked)
+
+    def capture(self, blocked: float) -> None:
+        """log the stack of the loop's thread, blocked for blocked seconds"""
+        frame = sys._current_frames().get(self._loop_thread_id)  # pylint: disable=protected-access
+        if frame is None:
+            return
+        request_id, method = find_request(frame)
+        stack = ''.join(traceback.format_stack(frame, limit=STACK_LIMIT))
+        # replaced, not updated, the loop's thread may be reading it
+        self.last_stall = {
+            'time': time.time(),
+            'blocked': round(blocked, 6),
+            'request_id': request_id,
+            'method': method,
+            'stack': stack
+        }
+        logger.error('event loop blocked', blocked=round(blocked, 6),
+                     request_id=request_id, method=method, stack=stack)
+
+    def stats(self) -> dict:
+        return {
+            'interval': self.interval,
+            'threshold': self.threshold,
+            'lag': self.lag.to_dict(),
+            'lag_p99': self.lag.quantile(0.99),
+            'lag_max': self.lag_max,
+            'stalls': self.stalls,
+            'last_stall': self.last_stall
+        }
+
+
+def find_request(frame) -> Tuple[Optional[str], Optional[str]]:
+    """(request id, JSON-RPC method) of the innermost request in the locals of
+    frame and its callers"""
+    while frame is not None:
+        for value in list(frame.f_locals.values()):
+            if isinstance(value, HTTPRequest):
+                # pylint: disable=protected-access
+                if isinstance(value._parsed_jsonrpc, JSONRPCRequest):
+                    value = value._parsed_jsonrpc
+                else:
+                    return value.headers.get('x-jussi-request-id'), None
+            if isinstance(value, JSONRPCRequest):
+                return value.jussi_request_id, method_name(value.urn)
+        frame = frame.f_back
+    return None, None
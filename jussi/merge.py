@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from time import perf_counter
+from typing import List
+
+from . import json
+from .empty import _empty
+from .request.jsonrpc import JSONRPCRequest
+from .urn import URN
+
+# -------------------
+# Merging of "vector" batch items
+#
+# Some methods take a list of names and return one entry per name, eg
+# get_accounts([["alice"]]). Batch items calling the same vector method on
+# the same upstream are sent as one call with all of their names, and the
+# entries of the upstream result are handed back to the items they belong
+# to. Every item keeps its own urn, so each account's entry is still cached
+# under its own key.
+# -------------------
+
+# (api, method) -> field of a result entry holding the name it belongs to,
+# None if the result has one entry per name, in order
+VECTOR_METHODS = {
+    ('database_api', 'get_accounts'): 'name',
+    ('condenser_api', 'get_accounts'): 'name',
+    ('database_api', 'lookup_account_names'): None,
+    ('condenser_api', 'lookup_account_names'): None,
+}
+
+# max names sent upstream in one merged call
+MAX_MERGED_NAMES = 100
+
+
+def is_vector_request(jrpc_request: JSONRPCRequest) -> bool:
+    urn = jrpc_request.urn
+    if (urn.api, urn.method) not in VECTOR_METHODS:
+        return False
+    params = urn.params
+    return isinstance(params, list) and len(params) == 1 \
+        and isinstance(params[0], list) \
+        and all(isinstance(name, str) for name in params[0])
+
+
+def group_vector_requests(jrpc_requests: List[JSONRPCRequest],
+                          max_names: int=MAX_MERGED_NAMES) -> List[List[int]]:
+    """group the indexes of jrpc_requests into the calls to make upstream
+
+    Vector requests to the same upstream method share a group, as long as the
+    group has no more than max_names names, every other request is a group of
+    its own. Groups are in the order of their first request.
+    """
+    groups = []
+    # (upstream url, request method, urn method) -> (open group, names in it)
+    open_groups = dict()
+    for i, jrpc_request in enumerate(jrpc_requests):
+        if not is_vector_request(jrpc_request):
+            groups.append([i])
+            continue
+        urn = jrpc_request.urn
+        key = (jrpc_request.upstream.url, jrpc_request.method,
+               urn.namespace, urn.api, urn.method)
+        names = len(urn.params[0])
+        group, group_names = open_groups.get(key, (None, 0))
+        if group is None or group_names + names > max_names:
+            group = []
+            groups.append(group)
+            group_names = 0
+        group.append(i)
+        open_groups[key] = (group, group_names + names)
+    return groups
+
+
+def merge_requests(jrpc_requests: List[JSONRPCRequest]) -> JSONRPCRequest:
+    """a single request for the names of all jrpc_requests, which have to be
+    in the same group"""
+    first = jrpc_requests[0]
+    names = list(dict.fromkeys(name for jrpc_request in jrpc_requests
+                               for name in jrpc_request.urn.params[0]))
+    params = [names]
+    urn = URN(first.urn.namespace, first.urn.api, first.urn.method, params)
+    if first.method == 'call':
+        request_params = [first.params[0], first.params[1], params]
+    else:
+        request_params = params
+    return JSONRPCRequest(first.id,
+                          first.jsonrpc,
+                          first.method,
+                          request_params,
+                          urn,
+                          first.upstream,
+                          first.amzn_trace_id,
+                          first.jussi_request_id,
+                          first.batch_index,
+                          None,
+                          [(perf_counter(), 'merge_requests')],
+                          deadline=first.deadline)
+
+
+def split_response(merged_request: JSONRPCRequest,
+                   jrpc_requests: List[JSONRPCRequest],
+                   raw_response: bytes) -> List[bytes]:
+    """split the response to merged_request into responses to jrpc_requests
+
+    Raises ValueError if the upstream result doesn't have the expected shape
+    """
+    response = json.loads(raw_response)
+    if not isinstance(response, dict):
+        raise ValueError(f'response is a {type(response).__name__}, not an object')
+    if 'result' not in response:
+        # errors apply to every request
+        return [_response_bytes(response, jrpc_request.id) for jrpc_request in jrpc_requests]
+
+    result = response['result']
+    if not isinstance(result, list):
+        raise ValueError(f'result is a {type(result).__name__}, not a list')
+    urn = merged_request.urn
+    names = urn.params[0]
+    key = VECTOR_METHODS[(urn.api, urn.method)]
+    if key is None:
+        if len(result) != len(names):
+            raise ValueError(f'{len(result)} results for {len(names)} names')
+        entries = dict(zip(names, result))
+    else:
+        entries = {entry[key]: entry for entry in result
+                   if isinstance(entry, dict) and key in entry}
+
+    responses = []
+    for jrpc_request in jrpc_requests:
+        if key is None:
+            request_result = [entries[name] for name in jrpc_request.urn.params[0]]
+        else:
+            request_result = [entries[name] for name in jrpc_request.urn.params[0]
+                              if name in entries]
+        responses.append(_response_bytes(dict(response, result=request_result),
+                                         jrpc_request.id))
+    return responses
+
+
+def _response_bytes(response: dict, jrpc_id) -> bytes:
+    return json.dumps_bytes(dict(response, id=None if jrpc_id is _empty else jrpc_id))
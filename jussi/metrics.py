@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import shutil
+import tempfile
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import structlog
+
+from . import json
+from .histogram import Histogram
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Prometheus metrics
+#
+# Each worker records into its own METRICS, without locks or IO on the
+# request path. When there are several workers, each one writes a snapshot
+# of its metrics to a directory created by the main process before forking,
+# every SNAPSHOT_INTERVAL seconds, and /metrics merges the snapshots of the
+# other workers with the live metrics of the worker answering it.
+#
+# Series are keyed by tuples, (family, label values...), with the label
+# names of each family in FAMILIES.
+# -------------------
+
+# doubling from 100µs to ~13s
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** i for i in range(18))
+
+# histograms past this many are recorded with the method label OVERFLOW_LABEL,
+# methods are client input
+MAX_SERIES = 4096
+OVERFLOW_LABEL = 'other'
+
+SNAPSHOT_INTERVAL = 5
+
+REQUEST_DURATION = 'jussi_request_duration_seconds'
+STAGE_DURATION = 'jussi_stage_duration_seconds'
+CACHE_REQUESTS = 'jussi_cache_requests_total'
+ERRORS = 'jussi_errors_total'
+LOOP_LAG = 'jussi_event_loop_lag_seconds'
+LOOP_STALLS = 'jussi_event_loop_stalls_total'
+
+# family -> (type, label names, help)
+FAMILIES = {
+    REQUEST_DURATION: ('histogram', ('method',),
+                       'Time to respond to a request, by JSON-RPC method, "batch" for batches'),
+    STAGE_DURATION: ('histogram', ('method', 'stage'),
+                     'Time from the previous timing of a request to this stage'),
+    CACHE_REQUESTS: ('counter', ('tier', 'result'),
+                     'Cached JSON-RPC response lookups by cache tier'),
+    ERRORS: ('counter', ('code',),
+             'JSON-RPC error responses by code, 1000 to 1160 are upstream errors and timeouts'),
+    LOOP_LAG: ('histogram', (), 'Delay of the event loop running a callback past its scheduled time'),
+    LOOP_STALLS: ('counter', (), 'Times the event loop was blocked past the loop lag threshold'),
+}
+
+SeriesKey = Tuple[str, ...]
+
+
+class Metrics:
+    """Histograms and counters of one process
+
+    Histograms are jussi.histogram.Histogram, all with the same bounds, so
+    the snapshots of the workers can be summed.
+    """
+
+    def __init__(self, bounds: Tuple[float, ...]=LATENCY_BUCKETS,
+                 max_series: int=MAX_SERIES) -> None:
+        if list(bounds) != sorted(bounds):
+            raise ValueError('histogram bounds are expected to be sorted')
+        self.bounds = tuple(bounds)
+        self.max_series = max_series
+        self.histograms = dict()  # type: Dict[SeriesKey, Histogram]
+        self.counters = dict()  # type: Dict[SeriesKey, int]
+
+    def observe(self, key: SeriesKey, value: float) -> None:
+        (self.histograms.get(key) or self._new_histogram(key)).observe(value)
+
+    def histogram(self, key: SeriesKey) -> Histogram:
+        """the histogram of key, for a caller also reading it, eg for /monitor"""
+        return self.histograms.get(key) or self._new_histogram(key)
+
+    def _new_histogram(self, key: SeriesKey) -> Histogram:
+        # series without labels are bounded already
+        if len(self.histograms) >= self.max_series and len(key) > 1:
+            key = key[:1] + (OVERFLOW_LABEL,) + key[2:]
+            histogram = self.histograms.get(key)
+            if histogram is not None:
+                return histogram
+        histogram = self.histograms[key] = Histogram(self.bounds)
+        return histogram
+
+    def incr(self, key: SeriesKey, count: int=1) -> None:
+        self.counters[key] = self.counters.get(key, 0) + count
+
+    def observe_timings(self, method: str, timings: List[Tuple[float, str]]) -> None:
+        """observe the time between consecutive timings, labelled with the
+        stage of the later one, as statsd's from_timings does"""
+        histograms = self.histograms
+        previous = timings[0][0]
+        for t, stage in timings[1:]:
+            key = (STAGE_DURATION, method, stage)
+            (histograms.get(key) or self._new_histogram(key)).observe(t - previous)
+            previous = t
+
+    def clear(self) -> None:
+        self.histograms.clear()
+        self.counters.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            'bounds': list(self.bounds),
+            'histograms': [[list(key), list(histogram.counts), histogram.sum]
+                           for key, histogram in self.histograms.items()],
+            'counters': [[list(key), value] for key, value in self.counters.items()]
+        }
+
+    def write_snapshot(self, path: str) -> None:
+        # replaced atomically, readers never see a partial snapshot
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps_bytes(self.snapshot()))
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+
+def snapshot_path(metrics_dir: str, pid: int) -> str:
+    return os.path.join(metrics_dir, f'{pid}.json')
+
+
+def read_snapshots(metrics_dir: Optional[str], exclude_pid: int=None) -> List[dict]:
+    if not metrics_dir:
+        return []
+    snapshots = []
+    exclude = f'{exclude_pid}.json'
+    try:
+        names = os.listdir(metrics_dir)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.endswith('.json') or name == exclude:
+            continue
+        try:
+            with open(os.path.join(metrics_dir, name), 'rb') as f:
+                snapshots.append(json.loads(f.read()))
+        except Exception as e:
+            logger.warning('unable to read metrics snapshot', name=name, e=e)
+    return snapshots
+
+
+def merge_snapshots(snapshots: Iterable[dict]) -> Tuple[tuple, dict, dict]:
+    """(bounds, histograms, counters) summed over snapshots, histograms are
+    key -> [bucket counts, sum]. Snapshots with other bounds are skipped"""
+    bounds = None
+    histograms = dict()
+    counters = dict()
+    for snapshot in snapshots:
+        snapshot_bounds = tuple(snapshot['bounds'])
+        if bounds is None:
+            bounds = snapshot_bounds
+        elif snapshot_bounds != bounds:
+            logger.warning('skipping metrics snapshot with different buckets')
+            continue
+        for key, counts, total in snapshot['histograms']:
+            key = tuple(key)
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = [list(counts), total]
+            else:
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        for key, value in snapshot['counters']:
+            key = tuple(key)
+            counters[key] = counters.get(key, 0) + value
+    return bounds or (), histograms, counters
+
+
+def render(snapshots: Iterable[dict]) -> str:
+    """Prometheus text exposition format of the merged snapshots"""
+    bounds, histograms, counters = merge_snapshots(snapshots)
+    les = [_format_float(bound) for bound in bounds] + ['+Inf']
+    lines = []
+    for family, (kind, label_names, help_text) in FAMILIES.items():
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        if kind == 'histogram':
+            for key in sorted(k for k in histograms if k[0] == family):
+                counts, total = histograms[key]
+                labels = _format_labels(label_names, key[1:])
+                cumulative = 0
+                for le, count in zip(les, counts):
+                    cumulative += count
+                    lines.append(f'{family}_bucket{{{labels}{"," if labels else ""}le="{le}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{family}_sum{_braced(labels)} {_format_float(total)}')
+                lines.append(f'{family}_count{_braced(labels)} {cumulative}')
+        else:
+            for key in sorted(k for k in counters if k[0] == family):
+                labels = _format_labels(label_names, key[1:])
+                lines.append(f'{family}{_braced(labels)} {counters[key]}')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+_ESCAPE = re.compile(r'[\\"\n]')
+_ESCAPES = {'\\': r'\\', '"': r'\"', '\n': r'\n'}
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ','.join(f'{name}="{_ESCAPE.sub(lambda m: _ESCAPES[m.group()], str(value))}"'
+                    for name, value in zip(names, values))
+
+
+def _braced(labels: str) -> str:
+    return f'{{{labels}}}' if labels else ''
+
+
+def _format_float(value: float) -> str:
+    return repr(round(value, 9))
+
+
+def create_metrics_dir() -> str:
+    return tempfile.mkdtemp(prefix='jussi-metrics-')
+
+
+def remove_metrics_dir(metrics_dir: str) -> None:
+    shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from time import perf_counter as perf
+from typing import List
+from typing import Optional
+
+import structlog
+from async_timeout import timeout
+
+from . import json
+from .histogram import Histogram
+from .scanner import split_batch
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Micro-batching of single requests to an http upstream
+#
+# Requests arriving within ``window`` seconds of the first one, or until
+# ``max_size`` of them are waiting, are sent upstream as one JSON-RPC batch.
+# Each request gets its position in the batch as upstream id, so responses
+# can be matched to their callers whatever order the upstream returns them in.
+# The batch response is split into raw responses without decoding it when its
+# shape allows (see jussi.scanner), each caller rewrites its response's id.
+# Callers that gave up, eg because their deadline passed, before the batch is
+# sent are left out of it.
+# -------------------
+
+DEFAULT_WINDOW = 0.001
+DEFAULT_MAX_SIZE = 32
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# pylint: disable=too-many-instance-attributes,too-many-arguments
+
+
+class MicroBatcher:
+    """Collects single requests to an http upstream url into batches"""
+
+    __slots__ = ('url',
+                 '_session',
+                 '_request_url',
+                 '_window',
+                 '_max_size',
+                 '_loop',
+                 '_pending',
+                 '_timer',
+                 '_inflight',
+                 'batch_sizes',
+                 'error_count')
+
+    def __init__(self,
+                 url: str,
+                 session,
+                 request_url: str=None,
+                 window: float=DEFAULT_WINDOW,
+                 max_size: int=DEFAULT_MAX_SIZE,
+                 loop=None) -> None:
+        if window < 0:
+            raise ValueError('window is expected to be greater than or equal zero')
+        if max_size < 1:
+            raise ValueError('max_size is expected to be greater than zero')
+        self.url = url
+        self._session = session
+        self._request_url = request_url or url
+        self._window = window
+        self._max_size = max_size
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = []
+        self._timer = None
+        self._inflight = set()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.error_count = 0
+
+    def fetch(self,
+              upstream_request: dict,
+              jussi_request_id: str=None,
+              deadline: Optional[float]=None) -> asyncio.Future:
+        """queue upstream_request for the next batch
+
+        The returned future resolves to the raw upstream response, whose id
+        is the request's position in the batch
+        """
+        future = self._loop.create_future()
+        self._pending.append((upstream_request, jussi_request_id, deadline, future))
+        if len(self._pending) >= self._max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self._window, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """send the queued requests now"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = [item for item in self._pending if not item[-1].done()]
+        self._pending = []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch), loop=self._loop)
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: list) -> None:
+        self.batch_sizes.observe(len(batch))
+        upstream_requests = [dict(upstream_request, id=i)
+                             for i, (upstream_request, *_) in enumerate(batch)]
+        headers = {}
+        request_ids = [jussi_request_id for _, jussi_request_id, _, _ in batch
+                       if jussi_request_id]
+        if request_ids:
+            headers['x-jussi-request-id'] = ','.join(dict.fromkeys(request_ids))
+        # wait as long as the most patient caller
+        deadlines = [deadline for _, _, deadline, _ in batch]
+        remaining = None
+        if None not in deadlines:
+            remaining = max(max(deadlines) - perf(), 0)
+            headers['x-jussi-timeout-ms'] = str(int(remaining * 1000))
+        try:
+            async with timeout(remaining):
+                async with self._session.post(self._request_url,
+                                              json=upstream_requests,
+                                              headers=headers) as resp:
+                    body = await resp.read()
+            raw_responses = split_batch(body, len(batch))
+            if raw_responses is None:
+                raw_responses = decode_batch(body, len(batch))
+        except Exception as e:
+            self.error_count += 1
+            logger.info('micro batch failed', url=self.url, size=len(batch), e=e)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, ((*_, future), raw_response) in enumerate(zip(batch, raw_responses)):
+            if future.done():
+                continue
+            if raw_response is None:
+                future.set_exception(
+                    ValueError(f'upstream batch response has no response for id {i}'))
+            else:
+                future.set_result(raw_response)
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for *_, future in self._pending:
+            future.cancel()
+        self._pending = []
+        for task in self._inflight:
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'url': self.url,
+            'window': self._window,
+            'max_size': self._max_size,
+            'queued': len(self._pending),
+            'inflight': len(self._inflight),
+            'batch_sizes': self.batch_sizes.to_dict(),
+            'errors': self.error_count
+        }
+
+
+def decode_batch(body: bytes, size: int) -> List[Optional[bytes]]:
+    """the raw responses of a batch response split_batch couldn't split,
+    None for the ids with no response"""
+    responses = json.loads(body)
+    if not isinstance(responses, list):
+        raise ValueError(f'upstream returned a {type(responses).__name__} for a batch')
+    raw_responses = [None] * size  # type: List[Optional[bytes]]
+    for response in responses:
+        if isinstance(response, dict):
+            i = response.get('id')
+            if type(i) is int and 0 <= i < size:
+                raw_responses[i] = json.dumps_bytes(response)
+    return raw_responses
@@ -3,6 +3,7 @@
 from .jussi import initialize_jussi_request
 from .jussi import finalize_jussi_response
 from .limits import check_limits
+from .limits import check_rate_limits
 from .limits import account_history_limit
 from .caching import get_response
 from .caching import cache_response
@@ -10,6 +11,7 @@ from .update_block_num import update_last_irreversible_block_num
 from .statsd import send_stats
 from .statsd import log_stats
 from .statsd import init_stats
+from .metrics import record_metrics
 
 
 def setup_middlewares(app):
@@ -19,6 +21,7 @@ def setup_middlewares(app):
     # request middleware
     app.request_middleware.append(initialize_jussi_request)
     app.request_middleware.append(init_stats)
+    app.request_middleware.append(check_rate_limits)
     app.request_middleware.append(check_limits)
     app.request_middleware.append(get_response)
     app.request_middleware.append(account_history_limit)
@@ -27,6 +30,7 @@ def setup_middlewares(app):
     app.response_middleware.append(finalize_jussi_response)
     app.response_middleware.append(update_last_irreversible_block_num)
     app.response_middleware.append(cache_response)
+    app.response_middleware.append(record_metrics)
 
     if app.config.args.statsd_url is not None:
         app.response_middleware.append(send_stats)
@@ -7,12 +7,16 @@ import structlog
 
 from async_timeout import timeout
 from sanic import response
-from ujson import loads
 
+from .. import json
 from ..cache.cache_group import UncacheableResponse
+from ..cache.ttl import TTL
+from ..scanner import scan_response
 from ..typedefs import HTTPRequest
 from ..typedefs import HTTPResponse
 from ..utils import async_nowait_middleware
+from ..validators import is_get_block_request
+from ..validators import is_valid_get_block_response_raw
 
 logger = structlog.get_logger(__name__)
 
@@ -46,8 +50,9 @@ async def get_response(request: HTTPRequest) -> None:
                 cache_group.is_complete_response(request.jsonrpc, cached_response):
             jussi_cache_key = cache_group.x_jussi_cache_key(request.jsonrpc)
             request.timings.append((perf(), 'get_cached_response.exit'))
-            return response.json(cached_response,
-                                 headers={'x-jussi-cache-hit': jussi_cache_key})
+            return response.raw(json.dumps_bytes(cached_response),
+                                content_type='application/json',
+                                headers={'x-jussi-cache-hit': jussi_cache_key})
 
     except ConnectionRefusedError as e:
         logger.error('error connecting to redis cache', e=e)
@@ -63,11 +68,23 @@ async def get_response(request: HTTPRequest) -> None:
 @async_nowait_middleware
 async def cache_response(request: HTTPRequest, response: HTTPResponse) -> None:
     try:
-        if 'x-jussi-cache-hit' in response.headers or not request.jsonrpc or not response.body:
+        # streamed responses have no body to cache
+        if 'x-jussi-cache-hit' in response.headers or not request.jsonrpc \
+                or not getattr(response, 'body', None):
             return
         if 'x-jussi-error-id' in response.headers:
             return
-        jsonrpc_response = loads(response.body)
+        if request.is_single_jrpc:
+            # avoid decoding responses that won't be cached
+            if request.jsonrpc.upstream.ttl == TTL.NO_CACHE:
+                return
+            scanned = scan_response(response.body)
+            if scanned is not None and scanned.key != b'result':
+                return
+            if is_get_block_request(request.jsonrpc) and \
+                    not is_valid_get_block_response_raw(request.jsonrpc, response.body):
+                return
+        jsonrpc_response = json.loads(response.body)
         if not jsonrpc_response:
             return
         cache_group = request.app.config.cache_group
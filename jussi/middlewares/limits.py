@@ -1,15 +1,35 @@
 # -*- coding: utf-8 -*-
+import math
 from typing import Optional
 
+from sanic import response
+
 from ..errors import JsonRpcBatchSizeError
 from ..errors import JsonRpcError
 from ..errors import JussiAccountHistoryLimitsError
+from ..errors import JussiRateLimitError
+from ..metrics import ERRORS
+from ..metrics import METRICS
 from ..typedefs import HTTPRequest
 from ..typedefs import HTTPResponse
 from ..validators import limit_broadcast_transaction_request
 from ..validators import limit_account_history_count_request
 
 
+async def check_rate_limits(request: HTTPRequest) -> Optional[HTTPResponse]:
+    rate_limiter = request.app.config.get('rate_limiter')
+    if rate_limiter is None or not (request.is_single_jrpc or request.is_batch_jrpc):
+        return None
+    exceeded = await rate_limiter.check(request)
+    if exceeded is None:
+        return None
+    rule, wait = exceeded
+    METRICS.incr((ERRORS, str(JussiRateLimitError.code)))
+    return response.raw(rate_limiter.error_response(rule, request),
+                        content_type='application/json',
+                        headers={'Retry-After': str(math.ceil(wait))})
+
+
 async def check_limits(request: HTTPRequest) -> Optional[HTTPResponse]:
     # pylint: disable=no-member
     try:
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from time import perf_counter as perf
+
+import structlog
+
+from ..metrics import METRICS
+from ..metrics import REQUEST_DURATION
+from ..typedefs import HTTPRequest
+from ..typedefs import HTTPResponse
+from ..urn import method_name
+
+logger = structlog.get_logger(__name__)
+
+# pylint: disable=unused-argument
+
+
+async def record_metrics(request: HTTPRequest, response: HTTPResponse) -> None:
+    try:
+        if request.is_single_jrpc:
+            method = method_name(request.jsonrpc.urn)
+            METRICS.observe((REQUEST_DURATION, method), perf() - request.timings[0][0])
+            METRICS.observe_timings(method, request.timings)
+            METRICS.observe_timings(method, request.jsonrpc.timings)
+        elif request.is_batch_jrpc:
+            METRICS.observe((REQUEST_DURATION, 'batch'), perf() - request.timings[0][0])
+            METRICS.observe_timings('batch', request.timings)
+            for r in request.jsonrpc:
+                METRICS.observe_timings(method_name(r.urn), r.timings)
+    except Exception as e:
+        logger.warning('record_metrics', e=e)
@@ -1,6 +1,4 @@
 # -*- coding: utf-8 -*-
-from asyncio.tasks import Task
-
 import structlog
 
 from ..typedefs import HTTPRequest
@@ -20,15 +18,14 @@ async def init_stats(request: HTTPRequest) -> None:
             return
         if request.is_single_jrpc:
             statsd_client.incr('jrpc.inflight')
-        elif request.is_batch_jrpc and statsd_client:
-            _ = [statsd_client.incr('jrpc.inflight') for r in request.jsonrpc]
+        elif request.is_batch_jrpc:
+            statsd_client.incr('jrpc.inflight', len(request.jsonrpc))
     except BaseException as e:
         logger.warning('send_stats', e=e)
 
 # pylint: disable=unused-argument
 
 
-@async_nowait_middleware
 async def send_stats(request: HTTPRequest,
                      response: HTTPResponse) -> None:
     # pylint: disable=bare-except
@@ -36,18 +33,16 @@ async def send_stats(request: HTTPRequest,
         statsd_client = getattr(request.app.config, 'statsd_client', None)
         if not statsd_client:
             return
+        # aggregated in memory, the client sends them once per flush interval
         if request.is_single_jrpc:
             statsd_client.from_timings(request.timings)
             statsd_client.from_timings(request.jsonrpc.timings)
             statsd_client.decr('jrpc.inflight')
-            statsd_client.gauge('tasks', len(Task.all_tasks()))
-            statsd_client._sendbatch()
         elif request.is_batch_jrpc:
             statsd_client.from_timings(request.timings)
             for r in request.jsonrpc:
                 statsd_client.from_timings(r.timings)
-                statsd_client.decr('jrpc.inflight')
-            statsd_client._sendbatch()
+            statsd_client.decr('jrpc.inflight', len(request.jsonrpc))
     except BaseException as e:
         logger.warning('send_stats', e=e)
 
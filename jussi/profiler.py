@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from typing import Counter
+from typing import Dict
+from typing import Optional
+
+import structlog
+
+from . import json
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Sampling profiler
+#
+# A thread reads the stack of the event loop's thread every interval, with
+# sys._current_frames(), and counts each distinct stack. Unlike cProfile,
+# nothing runs on the loop's thread, the loop only gives up the GIL for the
+# time it takes to walk a stack. Profiles are returned as collapsed stacks,
+# "outer;...;inner count" lines, the input of flamegraph.pl and speedscope.
+#
+# To profile every worker, the worker serving the request writes the
+# profile's parameters to the directory the workers share (see
+# setup_metrics_dir) and sends SIGUSR2 to the main process, which forwards it
+# to the workers. Each worker profiles itself and writes its stacks next to
+# the request, where the serving worker merges them.
+# -------------------
+
+DEFAULT_SECONDS = 10
+# with COLLECT_TIMEOUT, within sanic's RESPONSE_TIMEOUT
+MAX_SECONDS = 55
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.001
+
+PROFILE_REQUEST = 'profile.request'
+PROFILE_SUFFIX = '.profile'
+# seconds past the profile's duration to wait for the workers' stacks
+COLLECT_TIMEOUT = 5
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter[str]:
+    """collapsed stacks of thread_id, sampled every interval for seconds,
+    blocks the calling thread"""
+    stacks = collections.Counter()  # type: Counter[str]
+    labels = dict()  # type: Dict[object, str]
+    current_frames = sys._current_frames  # pylint: disable=protected-access
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = current_frames().get(thread_id)
+        if frame is None:
+            break
+        stacks[collapse(frame, labels)] += 1
+        del frame
+        time.sleep(interval)
+    return stacks
+
+
+def collapse(frame, labels: Dict[object, str]) -> str:
+    """outermost first, ; separated function (file:line) frames, labels
+    caches the label of each code object"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        label = labels.get(code)
+        if label is None:
+            label = labels[code] = (f'{code.co_name} ({os.path.basename(code.co_filename)}'
+                                    f':{code.co_firstlineno})').replace(';', ',')
+        names.append(label)
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+def format_collapsed(stacks: Counter[str]) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+class Profiler:
+    """Profiles the event loop of a worker, one profile at a time"""
+
+    def __init__(self, loop, profile_dir: Optional[str]=None) -> None:
+        self.profile_dir = profile_dir
+        self.running = False
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+
+    async def profile(self, seconds: float, interval: float) -> Counter[str]:
+        if self.running:
+            raise ProfilerBusy('a profile is already running in this worker')
+        self.running = True
+        logger.info('profiling worker', seconds=seconds, interval=interval)
+        try:
+            return await self._loop.run_in_executor(
+                None, sample_stacks, self._loop_thread_id, seconds, interval)
+        finally:
+            self.running = False
+
+    async def profile_workers(self, seconds: float, interval: float,
+                              workers: int) -> Counter[str]:
+        """profile every worker, returns the merged stacks of the workers
+        which answered within COLLECT_TIMEOUT seconds of the profile's end"""
+        if self.profile_dir is None:
+            return await self.profile(seconds, interval)
+        if self.running:
+            raise ProfilerBusy('a profile is already running in this worker')
+        profile_id = uuid.uuid4().hex
+        _write_atomic(os.path.join(self.profile_dir, PROFILE_REQUEST), {
+            'id': profile_id, 'seconds': seconds, 'interval': interval})
+        os.kill(os.getppid(), signal.SIGUSR2)
+        await asyncio.sleep(seconds, loop=self._loop)
+        deadline = time.monotonic() + COLLECT_TIMEOUT
+        paths = self._profile_paths(profile_id)
+        while len(paths) < workers and time.monotonic() < deadline:
+            await asyncio.sleep(0.1, loop=self._loop)
+            paths = self._profile_paths(profile_id)
+        stacks = collections.Counter()  # type: Counter[str]
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    stacks.update(json.loads(f.read()))
+                os.remove(path)
+            except Exception as e:
+                logger.warning('unable to read worker profile', path=path, e=e)
+        if len(paths) < workers:
+            logger.warning('missing worker profiles', expected=workers, received=len(paths))
+        return stacks
+
+    def _profile_paths(self, profile_id: str) -> list:
+        prefix = f'{profile_id}.'
+        return [os.path.join(self.profile_dir, name) for name in os.listdir(self.profile_dir)
+                if name.startswith(prefix) and name.endswith(PROFILE_SUFFIX)]
+
+    def on_profile_signal(self) -> None:
+        """SIGUSR2, profile this worker as requested in the profile dir"""
+        try:
+            with open(os.path.join(self.profile_dir, PROFILE_REQUEST), 'rb') as f:
+                request = json.loads(f.read())
+        except Exception as e:
+            logger.warning('SIGUSR2 without a readable profile request', e=e)
+            return
+        asyncio.ensure_future(self._profile_to_file(request), loop=self._loop)
+
+    async def _profile_to_file(self, request: dict) -> None:
+        try:
+            stacks = await self.profile(request['seconds'], request['interval'])
+            path = os.path.join(self.profile_dir,
+                                f'{request["id"]}.{os.getpid()}{PROFILE_SUFFIX}')
+            _write_atomic(path, dict(stacks))
+        except Exception as e:
+            logger.error('worker profile failed', profile_id=request.get('id'), e=e)
+
+
+def _write_atomic(path: str, data: dict) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps_bytes(data))
+    os.replace(tmp_path, path)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import math
+import mmap
+import multiprocessing
+import struct
+import time
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import structlog
+
+from . import json
+from .errors import JussiRateLimitError
+from .scanner import join_batch
+from .scanner import rewrite_id
+from .urn import method_name
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Token bucket rate limits
+#
+# Rules come from "rate_limits" in the "limits" of the upstream config, eg
+#   {"name": "per_ip", "key": "ip", "rate": 50, "burst": 100}
+#   {"name": "per_api_key", "key": "header", "header": "x-api-key", "rate": 200}
+#   {"name": "history", "key": "global", "prefix": "appbase.condenser_api.get_account_history", "rate": 20}
+# A rule's bucket is keyed by client ip, by the value of a request header, or
+# shared by all clients ("global"). Rules with a method prefix only count the
+# JSON-RPC requests whose method starts with it, every request of a batch
+# takes a token. A request is only charged if every rule's bucket has its
+# tokens, so a request refused by one rule doesn't drain the others.
+#
+# Buckets live in an anonymous shared mmap created before the workers are
+# forked, so the workers on a host share them. Optionally they live in redis,
+# shared by every host, falling back to the local buckets if redis fails.
+# -------------------
+
+RULE_KEYS = ('ip', 'header', 'global')
+
+DEFAULT_SLOTS = 65536
+# slots are grouped into sets of SET_SIZE, a bucket is stored in the set its
+# hash picks, replacing the least recently used bucket if the set is full
+SET_SIZE = 8
+LOCKS = 64
+
+# key hash, tokens, last update (time.monotonic)
+SLOT = struct.Struct('<Qdd')
+SET = struct.Struct('<' + 'Qdd' * SET_SIZE)
+
+
+class RateLimitRule(NamedTuple):
+    name: str
+    key: str
+    rate: float
+    burst: float
+    prefix: Optional[str] = None
+    header: Optional[str] = None
+
+
+def parse_rate_limits(config: list) -> Tuple[RateLimitRule, ...]:
+    """rules from the "rate_limits" of the upstream config's "limits"
+
+    Raises ValueError for invalid rules
+    """
+    rules = []
+    for i, rule in enumerate(config or []):
+        key = rule.get('key')
+        if key not in RULE_KEYS:
+            raise ValueError(f'rate limit {i} key is expected to be one of {RULE_KEYS}')
+        rate = float(rule.get('rate', 0))
+        if rate <= 0:
+            raise ValueError(f'rate limit {i} rate is expected to be greater than zero')
+        burst = float(rule.get('burst', rate))
+        if burst < 1:
+            raise ValueError(f'rate limit {i} burst is expected to be at least 1')
+        header = rule.get('header')
+        if key == 'header' and not header:
+            raise ValueError(f'rate limit {i} is keyed by header but has no header')
+        rules.append(RateLimitRule(name=rule.get('name', f'rule{i}'),
+                                   key=key,
+                                   rate=rate,
+                                   burst=burst,
+                                   prefix=rule.get('prefix'),
+                                   header=header.lower() if header else None))
+    return tuple(rules)
+
+
+def key_hash(key: bytes) -> int:
+    # stable across processes and hosts, unlike hash(). 0 marks empty slots
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+class SharedTokenBuckets:
+    """Token buckets in memory shared by the processes forked after it's
+    created"""
+
+    def __init__(self, slots: int=DEFAULT_SLOTS, locks: int=LOCKS) -> None:
+        if slots < SET_SIZE:
+            raise ValueError(f'slots is expected to be at least {SET_SIZE}')
+        self._sets = slots // SET_SIZE
+        self._mmap = mmap.mmap(-1, self._sets * SET_SIZE * SLOT.size)
+        self._locks = [multiprocessing.Lock() for _ in range(locks)]
+
+    def take(self, key: bytes, rate: float, burst: float, count: int=1,
+             now: float=None) -> float:
+        """take count tokens from key's bucket
+
+        Returns 0 if they were taken, otherwise the seconds until they
+        will be available
+        """
+        now = time.monotonic() if now is None else now
+        h = key_hash(key)
+        set_index = h % self._sets
+        first = set_index * SET_SIZE
+        mm = self._mmap
+        with self._locks[set_index % len(self._locks)]:
+            slots = SET.unpack_from(mm, first * SLOT.size)
+            slot = None
+            oldest = math.inf
+            for i in range(0, SET_SIZE * 3, 3):
+                slot_key = slots[i]
+                if slot_key == h:
+                    slot = i
+                    tokens, updated = slots[i + 1], slots[i + 2]
+                    break
+                if slot_key == 0:
+                    # slots are filled in order, so the key isn't in the set
+                    slot = i
+                    tokens, updated = burst, now
+                    break
+                if slots[i + 2] < oldest:
+                    slot, oldest = i, slots[i + 2]
+            else:
+                tokens, updated = burst, now
+            tokens, wait = _take(tokens, updated, rate, burst, count, now)
+            SLOT.pack_into(mm, (first + slot // 3) * SLOT.size, h, tokens, now)
+        return wait
+
+    def refund(self, key: bytes, burst: float, count: int=1) -> None:
+        """give back count tokens taken from key's bucket"""
+        h = key_hash(key)
+        set_index = h % self._sets
+        first = set_index * SET_SIZE
+        mm = self._mmap
+        with self._locks[set_index % len(self._locks)]:
+            slots = SET.unpack_from(mm, first * SLOT.size)
+            for i in range(0, SET_SIZE * 3, 3):
+                if slots[i] == h:
+                    SLOT.pack_into(mm, (first + i // 3) * SLOT.size,
+                                   h, min(burst, slots[i + 1] + count), slots[i + 2])
+                    return
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def _take(tokens: float, updated: float, rate: float, burst: float, count: int,
+          now: float) -> Tuple[float, float]:
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= count:
+        return tokens - count, 0.0
+    return tokens, (count - tokens) / rate
+
+
+# ARGV is now, then rate, burst and count for each key. Returns the 1-based
+# index of the first bucket without enough tokens and the wait, without
+# taking any, or 0 once the tokens are taken from every bucket
+REDIS_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local remaining = {}
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 3 - 1])
+  local burst = tonumber(ARGV[i * 3])
+  local count = tonumber(ARGV[i * 3 + 1])
+  local bucket = redis.call('HMGET', key, 't', 'u')
+  local tokens = tonumber(bucket[1]) or burst
+  local updated = tonumber(bucket[2]) or now
+  tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+  if tokens < count then
+    return {i, tostring((count - tokens) / rate)}
+  end
+  remaining[i] = tokens - count
+end
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 3 - 1])
+  local burst = tonumber(ARGV[i * 3])
+  redis.call('HSET', key, 't', remaining[i], 'u', now)
+  redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return {0, '0'}
+"""
+
+
+class RedisTokenBuckets:
+    """Token buckets in redis, shared by every jussi host using it"""
+
+    def __init__(self, url: str, prefix: str='jussi:ratelimit:') -> None:
+        from redis.asyncio import Redis
+        self._client = Redis.from_url(url)
+        self._script = self._client.register_script(REDIS_TAKE_SCRIPT)
+        self._prefix = prefix
+
+    async def take_all(self, takes: List[Tuple[bytes, float, float, int]]
+                       ) -> Optional[Tuple[int, float]]:
+        """take count tokens from each (key, rate, burst, count) bucket, or
+        from none of them. Returns the index of the first bucket without
+        enough tokens and the seconds until it will have them, or None"""
+        args = [time.time()]
+        for _, rate, burst, count in takes:
+            args.extend((rate, burst, count))
+        index, wait = await self._script(
+            keys=[self._prefix.encode() + key for key, _, _, _ in takes], args=args)
+        if not index:
+            return None
+        return int(index) - 1, float(wait)
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+class RateLimiter:
+    """Checks requests against rate limit rules"""
+
+    def __init__(self,
+                 rules: Tuple[RateLimitRule, ...],
+                 buckets: SharedTokenBuckets,
+                 redis_buckets: RedisTokenBuckets=None) -> None:
+        self.rules = rules
+        self._buckets = buckets
+        self._redis_buckets = redis_buckets
+        # the error responses are built once, only their id changes
+        self._errors = {rule.name: json.dumps_bytes({
+            'jsonrpc': '2.0',
+            'id': None,
+            'error': {
+                'code': JussiRateLimitError.code,
+                'message': JussiRateLimitError.message.format(
+                    rate=f'{rule.rate:g}', name=rule.name)
+            }
+        }) for rule in rules}
+        self.rejected = {rule.name: 0 for rule in rules}
+        self.redis_error_count = 0
+
+    def keys(self, http_request) -> List[Tuple[RateLimitRule, bytes, int]]:
+        """(rule, bucket key, tokens) for each rule the request counts toward"""
+        keys = []
+        for rule in self.rules:
+            count = 1
+            if rule.prefix is not None:
+                count = sum(1 for jrpc_request in _jrpc_requests(http_request)
+                            if method_name(jrpc_request.urn).startswith(rule.prefix))
+                if not count:
+                    continue
+            elif http_request.is_batch_jrpc:
+                count = len(http_request.jsonrpc)
+            if rule.key == 'ip':
+                value = http_request.client_ip or ''
+            elif rule.key == 'header':
+                value = http_request.headers.get(rule.header)
+                if value is None:
+                    continue
+            else:
+                value = ''
+            keys.append((rule, f'{rule.name}\0{value}'.encode(), count))
+        return keys
+
+    async def check(self, http_request) -> Optional[Tuple[RateLimitRule, float]]:
+        """take tokens for http_request, returns the first rule it exceeds,
+        and the seconds until it wouldn't, or None. Tokens are only taken
+        if no rule is exceeded"""
+        keys = self.keys(http_request)
+        if not keys:
+            return None
+        exceeded = await self.take_all(keys)
+        if exceeded is None:
+            return None
+        index, wait = exceeded
+        rule = keys[index][0]
+        self.rejected[rule.name] += 1
+        return rule, wait
+
+    async def take_all(self, keys: List[Tuple[RateLimitRule, bytes, int]]
+                       ) -> Optional[Tuple[int, float]]:
+        if self._redis_buckets is not None:
+            try:
+                return await self._redis_buckets.take_all(
+                    [(key, rule.rate, rule.burst, count) for rule, key, count in keys])
+            except Exception as e:
+                self.redis_error_count += 1
+                logger.warning('redis rate limit failed, using local buckets', e=e)
+        buckets = self._buckets
+        for i, (rule, key, count) in enumerate(keys):
+            wait = buckets.take(key, rule.rate, rule.burst, count)
+            if wait:
+                # give back the tokens taken by the previous rules
+                for taken_rule, taken_key, taken_count in keys[:i]:
+                    buckets.refund(taken_key, taken_rule.burst, taken_count)
+                return i, wait
+        return None
+
+    def error_response(self, rule: RateLimitRule, http_request) -> bytes:
+        """the error of rule, a batch gets one error per request"""
+        error = self._errors[rule.name]
+        if http_request.is_single_jrpc:
+            return rewrite_id(error, http_request.jsonrpc.id)
+        if http_request.is_batch_jrpc:
+            return join_batch(rewrite_id(error, jrpc_request.id)
+                              for jrpc_request in http_request.jsonrpc)
+        return error
+
+    def stats(self) -> dict:
+        return {
+            'rules': [rule._asdict() for rule in self.rules],
+            'rejected': self.rejected,
+            'redis': self._redis_buckets is not None,
+            'redis_errors': self.redis_error_count
+        }
+
+
+def _jrpc_requests(http_request) -> list:
+    if http_request.is_single_jrpc:
+        return [http_request.jsonrpc]
+    if http_request.is_batch_jrpc:
+        return http_request.jsonrpc
+    return []
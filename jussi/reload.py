@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import ssl
+from typing import NamedTuple
+from typing import Tuple
+
+import structlog
+
+from . import json
+from .listeners import http_pool_config
+from .listeners import make_http_session
+from .listeners import make_micro_batcher
+from .listeners import make_rate_limiter
+from .listeners import make_upstream_limiter
+from .listeners import make_upstream_scheduler
+from .listeners import make_websocket_pool
+from .ratelimit import parse_rate_limits
+from .typedefs import WebApp
+from .upstream import _Upstreams
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Hot reload of the upstream config
+#
+# The new config is loaded and validated off the event loop, then only the
+# websocket pools, http sessions, micro batchers and limiters of urls that
+# were added or whose settings changed are created. Routing tables are
+# compiled per _Upstreams, so swapping app.config.upstreams swaps them all,
+# and everything is swapped without yielding to the event loop in between.
+# Pools and sessions that are no longer used are closed RETIRE_DELAY seconds
+# later, so requests routed before the swap can finish.
+# -------------------
+
+RETIRE_DELAY = 30
+POOL_CLOSE_TIMEOUT = 10
+
+
+class UpstreamChanges(NamedTuple):
+    added: frozenset
+    removed: frozenset
+    # kept http urls whose connection pool settings changed
+    http_pools: frozenset
+    # kept http urls whose micro batch settings changed
+    micro_batches: frozenset
+    priority_classes: bool
+
+    def to_dict(self) -> dict:
+        return {
+            'added': sorted(self.added),
+            'removed': sorted(self.removed),
+            'http_pools': sorted(self.http_pools),
+            'micro_batches': sorted(self.micro_batches),
+            'priority_classes': self.priority_classes
+        }
+
+
+def load_upstreams(config_file: str, validate: bool) -> Tuple[dict, _Upstreams]:
+    with open(config_file) as f:
+        config = json.loads(f.read())
+    return config, _Upstreams(config, validate=validate)
+
+
+def diff_upstreams(old: _Upstreams, new: _Upstreams, args) -> UpstreamChanges:
+    kept = frozenset(url for url in old.urls & new.urls if url.startswith('http'))
+    http_pools = frozenset(
+        url for url in kept
+        if http_pool_config(url, old, args) != http_pool_config(url, new, args))
+    micro_batches = frozenset(
+        url for url in kept - http_pools
+        if old.micro_batch(url) != new.micro_batch(url))
+    return UpstreamChanges(added=new.urls - old.urls,
+                           removed=old.urls - new.urls,
+                           http_pools=http_pools,
+                           micro_batches=micro_batches,
+                           priority_classes=old.priority_classes != new.priority_classes)
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+async def reload_upstreams(app: WebApp, loop=None) -> UpstreamChanges:
+    """reload the upstream config file and swap it in
+
+    Raises if the config can't be loaded or a new pool can't be created, the
+    current config is kept in that case
+    """
+    loop = loop or asyncio.get_event_loop()
+    lock = getattr(app.config, 'upstreams_reload_lock', None)
+    if lock is None:
+        lock = app.config.upstreams_reload_lock = asyncio.Lock(loop=loop)
+
+    async with lock:
+        args = app.config.args
+        old = app.config.upstreams
+        # validating urls resolves their hostnames, which blocks
+        config, new = await loop.run_in_executor(
+            None, load_upstreams, args.upstream_config_file, args.test_upstream_urls)
+        rate_limits = parse_rate_limits(config.get('limits', {}).get('rate_limits'))
+        changes = diff_upstreams(old, new, args)
+        logger.info('reloading upstreams', **changes.to_dict())
+
+        aio = app.config.aiohttp
+        pools = dict()
+        sessions = dict()
+        request_urls = dict()
+        batchers = dict()
+        prewarm = []
+        try:
+            ssl_context = ssl.create_default_context()
+            for url in changes.added | changes.http_pools:
+                if url.startswith('ws'):
+                    pools[url] = await make_websocket_pool(url, args, loop)
+                elif url.startswith('http'):
+                    session, request_url, batcher, warmups = make_http_session(
+                        url, new, args, loop, ssl_context)
+                    sessions[url] = session
+                    request_urls[url] = request_url
+                    batchers[url] = batcher
+                    prewarm.extend(warmups)
+            for url in changes.micro_batches:
+                batchers[url] = make_micro_batcher(url, new, aio['sessions'][url],
+                                                   aio['request_urls'].get(url), loop)
+            if prewarm:
+                await asyncio.gather(*prewarm)
+        except BaseException:
+            for batcher in batchers.values():
+                if batcher is not None:
+                    batcher.close()
+            for session in sessions.values():
+                await session.close()
+            for pool in pools.values():
+                pool.terminate()
+            raise
+
+        # swap, nothing below yields to the event loop
+        retired = []
+        ws_pools = app.config.websocket_pools
+        for url, pool in pools.items():
+            ws_pools[url] = pool
+        for url, session in sessions.items():
+            if url in aio['sessions']:
+                retired.append((aio['sessions'], url, aio['sessions'][url]))
+            aio['sessions'][url] = session
+            _replace(aio['request_urls'], url, request_urls[url])
+        for url, batcher in batchers.items():
+            if url in aio['batchers']:
+                retired.append((aio['batchers'], url, aio['batchers'][url]))
+            _replace(aio['batchers'], url, batcher)
+
+        limiters = app.config.upstream_limiters
+        if args.upstream_concurrency_limit:
+            for url in changes.added:
+                limiters[url] = make_upstream_limiter(url, args, loop)
+        if changes.priority_classes:
+            app.config.upstream_scheduler = make_upstream_scheduler(new, args, loop)
+        app.config.limits = config.get('limits', {'accounts_blacklist': set(),
+                                                  'account_history_limit': 100})
+        if rate_limits != getattr(app.config.rate_limiter, 'rules', ()):
+            # buckets are kept, only the rules change
+            app.config.rate_limiter = make_rate_limiter(rate_limits,
+                                                        app.config.rate_limit_buckets,
+                                                        app.config.rate_limit_redis)
+        app.config.upstream_config = config
+        app.config.upstreams = new
+
+        # removed urls stay reachable for requests routed before the swap
+        for url in changes.removed:
+            for resources in (ws_pools, aio['sessions'], aio['batchers'], limiters):
+                if url in resources:
+                    retired.append((resources, url, resources[url]))
+            if url in aio['request_urls']:
+                retired.append((aio['request_urls'], url, aio['request_urls'][url]))
+
+    if retired:
+        asyncio.ensure_future(retire(retired, RETIRE_DELAY), loop=loop)
+    logger.info('reloaded upstreams', **changes.to_dict())
+    return changes
+# pylint: enable=too-many-locals,too-many-branches,too-many-statements
+
+
+async def retire(retired: list, delay: float) -> None:
+    """after delay, remove each (mapping, url, resource) from its mapping,
+    unless it has been replaced since, and close it"""
+    await asyncio.sleep(delay)
+    for resources, url, resource in retired:
+        if resources.get(url) is resource:
+            del resources[url]
+        try:
+            await close_resource(resource)
+        except Exception as e:
+            logger.error('error closing retired upstream resource', url=url, e=e)
+
+
+async def close_resource(resource) -> None:
+    if hasattr(resource, 'terminate'):
+        # websocket pool
+        try:
+            await asyncio.wait_for(resource.close(), POOL_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            resource.terminate()
+    elif hasattr(resource, 'flush'):
+        # micro batcher
+        resource.close()
+    elif hasattr(resource, 'connector'):
+        # aiohttp session
+        await resource.close()
+
+
+def on_reload_signal(app: WebApp, loop) -> None:
+    asyncio.ensure_future(_reload_upstreams_logged(app, loop), loop=loop)
+
+
+async def _reload_upstreams_logged(app: WebApp, loop) -> None:
+    try:
+        await reload_upstreams(app, loop=loop)
+    except Exception as e:
+        logger.error('upstream reload failed, keeping current config', e=e)
+
+
+def _replace(resources: dict, url: str, resource) -> None:
+    if resource is None:
+        resources.pop(url, None)
+    else:
+        resources[url] = resource
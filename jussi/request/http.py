@@ -10,10 +10,10 @@ from urllib.parse import urlunparse
 
 # pylint: disable=no-name-in-module
 from httptools import parse_url
-from ujson import loads as json_loads
-
+from jussi import json
 from jussi.empty import _empty
 from jussi.request.jsonrpc import JSONRPCRequest
+from jussi.request.jsonrpc import from_http_batch as jsonrpc_batch_from_request
 from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
 
 # pylint: enable=no-name-in-module
@@ -72,8 +72,9 @@ class HTTPRequest:
 
     @property
     def jsonrpc(self) -> Optional[JrpcRequest]:
-        # ignore body and json if HTTP methos is not POST
-        if self.method != 'POST':
+        # ignore body and json if HTTP methos is not POST, or for admin
+        # routes, eg /admin/reload
+        if self.method != 'POST' or self._parsed_url.path.startswith(b'/admin/'):
             return None
 
         if self._parsed_jsonrpc is _empty:
@@ -87,24 +88,22 @@ class HTTPRequest:
                     raise ParseError(http_request=self)
                 # raise ParseError if parsing fails
                 try:
-                    self._parsed_json = json_loads(self.body)
+                    self._parsed_json = json.loads(self.body)
                 except Exception as e:
                     raise ParseError(http_request=self, exception=e)
 
                 # validate jsonrpc
                 jsonrpc_request = self._parsed_json
-                validate_jsonrpc_request(jsonrpc_request)
-
-                if isinstance(jsonrpc_request, dict):
+                if isinstance(jsonrpc_request, list) and jsonrpc_request:
+                    # validated while parsed
+                    self._parsed_jsonrpc = jsonrpc_batch_from_request(self,
+                                                                      jsonrpc_request)
+                    self.is_batch_jrpc = True
+                else:
+                    validate_jsonrpc_request(jsonrpc_request)
                     self._parsed_jsonrpc = jsonrpc_from_request(self, 0,
                                                                 jsonrpc_request)
                     self.is_single_jrpc = True
-                elif isinstance(jsonrpc_request, list):
-                    self._parsed_jsonrpc = [
-                        jsonrpc_from_request(self, batch_index, req)
-                        for batch_index, req in enumerate(jsonrpc_request)
-                    ]
-                    self.is_batch_jrpc = True
             except ParseError as e:
                 raise e
             except Exception as e:
@@ -117,6 +116,20 @@ class HTTPRequest:
             self._get_address()
         return self._ip
 
+    @property
+    def client_ip(self) -> Optional[str]:
+        # openresty's real_ip_header already restores the true client IP
+        # to $remote_addr, then passes it as X-Real-IP to jussi.
+        # X-Forwarded-For ($proxy_add_x_forwarded_for) contains the full
+        # proxy chain and is used as fallback.
+        real_ip = self.headers.get('X-Real-IP')
+        if real_ip:
+            return real_ip
+        forwarded_for = self.headers.get('X-Forwarded-For')
+        if forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+        return self.ip
+
     @property
     def port(self):
         if not hasattr(self, '_socket'):
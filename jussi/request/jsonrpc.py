@@ -2,12 +2,12 @@
 from time import perf_counter
 from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Tuple
 from typing import TypeVar
 from typing import Union
 
-from ujson import dumps
-
+from jussi import json
 from jussi.empty import _empty
 
 # JSONRPC Request/Response fields
@@ -39,7 +39,8 @@ class JSONRPCRequest:
                  'jussi_request_id',
                  'batch_index',
                  'original_request',
-                 'timings')
+                 'timings',
+                 'deadline')
 
     # pylint: disable=too-many-arguments
     def __init__(self,
@@ -53,7 +54,8 @@ class JSONRPCRequest:
                  jussi_request_id: str,
                  batch_index: int,
                  original_request: SingleRawRequest,
-                 timings: List[Tuple[float, str]]) -> None:
+                 timings: List[Tuple[float, str]],
+                 deadline: Optional[float]=None) -> None:
         self.id = _id
         self.jsonrpc = jsonrpc
         self.method = method
@@ -65,19 +67,21 @@ class JSONRPCRequest:
         self.batch_index = batch_index
         self.original_request = original_request
         self.timings = timings
+        # absolute perf_counter() time by which the response is needed
+        self.deadline = deadline
 
     def to_dict(self):
         return {k: getattr(self, k) for k in
                 ('id', 'jsonrpc', 'method', 'params') if getattr(self, k) is not _empty}
 
     def json(self) -> str:
-        return dumps(self.to_dict(), ensure_ascii=False)
+        return json.dumps(self.to_dict())
 
     def to_upstream_request(self, as_json=True) -> Union[str, dict]:
         jrpc_dict = self.to_dict()
         jrpc_dict.update({'id': self.upstream_id})
         if as_json:
-            return dumps(jrpc_dict, ensure_ascii=False)
+            return json.dumps(jrpc_dict)
         return jrpc_dict
 
     @property
@@ -87,6 +91,13 @@ class JSONRPCRequest:
             headers['x-amzn-trace-id'] = self.amzn_trace_id
         return headers
 
+    @property
+    def remaining(self) -> Optional[float]:
+        """seconds left until the deadline, None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return self.deadline - perf_counter()
+
     @property
     def upstream_id(self) -> int:
         # jussi_request_id is a hex string from nginx $request_id,
@@ -120,31 +131,77 @@ class JSONRPCRequest:
 def from_http_request(http_request, batch_index: int, request: SingleRawRequest):
     from ..urn import from_request as urn_from_request
     from ..upstream import Upstream
-
+    return _from_raw_request(http_request.app.config.upstreams,
+                             urn_from_request,
+                             Upstream.from_urn,
+                             batch_index,
+                             request,
+                             http_request.amzn_trace_id,
+                             http_request.jussi_request_id,
+                             http_request.request_start_time)
+
+
+def from_http_batch(http_request, requests: List[SingleRawRequest]) -> List[JSONRPCRequest]:
+    """validate, parse and route the requests of a batch in a single pass
+
+    Raises AssertionError if a request isn't a valid jsonrpc request
+    """
+    # imported once per batch instead of once per request
+    from ..urn import from_request as urn_from_request
+    from ..upstream import Upstream
+    from ..validators import validate_single_jsonrpc_request
     upstreams = http_request.app.config.upstreams
+    upstream_from_urn = Upstream.from_urn
+    # the same for every request of the batch
+    amzn_trace_id = http_request.amzn_trace_id
+    jussi_request_id = http_request.jussi_request_id
+    request_start_time = http_request.request_start_time
+    jsonrpc_requests = []
+    for batch_index, request in enumerate(requests):
+        validate_single_jsonrpc_request(request)
+        jsonrpc_requests.append(_from_raw_request(upstreams,
+                                                  urn_from_request,
+                                                  upstream_from_urn,
+                                                  batch_index,
+                                                  request,
+                                                  amzn_trace_id,
+                                                  jussi_request_id,
+                                                  request_start_time))
+    return jsonrpc_requests
+
+
+# pylint: disable=too-many-arguments
+def _from_raw_request(upstreams,
+                      urn_from_request,
+                      upstream_from_urn,
+                      batch_index: int,
+                      request: SingleRawRequest,
+                      amzn_trace_id: str,
+                      jussi_request_id: str,
+                      request_start_time: float) -> JSONRPCRequest:
     urn = urn_from_request(request)  # type:URN
-    upstream = Upstream.from_urn(urn, upstreams=upstreams)  # type: Upstream
     original_request = None
 
+    # only route the request jussi will actually send
     if upstreams.translate_to_appbase(urn):
         original_request = request
         request = JSONRPCRequest.translate_to_appbase(request, urn)
         urn = urn_from_request(request)
-        upstream = Upstream.from_urn(urn, upstreams=upstreams)
+    upstream = upstream_from_urn(urn, upstreams=upstreams)  # type: Upstream
 
-    _id = request.get('id', _empty)
-    jsonrpc = request['jsonrpc']
-    method = request['method']
-    params = request.get('params', _empty)
     timings = [(perf_counter(), 'jsonrpc_create')]
-    return JSONRPCRequest(_id,
-                          jsonrpc,
-                          method,
-                          params,
+    deadline = None
+    if upstream.timeout:
+        deadline = request_start_time + upstream.timeout
+    return JSONRPCRequest(request.get('id', _empty),
+                          request['jsonrpc'],
+                          request['method'],
+                          request.get('params', _empty),
                           urn,
                           upstream,
-                          http_request.amzn_trace_id,
-                          http_request.jussi_request_id,
+                          amzn_trace_id,
+                          jussi_request_id,
                           batch_index,
                           original_request,
-                          timings)
+                          timings,
+                          deadline=deadline)
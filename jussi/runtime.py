@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os
+from typing import Callable
+from typing import Dict
+
+import structlog
+from sanic.server import HttpProtocol
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Runtime stats
+#
+# Each subsystem registers a provider, a callable returning the counters it
+# keeps anyway, eg a pool's stats(), when it's set up. /monitor only calls
+# the providers, so it's cheap enough to poll on a busy worker. Providers
+# read app.config when called, so they follow upstream reloads.
+# -------------------
+
+
+class RuntimeStats:
+    """Named stats providers of a worker"""
+
+    def __init__(self) -> None:
+        self._providers = dict()  # type: Dict[str, Callable[[], object]]
+
+    def register(self, name: str, provider: Callable[[], object]) -> None:
+        self._providers[name] = provider
+
+    def unregister(self, name: str) -> None:
+        self._providers.pop(name, None)
+
+    def collect(self) -> dict:
+        stats = dict()
+        for name, provider in self._providers.items():
+            try:
+                stats[name] = provider()
+            except Exception as e:
+                logger.error('error collecting runtime stats', name=name, e=e)
+                stats[name] = None
+        return stats
+
+
+class CountingHttpProtocol(HttpProtocol):
+    """sanic's HttpProtocol, counting the connections of the worker"""
+    __slots__ = ()
+
+    # HttpProtocol has a connections slot, the set of the server's protocols
+    open_connections = 0
+    connections_total = 0
+
+    def connection_made(self, transport):
+        CountingHttpProtocol.open_connections += 1
+        CountingHttpProtocol.connections_total += 1
+        super().connection_made(transport)
+
+    def connection_lost(self, exc):
+        CountingHttpProtocol.open_connections -= 1
+        super().connection_lost(exc)
+
+
+def server_stats() -> dict:
+    return {
+        'pid': os.getpid(),
+        'connections': CountingHttpProtocol.open_connections,
+        'connections_total': CountingHttpProtocol.connections_total
+    }
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from collections import deque
+from typing import Coroutine
+from typing import Dict
+
+import structlog
+
+from .errors import PriorityQueueFullError
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Priority scheduling of upstream requests
+#
+# Every upstream request belongs to a priority class, assigned by the longest
+# matching prefix in the upstream config's "priorities" (unmatched requests
+# belong to DEFAULT_PRIORITY). At most ``concurrency`` requests are dispatched
+# at once. Once that limit is reached requests wait in a bounded FIFO queue per
+# class, and free slots are handed out between the classes by weighted fair
+# queuing: each dispatched request advances its class's virtual time by
+# 1/weight, and the backlogged class with the lowest virtual finish time goes
+# next. A class may also be capped to ``max_concurrency`` in-flight requests,
+# so a few expensive calls can't take every slot even when nothing else is
+# waiting.
+# -------------------
+
+DEFAULT_PRIORITY = 'default'
+DEFAULT_CONCURRENCY = 256
+DEFAULT_MAX_QUEUE_SIZE = 1024
+
+DEFAULT_PRIORITY_CLASSES = {
+    'light': {'weight': 8},
+    'default': {'weight': 4},
+    'heavy': {'weight': 1, 'max_concurrency': 32}
+}
+
+# pylint: disable=too-many-instance-attributes
+
+
+class PriorityClass:
+    __slots__ = ('name',
+                 'weight',
+                 'max_concurrency',
+                 'inflight',
+                 'waiters',
+                 'vtime',
+                 'dispatched',
+                 'shed_count')
+
+    def __init__(self, name: str, weight: float=1, max_concurrency: int=None) -> None:
+        if weight <= 0:
+            raise ValueError(f'priority class {name} weight is expected to be greater than zero')
+        if max_concurrency is not None and max_concurrency <= 0:
+            raise ValueError(
+                f'priority class {name} max_concurrency is expected to be greater than zero')
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.inflight = 0
+        self.waiters = deque()
+        self.vtime = 0.0
+        self.dispatched = 0
+        self.shed_count = 0
+
+    @property
+    def capped(self) -> bool:
+        return self.max_concurrency is not None and self.inflight >= self.max_concurrency
+
+    def stats(self) -> dict:
+        return {
+            'weight': self.weight,
+            'max_concurrency': self.max_concurrency,
+            'inflight': self.inflight,
+            'queued': len(self.waiters),
+            'dispatched': self.dispatched,
+            'shed': self.shed_count
+        }
+
+
+class PriorityScheduler:
+    """Weighted fair queuing of upstream requests between priority classes"""
+
+    __slots__ = ('_loop',
+                 '_classes',
+                 '_concurrency',
+                 '_max_queue_size',
+                 '_inflight',
+                 '_vclock')
+
+    def __init__(self,
+                 classes: Dict[str, dict]=None,
+                 concurrency: int=DEFAULT_CONCURRENCY,
+                 max_queue_size: int=DEFAULT_MAX_QUEUE_SIZE,
+                 loop=None) -> None:
+        if concurrency <= 0:
+            raise ValueError('concurrency is expected to be greater than zero')
+        if max_queue_size < 0:
+            raise ValueError('max_queue_size is expected to be greater than or equal zero')
+        classes = dict(classes or DEFAULT_PRIORITY_CLASSES)
+        classes.setdefault(DEFAULT_PRIORITY, {})
+        self._loop = loop or asyncio.get_event_loop()
+        self._classes = {name: PriorityClass(name, **config)
+                         for name, config in classes.items()}
+        self._concurrency = concurrency
+        self._max_queue_size = max_queue_size
+        self._inflight = 0
+        self._vclock = 0.0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def queued(self) -> int:
+        return sum(len(c.waiters) for c in self._classes.values())
+
+    def priority_class(self, name: str) -> PriorityClass:
+        try:
+            return self._classes[name]
+        except KeyError:
+            return self._classes[DEFAULT_PRIORITY]
+
+    async def acquire(self, name: str) -> PriorityClass:
+        priority_class = self.priority_class(name)
+        if (self._inflight < self._concurrency
+                and not priority_class.capped
+                and not priority_class.waiters):
+            self._dispatch(priority_class)
+            return priority_class
+
+        if len(priority_class.waiters) >= self._max_queue_size:
+            priority_class.shed_count += 1
+            raise PriorityQueueFullError(priority=priority_class.name,
+                                         queue_size=len(priority_class.waiters))
+
+        waiter = self._loop.create_future()
+        priority_class.waiters.append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # a slot was handed to us after we were cancelled,
+                # so pass it along to the next waiter
+                self.release(priority_class)
+            else:
+                try:
+                    priority_class.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+        return priority_class
+
+    def release(self, priority_class: PriorityClass) -> None:
+        self._inflight -= 1
+        priority_class.inflight -= 1
+        self._wake_waiters()
+
+    async def run(self, name: str, coro: Coroutine):
+        """await ``coro`` once its priority class is scheduled"""
+        try:
+            priority_class = await self.acquire(name)
+        except BaseException:
+            coro.close()
+            raise
+        try:
+            return await coro
+        finally:
+            self.release(priority_class)
+
+    def _dispatch(self, priority_class: PriorityClass) -> None:
+        # a class that has been idle doesn't get credit for the time
+        # it didn't use
+        start = max(priority_class.vtime, self._vclock)
+        priority_class.vtime = start + 1 / priority_class.weight
+        self._vclock = start
+        priority_class.inflight += 1
+        priority_class.dispatched += 1
+        self._inflight += 1
+
+    def _next_class(self) -> PriorityClass:
+        next_class = None
+        next_finish = None
+        for priority_class in self._classes.values():
+            if not priority_class.waiters or priority_class.capped:
+                continue
+            finish = max(priority_class.vtime, self._vclock) + 1 / priority_class.weight
+            if next_finish is None or finish < next_finish:
+                next_class, next_finish = priority_class, finish
+        return next_class
+
+    def _wake_waiters(self) -> None:
+        while self._inflight < self._concurrency:
+            priority_class = self._next_class()
+            if priority_class is None:
+                return
+            waiter = priority_class.waiters.popleft()
+            if waiter.done():
+                continue
+            self._dispatch(priority_class)
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self._concurrency,
+            'inflight': self._inflight,
+            'queued': self.queued,
+            'classes': {name: c.stats() for name, c in self._classes.items()}
+        }
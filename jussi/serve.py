@@ -1,17 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import asyncio
+import multiprocessing
 import os
+import signal
 
 import configargparse
 import uvloop
 from sanic import Sanic
 
+import jussi.async_stats
 import jussi.errors
 import jussi.handlers
+import jussi.json
 import jussi.listeners
 import jussi.logging_config
 import jussi.middlewares
+import jussi.runtime
 import jussi.sanic_config
 from jussi.request.http import HTTPRequest
 from jussi.typedefs import WebApp
@@ -45,10 +50,31 @@ def int_or_none(val):
 
 def setup_routes(app: WebApp) -> WebApp:
     app.add_route(jussi.handlers.healthcheck, '/health', methods=['GET', 'HEAD'])
+    app.add_route(jussi.handlers.ready, '/ready', methods=['GET', 'HEAD'])
+    app.add_route(jussi.handlers.metrics, '/metrics', methods=['GET'])
     app.add_route(jussi.handlers.handle_jsonrpc, '/', methods=['POST'])
     return app
 
 
+def forward_reload_signal() -> None:
+    """pass SIGHUP from the main process on to the workers, which reload
+    their upstream config. A single worker runs in the main process and
+    replaces this handler with its own
+    """
+    signal.signal(signal.SIGHUP, forward_signal)
+
+
+def forward_profile_signal() -> None:
+    """pass SIGUSR2, sent by the worker serving /admin/profile?workers=all,
+    from the main process on to the workers, which profile themselves"""
+    signal.signal(signal.SIGUSR2, forward_signal)
+
+
+def forward_signal(signum, frame) -> None:
+    for process in multiprocessing.active_children():
+        os.kill(process.pid, signum)
+
+
 def parse_args(args: list = None):
     """parse CLI args and add them to app.config
     """
@@ -63,6 +89,18 @@ def parse_args(args: list = None):
                         type=lambda x: bool(strtobool(x)),
                         env_var='JUSSI_MONITOR_ROUTE',
                         default=True)
+    parser.add_argument('--upstream_reload_route',
+                        type=lambda x: bool(strtobool(x)),
+                        env_var='JUSSI_UPSTREAM_RELOAD_ROUTE',
+                        default=False,
+                        help='reload the upstream config file on '
+                             'POST /admin/reload, SIGHUP always reloads it')
+    parser.add_argument('--profiler_route',
+                        type=lambda x: bool(strtobool(x)),
+                        env_var='JUSSI_PROFILER_ROUTE',
+                        default=False,
+                        help='sample the stacks of the workers on '
+                             'GET /admin/profile?seconds=10&workers=all')
     parser.add_argument('--server_host', type=str, env_var='JUSSI_SERVER_HOST',
                         default='0.0.0.0')
     parser.add_argument('--server_port', type=int, env_var='JUSSI_SERVER_PORT',
@@ -71,16 +109,33 @@ def parse_args(args: list = None):
                         env_var='JUSSI_SERVER_WORKERS', default=os.cpu_count())
     parser.add_argument('--server_tcp_backlog', type=int,
                         env_var='JUSSI_SERVER_TCP_BACKLOG', default=100)
+    parser.add_argument('--warmup_timeout', type=float,
+                        env_var='JUSSI_WARMUP_TIMEOUT', default=10.0,
+                        help='seconds a worker waits for its upstream connections '
+                             'before /ready reports it ready')
 
     parser.add_argument('--jsonrpc_batch_size_limit', type=int,
                         env_var='JUSSI_JSONRPC_BATCH_SIZE_LIMIT', default=50)
+    parser.add_argument('--json_engine', type=str, env_var='JUSSI_JSON_ENGINE',
+                        choices=sorted(jussi.json.ENGINES),
+                        default=jussi.json.DEFAULT_ENGINE)
 
     # server websocket pool config
     parser.add_argument('--websocket_pool_minsize', type=int,
                         env_var='JUSSI_WEBSOCKET_POOL_MINSIZE', default=8)
     parser.add_argument('--websocket_pool_maxsize',
                         env_var='JUSSI_WEBSOCKET_POOL_MAXSIZE', type=int,
-                        default=8)
+                        default=32)
+    parser.add_argument('--websocket_pool_idle_timeout', type=float,
+                        env_var='JUSSI_WEBSOCKET_POOL_IDLE_TIMEOUT', default=300.0)
+    parser.add_argument('--websocket_pool_ping_interval', type=float,
+                        env_var='JUSSI_WEBSOCKET_POOL_PING_INTERVAL', default=30.0)
+    parser.add_argument('--websocket_pool_ping_timeout', type=float,
+                        env_var='JUSSI_WEBSOCKET_POOL_PING_TIMEOUT', default=10.0)
+    parser.add_argument('--websocket_pool_grow_wait', type=float,
+                        env_var='JUSSI_WEBSOCKET_POOL_GROW_WAIT', default=0.005)
+    parser.add_argument('--websocket_pool_drain_timeout', type=float,
+                        env_var='JUSSI_WEBSOCKET_POOL_DRAIN_TIMEOUT', default=10.0)
     parser.add_argument('--websocket_queue_size',
                         env_var='JUSSI_WEBSOCKET_QUEUE', type=int, default=1)
     parser.add_argument('--websocket_read_limit',
@@ -92,6 +147,50 @@ def parse_args(args: list = None):
                         default=None,
                         type=int_or_none)
 
+    # upstream http connection pool config (per upstream url, may be
+    # overridden by an upstream's "http_pool" in the upstream config file)
+    parser.add_argument('--http_pool_limit', type=int,
+                        env_var='JUSSI_HTTP_POOL_LIMIT', default=100)
+    parser.add_argument('--http_pool_keepalive_timeout', type=float,
+                        env_var='JUSSI_HTTP_POOL_KEEPALIVE_TIMEOUT', default=30.0)
+    parser.add_argument('--http_pool_dns_cache_ttl', type=int,
+                        env_var='JUSSI_HTTP_POOL_DNS_CACHE_TTL', default=10)
+    parser.add_argument('--http_pool_prewarm', type=int,
+                        env_var='JUSSI_HTTP_POOL_PREWARM', default=0)
+
+    # stream uncacheable or large single responses from http upstreams
+    # to the client instead of parsing and re-serializing them
+    parser.add_argument('--upstream_streaming',
+                        type=lambda x: bool(strtobool(x)),
+                        env_var='JUSSI_UPSTREAM_STREAMING', default=False)
+    parser.add_argument('--upstream_streaming_min_size', type=int,
+                        env_var='JUSSI_UPSTREAM_STREAMING_MIN_SIZE', default=2**20)
+
+    # upstream adaptive concurrency limit config
+    parser.add_argument('--upstream_concurrency_limit',
+                        type=lambda x: bool(strtobool(x)),
+                        env_var='JUSSI_UPSTREAM_CONCURRENCY_LIMIT', default=False)
+    parser.add_argument('--upstream_concurrency_initial_limit', type=int,
+                        env_var='JUSSI_UPSTREAM_CONCURRENCY_INITIAL_LIMIT', default=32)
+    parser.add_argument('--upstream_concurrency_min_limit', type=int,
+                        env_var='JUSSI_UPSTREAM_CONCURRENCY_MIN_LIMIT', default=4)
+    parser.add_argument('--upstream_concurrency_max_limit', type=int,
+                        env_var='JUSSI_UPSTREAM_CONCURRENCY_MAX_LIMIT', default=512)
+    parser.add_argument('--upstream_concurrency_queue_size', type=int,
+                        env_var='JUSSI_UPSTREAM_CONCURRENCY_QUEUE_SIZE', default=1024)
+    parser.add_argument('--upstream_concurrency_latency_tolerance', type=float,
+                        env_var='JUSSI_UPSTREAM_CONCURRENCY_LATENCY_TOLERANCE',
+                        default=2.0)
+
+    # upstream priority scheduling config
+    parser.add_argument('--upstream_scheduler',
+                        type=lambda x: bool(strtobool(x)),
+                        env_var='JUSSI_UPSTREAM_SCHEDULER', default=False)
+    parser.add_argument('--upstream_scheduler_concurrency', type=int,
+                        env_var='JUSSI_UPSTREAM_SCHEDULER_CONCURRENCY', default=256)
+    parser.add_argument('--upstream_scheduler_queue_size', type=int,
+                        env_var='JUSSI_UPSTREAM_SCHEDULER_QUEUE_SIZE', default=1024)
+
     # server version
     parser.add_argument('--source_commit', env_var='SOURCE_COMMIT', type=str,
                         default='')
@@ -141,10 +240,33 @@ def parse_args(args: list = None):
                              'asyncio cancel-leak. Must be larger than '
                              '--cache_read_timeout.')
 
+    # rate limits, the rules are "rate_limits" in the upstream config's "limits"
+    parser.add_argument('--rate_limit_slots', type=int,
+                        env_var='JUSSI_RATE_LIMIT_SLOTS', default=65536,
+                        help='token buckets shared by the workers of a host')
+    parser.add_argument('--rate_limit_redis_url', type=str,
+                        env_var='JUSSI_RATE_LIMIT_REDIS_URL', default=None,
+                        help='keep token buckets in redis, shared by every host')
+
     # statsd statsd://host:port
     parser.add_argument('--statsd_url', type=str, env_var='JUSSI_STATSD_URL',
                         help='statsd://host:port',
                         default=None)
+    parser.add_argument('--statsd_flush_interval', type=float,
+                        env_var='JUSSI_STATSD_FLUSH_INTERVAL', default=1.0,
+                        help='seconds between sends of the aggregated stats')
+    parser.add_argument('--statsd_sample_rates',
+                        type=jussi.async_stats.parse_sample_rates,
+                        env_var='JUSSI_STATSD_SAMPLE_RATES', default='',
+                        help='stat prefix=rate,prefix=rate, eg fetch_ws=0.1')
+
+    # event loop lag
+    parser.add_argument('--loop_lag_interval', type=float,
+                        env_var='JUSSI_LOOP_LAG_INTERVAL', default=0.1,
+                        help='seconds between event loop lag samples, 0 to disable')
+    parser.add_argument('--loop_lag_threshold', type=float,
+                        env_var='JUSSI_LOOP_LAG_THRESHOLD', default=0.25,
+                        help='seconds of lag after which the blocking stack is logged')
 
     return parser.parse_args(args=args)
 
@@ -162,6 +284,10 @@ def main():
     app = jussi.middlewares.setup_middlewares(app)
     app = jussi.errors.setup_error_handlers(app)
     app = jussi.listeners.setup_listeners(app)
+    # parsed once here, the workers inherit it
+    jussi.listeners.load_upstream_config(app)
+    jussi.listeners.create_rate_limit_buckets(app)
+    jussi.listeners.setup_metrics_dir(app)
 
     run_config = dict(
         host=app.config.args.server_host,
@@ -169,10 +295,14 @@ def main():
         workers=app.config.args.server_workers,
         access_log=False,
         debug=app.config.args.debug,
-        backlog=app.config.args.server_tcp_backlog)
+        backlog=app.config.args.server_tcp_backlog,
+        protocol=jussi.runtime.CountingHttpProtocol)
 
     app.config.logger.info('app.config', config=app.config)
     app.config.logger.info('app.run', config=run_config)
+    forward_reload_signal()
+    if app.config.args.profiler_route:
+        forward_profile_signal()
     app.run(**run_config)
 
 
@@ -189,6 +319,10 @@ if __name__ == '__main__':
     app = jussi.middlewares.setup_middlewares(app)
     app = jussi.errors.setup_error_handlers(app)
     app = jussi.listeners.setup_listeners(app)
+    # parsed once here, the workers inherit it
+    jussi.listeners.load_upstream_config(app)
+    jussi.listeners.create_rate_limit_buckets(app)
+    jussi.listeners.setup_metrics_dir(app)
 
     run_config = dict(
         host=app.config.args.server_host,
@@ -196,8 +330,12 @@ if __name__ == '__main__':
         workers=app.config.args.server_workers,
         access_log=False,
         debug=app.config.args.debug,
-        backlog=app.config.args.server_tcp_backlog)
+        backlog=app.config.args.server_tcp_backlog,
+        protocol=jussi.runtime.CountingHttpProtocol)
 
     app.config.logger.info('app.config', config=app.config)
     app.config.logger.info('app.run', config=run_config)
+    forward_reload_signal()
+    if app.config.args.profiler_route:
+        forward_profile_signal()
     app.run(**run_config)
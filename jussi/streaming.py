@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import re
+from time import perf_counter as perf
+
+import structlog
+
+from async_timeout import timeout
+from sanic import response
+
+from . import json
+from .cache.ttl import TTL
+from .empty import _empty
+from .errors import UpstreamResponseError
+from .typedefs import HTTPRequest
+from .typedefs import SingleJrpcRequest
+
+logger = structlog.get_logger(__name__)
+
+# -------------------
+# Streaming upstream responses
+#
+# Uncacheable or very large single request responses from http upstreams are
+# streamed to the client as they arrive instead of being read, parsed and
+# re-serialized. The only change made to such a response is replacing the
+# upstream request id with the client's request id.
+#
+# steemd and hivemind write the top-level "id" either first (optionally after
+# "jsonrpc") or last, so only the head and a small tail of the response are
+# ever inspected, and no more than HEAD_SIZE + TAIL_SIZE bytes plus the
+# current chunk are held in memory.
+# -------------------
+
+HEAD_SIZE = 128
+TAIL_SIZE = 128
+
+HEAD_ID_PATTERN = re.compile(
+    rb'^\s*\{\s*(?:"jsonrpc"\s*:\s*"2\.0"\s*,\s*)?"id"\s*:\s*(-?\d+)\s*[,}]')
+TAIL_ID_PATTERN = re.compile(rb',\s*"id"\s*:\s*(-?\d+)\s*\}\s*$')
+
+
+class JsonRpcIdRewriter:
+    """Incrementally replace the top-level id of a JSONRPC response"""
+
+    __slots__ = ('_upstream_id', '_id', '_head', '_tail', '_rewritten')
+
+    def __init__(self, upstream_id: int, jrpc_id) -> None:
+        self._upstream_id = upstream_id
+        if jrpc_id is _empty:
+            jrpc_id = None
+        self._id = json.dumps_bytes(jrpc_id)
+        self._head = b''
+        self._tail = b''
+        self._rewritten = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        """return the bytes of the response that are ready to be sent"""
+        if self._head is not None:
+            self._head += chunk
+            if len(self._head) < HEAD_SIZE:
+                return b''
+            chunk = self._rewrite(HEAD_ID_PATTERN, self._head)
+            self._head = None
+        if self._rewritten:
+            return chunk
+
+        # hold back the tail in case it contains the id
+        data = self._tail + chunk
+        self._tail = data[-TAIL_SIZE:]
+        return data[:-TAIL_SIZE]
+
+    def finish(self) -> bytes:
+        """return the rest of the response once upstream is done sending it"""
+        data = self._tail
+        if self._head is not None:
+            data = self._rewrite(HEAD_ID_PATTERN, self._head)
+            self._head = None
+        if not self._rewritten:
+            data = self._rewrite(TAIL_ID_PATTERN, data)
+        if not self._rewritten:
+            raise ValueError(f'upstream id {self._upstream_id} not found in response')
+        self._tail = b''
+        return data
+
+    def _rewrite(self, pattern, data: bytes) -> bytes:
+        match = pattern.search(data)
+        if not match or int(match.group(1)) != self._upstream_id:
+            return data
+        self._rewritten = True
+        return b''.join((data[:match.start(1)], self._id, data[match.end(1):]))
+
+
+def is_streamable_response(http_request: HTTPRequest,
+                           jrpc_request: SingleJrpcRequest,
+                           upstream_response) -> bool:
+    if upstream_response.status != 200:
+        return False
+    if jrpc_request.upstream.ttl == TTL.NO_CACHE:
+        return True
+    content_length = upstream_response.content_length
+    return content_length is not None and \
+        content_length >= http_request.app.config.args.upstream_streaming_min_size
+
+
+async def stream_upstream_response(http_request: HTTPRequest,
+                                   jrpc_request: SingleJrpcRequest,
+                                   upstream_response) -> response.StreamingHTTPResponse:
+    """stream upstream_response to the client, rewriting its id
+
+    upstream_response is released once it has been streamed
+    """
+    # read the first chunk before any response is sent, so an empty
+    # upstream response can still be returned as a JSONRPC error
+    first_chunk = await upstream_response.content.readany()
+    if not first_chunk:
+        raise UpstreamResponseError(
+            http_request=http_request,
+            jrpc_request=jrpc_request,
+            reason=f'upstream returned empty body with HTTP {upstream_response.status}'
+        )
+    rewriter = JsonRpcIdRewriter(jrpc_request.upstream_id, jrpc_request.id)
+
+    async def streaming_fn(client_response):
+        jrpc_request.timings.append((perf(), 'stream_upstream_response.enter'))
+        try:
+            async with timeout(jrpc_request.remaining):
+                data = rewriter.feed(first_chunk)
+                if data:
+                    await client_response.write(data)
+                async for chunk in upstream_response.content.iter_any():
+                    data = rewriter.feed(chunk)
+                    if data:
+                        await client_response.write(data)
+                await client_response.write(rewriter.finish())
+        except BaseException as e:
+            logger.error('error streaming upstream response',
+                         url=jrpc_request.upstream.url,
+                         request_id=jrpc_request.jussi_request_id,
+                         e=e)
+            upstream_response.close()
+            # headers have already been sent, so the only way to tell the
+            # client the response is incomplete is to drop the connection
+            client_response.protocol.transport.close()
+            raise
+        upstream_response.release()
+        jrpc_request.timings.append((perf(), 'stream_upstream_response.exit'))
+
+    return response.stream(streaming_fn,
+                           content_type='application/json',
+                           headers={'x-jussi-streamed': 'true'})
@@ -1,25 +1,35 @@
 # -*- coding: utf-8 -*-
+import concurrent.futures
 import functools
 import itertools as it
-import json
 import os
 import re
 import socket
+import stat
 from typing import NamedTuple
+from typing import Tuple
+from urllib.parse import unquote
 from urllib.parse import urlparse
 
 import jsonschema
 import pygtrie
 import structlog
-import ujson
 
+from . import json
+from .empty import _empty
 from .errors import InvalidUpstreamHost
 from .errors import InvalidUpstreamURL
+from .scheduler import DEFAULT_PRIORITY
+from .scheduler import DEFAULT_PRIORITY_CLASSES
 
 logger = structlog.get_logger(__name__)
 
 ACCOUNT_TRANSFER_PATTERN = re.compile(r'^\/?(@([^\/\s]+)/transfers|~?witnesses|proposals)$')
 
+# co-located upstreams can be reached over a unix domain socket, the socket
+# path is percent-encoded as the url host, eg http+unix://%2Frun%2Fsteemd.sock/
+UNIX_SOCKET_SCHEMES = ('http+unix', 'ws+unix')
+
 
 # -------------------
 # TTLS
@@ -35,11 +45,35 @@ ACCOUNT_TRANSFER_PATTERN = re.compile(r'^\/?(@([^\/\s]+)/transfers|~?witnesses|p
 # -------------------
 
 
+# certain steemd.get_state paths must be routed differently
+ACCOUNT_TRANSFER_APIS = ('database_api', 'condenser_api')
+
+# first component of prefixes that only match certain params,
+# eg steemd.database_api.get_state.params=["/trending"]
+PARAMS_COMPONENT = 'params'
+
+
+class Route(NamedTuple):
+    url: str
+    ttl: int
+    timeout: int
+    priority: str
+    url_error: str
+
+
 UPSTREAM_SCHEMA_FILE = 'upstreams_schema.json'
-with open(UPSTREAM_SCHEMA_FILE) as f:
-    UPSTREAM_SCHEMA = json.load(f)
-jsonschema.Draft4Validator.check_schema(UPSTREAM_SCHEMA)
-#CONFIG_VALIDATOR = jsonschema.Draft4Validator(UPSTREAM_SCHEMA)
+
+# max hostnames resolved at once by _Upstreams.validate_urls
+MAX_VALIDATION_THREADS = 16
+
+
+@functools.lru_cache(1)
+def upstream_schema() -> dict:
+    """the upstream config schema, loaded on first use rather than at import"""
+    with open(UPSTREAM_SCHEMA_FILE) as f:
+        schema = json.loads(f.read())
+    jsonschema.Draft4Validator.check_schema(schema)
+    return schema
 
 
 class _Upstreams(object):
@@ -48,12 +82,19 @@ class _Upstreams(object):
     __TTLS = None
     __TIMEOUTS = None
     __TRANSLATE_TO_APPBASE = None
+    __HTTP_POOLS = None
+    __MICRO_BATCHES = None
+    __PRIORITIES = None
+    __ROUTES = None
+    __PARAM_ROUTES = None
+    __NO_ROUTE = None
 
     def __init__(self, config, validate=True):
         upstream_config = config['upstreams']
         # CONFIG_VALIDATOR.validate(upstream_config)
         self.config = upstream_config
-        self.__hash = hash(ujson.dumps(self.config))
+        self.priority_classes = config.get('priority_classes') or DEFAULT_PRIORITY_CLASSES
+        self.__hash = hash(json.dumps(self.config))
 
         self.__NAMESPACES = frozenset(c['name'] for c in self.config)
         for namespace in self.__NAMESPACES:
@@ -65,16 +106,31 @@ class _Upstreams(object):
         self.__URLS = self.__build_trie('urls')
         self.__TTLS = self.__build_trie('ttls')
         self.__TIMEOUTS = self.__build_trie('timeouts')
+        self.__PRIORITIES = self.__build_trie('priorities')
+        for prefix, priority in self.__PRIORITIES.items():
+            assert priority in self.priority_classes,\
+                f'Invalid priority {priority} for {prefix} : No such priority class'
+
+        self.__ACCOUNT_TRANSFER_URL = os.environ.get('JUSSI_ACCOUNT_TRANSFER_STEEMD_URL')
+        self.__compile_routes()
 
         self.__TRANSLATE_TO_APPBASE = frozenset(
             c['name'] for c in self.config if c.get('translate_to_appbase', False) is True)
 
+        self.__HTTP_POOLS = {
+            url: c['http_pool'] for c in self.config if 'http_pool' in c
+            for _, url in self.__iter_pairs(c['urls'])}
+
+        self.__MICRO_BATCHES = {
+            url: c['micro_batch'] for c in self.config if 'micro_batch' in c
+            for _, url in self.__iter_pairs(c['urls']) if url.startswith('http')}
+
         if validate:
             self.validate_urls()
 
-    def __build_trie(self, key):
-        trie = pygtrie.StringTrie(separator='.')
-        for item in it.chain.from_iterable(c[key] for c in self.config):
+    @staticmethod
+    def __iter_pairs(items):
+        for item in items:
             if isinstance(item, list):
                 prefix, value = item
             else:
@@ -83,40 +139,102 @@ class _Upstreams(object):
                 value_key = keys[keys.index(prefix_key) - 1]
                 prefix = item[prefix_key]
                 value = item[value_key]
+            yield prefix, value
+
+    def __build_trie(self, key):
+        trie = pygtrie.StringTrie(separator='.')
+        for prefix, value in self.__iter_pairs(
+                it.chain.from_iterable(c.get(key, []) for c in self.config)):
             trie[prefix] = value
         return trie
 
-    @functools.lru_cache(8192)
-    def url(self, request_urn) -> str:
-        # certain steemd.get_state paths must be routed differently
-        if (request_urn.api in ['database_api', 'condenser_api']
+    def __compile_routes(self):
+        """flatten the tries into a table of routes keyed on every configured
+        prefix, eg steemd.database_api.get_block, steemd.database_api and steemd
+
+        Prefixes that only match certain params are left to the tries, the
+        methods they belong to are kept in __PARAM_ROUTES
+        """
+        tries = (self.__URLS, self.__TTLS, self.__TIMEOUTS, self.__PRIORITIES)
+        prefixes = set()
+        param_routes = set()
+        for trie in tries:
+            for prefix in trie.keys():
+                components = prefix.split('.')
+                for i, component in enumerate(components):
+                    if component.startswith(PARAMS_COMPONENT):
+                        param_routes.add('.'.join(components[:i]))
+                        break
+                else:
+                    prefixes.add(prefix)
+        if self.__ACCOUNT_TRANSFER_URL:
+            param_routes.update(f'{namespace}.{api}.get_state'
+                                for namespace in it.chain(self.__NAMESPACES, ['appbase'])
+                                for api in ACCOUNT_TRANSFER_APIS)
+        self.__ROUTES = {prefix: self.__trie_route(prefix) for prefix in prefixes}
+        self.__PARAM_ROUTES = frozenset(param_routes)
+        self.__NO_ROUTE = self.__trie_route('')
+
+    def __trie_route(self, key: str) -> Route:
+        _, url = self.__URLS.longest_prefix(key)
+        _, ttl = self.__TTLS.longest_prefix(key)
+        _, timeout = self.__TIMEOUTS.longest_prefix(key)
+        _, priority = self.__PRIORITIES.longest_prefix(key)
+        url_error = None
+        if not url:
+            url_error = 'No matching url found'
+        elif not (url.startswith('ws') or url.startswith('http')):
+            url_error = 'invalid format'
+        return Route(url, ttl, timeout or None, priority or DEFAULT_PRIORITY, url_error)
+
+    def route(self, request_urn) -> Route:
+        """url, ttl, timeout and priority for request_urn, found with a single
+        lookup unless its method has param-specific settings
+        """
+        if request_urn.api is _empty:
+            components = (request_urn.namespace, request_urn.method)
+        else:
+            components = (request_urn.namespace, str(request_urn.api), request_urn.method)
+        method_key = '.'.join(components)
+        if method_key in self.__PARAM_ROUTES:
+            return self.__param_route(request_urn)
+        routes = self.__ROUTES
+        route = routes.get(method_key)
+        if route is not None:
+            return route
+        for i in range(len(components) - 1, 0, -1):
+            route = routes.get('.'.join(components[:i]))
+            if route is not None:
+                return route
+        return self.__NO_ROUTE
+
+    def __param_route(self, request_urn) -> Route:
+        if (self.__ACCOUNT_TRANSFER_URL
+                and request_urn.api in ACCOUNT_TRANSFER_APIS
                 and request_urn.method == 'get_state'
                 and isinstance(request_urn.params, list)
                 and len(request_urn.params) == 1
+                and isinstance(request_urn.params[0], str)
                 and ACCOUNT_TRANSFER_PATTERN.match(request_urn.params[0])):
-            url = os.environ.get('JUSSI_ACCOUNT_TRANSFER_STEEMD_URL')
-            if url:
-                return url
+            route = self.__trie_route(str(request_urn))
+            return route._replace(url=self.__ACCOUNT_TRANSFER_URL, url_error=None)
+        return self.__trie_route(str(request_urn))
 
-        _, url = self.__URLS.longest_prefix(str(request_urn))
-        if not url:
+    def url(self, request_urn) -> str:
+        route = self.route(request_urn)
+        if route.url_error:
             raise InvalidUpstreamURL(
-                url=url, reason='No matching url found', urn=str(request_urn))
-        elif url.startswith('ws') or url.startswith('http'):
-            return url
-        raise InvalidUpstreamURL(url=url, reason='invalid format', urn=str(request_urn))
+                url=route.url, reason=route.url_error, urn=str(request_urn))
+        return route.url
 
-    @functools.lru_cache(8192)
     def ttl(self, request_urn) -> int:
-        _, ttl = self.__TTLS.longest_prefix(str(request_urn))
-        return ttl
+        return self.route(request_urn).ttl
 
-    @functools.lru_cache(8192)
     def timeout(self, request_urn) -> int:
-        _, timeout = self.__TIMEOUTS.longest_prefix(str(request_urn))
-        if timeout == 0:
-            timeout = None
-        return timeout
+        return self.route(request_urn).timeout
+
+    def priority(self, request_urn) -> str:
+        return self.route(request_urn).priority
 
     @property
     def urls(self) -> frozenset:
@@ -126,35 +244,81 @@ class _Upstreams(object):
     def namespaces(self)-> frozenset:
         return self.__NAMESPACES
 
+    def http_pool(self, url) -> dict:
+        return self.__HTTP_POOLS.get(url, {})
+
+    def micro_batch(self, url) -> dict:
+        return self.__MICRO_BATCHES.get(url, {})
+
     def translate_to_appbase(self, request_urn) -> bool:
         return request_urn.namespace in self.__TRANSLATE_TO_APPBASE
 
     def validate_urls(self):
         logger.info('testing upstream urls')
-        for url in self.urls:
-            try:
-                parsed_url = urlparse(url)
-                host = urlparse(url).hostname
-                logger.info('attempting to add uptream url', url=parsed_url)
-                socket.gethostbyname(host)
-                logger.info('added upstream url', url=parsed_url)
-            except socket.gaierror:
-                raise InvalidUpstreamHost(url=url)
-            except Exception as e:
-                raise InvalidUpstreamURL(url=url, reason=str(e))
+        # resolve every hostname at once, the first invalid url in sorted
+        # order is raised
+        urls = sorted(self.urls)
+        if not urls:
+            return
+        workers = min(len(urls), MAX_VALIDATION_THREADS)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(validate_url, urls):
+                pass
 
     def __hash__(self):
         return self.__hash
 
 
+def validate_url(url: str) -> None:
+    try:
+        parsed_url = urlparse(url)
+        logger.info('attempting to add uptream url', url=parsed_url)
+        if is_unix_socket_url(url):
+            socket_path, _ = parse_unix_socket_url(url)
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError(f'{socket_path} is not a unix socket')
+        else:
+            socket.gethostbyname(parsed_url.hostname)
+        logger.info('added upstream url', url=parsed_url)
+    except socket.gaierror:
+        raise InvalidUpstreamHost(url=url)
+    except Exception as e:
+        raise InvalidUpstreamURL(url=url, reason=str(e))
+
+
+def is_unix_socket_url(url: str) -> bool:
+    return url.startswith(UNIX_SOCKET_SCHEMES)
+
+
+@functools.lru_cache(256)
+def parse_unix_socket_url(url: str) -> Tuple[str, str]:
+    """split a http+unix:// or ws+unix:// url into the unix socket path
+    and the url to request over that socket
+
+    >>> parse_unix_socket_url('ws+unix://%2Frun%2Fsteemd.sock/ws')
+    ('/run/steemd.sock', 'ws://localhost/ws')
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in UNIX_SOCKET_SCHEMES:
+        raise ValueError(f'{url} is not a unix socket url')
+    socket_path = unquote(parsed.netloc)
+    if not socket_path:
+        raise ValueError(f'{url} has no unix socket path')
+    scheme = parsed.scheme.split('+')[0]
+    request_url = parsed._replace(scheme=scheme, netloc='localhost',
+                                  path=parsed.path or '/').geturl()
+    return socket_path, request_url
+
+
 class Upstream(NamedTuple):
     url: str
     ttl: int
     timeout: int
 
     @classmethod
-    @functools.lru_cache(4096)
     def from_urn(cls, urn, upstreams: _Upstreams=None):
-        return Upstream(upstreams.url(urn),
-                        upstreams.ttl(urn),
-                        upstreams.timeout(urn))
+        route = upstreams.route(urn)
+        if route.url_error:
+            raise InvalidUpstreamURL(
+                url=route.url, reason=route.url_error, urn=str(urn))
+        return Upstream(route.url, route.ttl, route.timeout)
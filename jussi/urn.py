@@ -1,14 +1,14 @@
 # -*- coding: utf-8 -*-
-import functools
 import re
 import reprlib
 from typing import Dict
+from typing import Optional
 from typing import TypeVar
 from typing import Union
 
 import structlog
-import ujson
 
+from . import json
 from .empty import Empty
 from .empty import _empty
 from .errors import InvalidNamespaceAPIError
@@ -33,7 +33,8 @@ FIELD_KEYS = ('namespace', 'api', 'method', 'params')
 
 
 class URN:
-    __slots__ = ('namespace', 'api', 'method', 'params', '__cached_str')
+    __slots__ = ('namespace', 'api', 'method', 'params',
+                 '__cached_str', '__cached_key', '__cached_hash')
 
     def __init__(self, namespace: str, api: APIType, method: str, params: ParamsType) -> None:
         self.namespace = namespace
@@ -41,6 +42,8 @@ class URN:
         self.method = method
         self.params = params
         self.__cached_str = None
+        self.__cached_key = None
+        self.__cached_hash = None
 
     def __repr__(self) -> str:
         return f'URN(namespace={self.namespace}, api={self.api}, method={self.method}, params={reprlib.repr(self.params)})'
@@ -49,8 +52,10 @@ class URN:
         if self.__cached_str:
             return self.__cached_str
         params = self.params
-        if self.params is not _empty:
-            params = f'params={ujson.dumps(self.params, ensure_ascii=False)}'
+        if params is not _empty:
+            if isinstance(params, dict):
+                params = dict(sorted(params.items()))
+            params = f'params={json.dumps(params)}'
 
         api = self.api
         if api is not _empty:
@@ -71,85 +76,116 @@ class URN:
             'params': self.params
         }
 
+    @property
+    def key(self) -> tuple:
+        """hashable canonical form, equal for urns with the same str()"""
+        if self.__cached_key is None:
+            self.__cached_key = (self.namespace,
+                                 None if self.api is _empty else str(self.api),
+                                 self.method,
+                                 _canonical(self.params))
+        return self.__cached_key
+
     def __hash__(self) -> int:
-        return hash(str(self))
+        if self.__cached_hash is None:
+            self.__cached_hash = hash(self.key)
+        return self.__cached_hash
 
     def __eq__(self, urn) -> bool:
-        return hash(urn) == hash(self)
+        if self is urn:
+            return True
+        if not isinstance(urn, URN):
+            return NotImplemented
+        return hash(self) == hash(urn) and self.key == urn.key
+
+
+def method_name(urn: URN) -> str:
+    """namespace.api.method, without params"""
+    if urn.api is _empty or urn.api is None:
+        return f'{urn.namespace}.{urn.method}'
+    return f'{urn.namespace}.{urn.api}.{urn.method}'
+
+
+_EMPTY_KEY = (Empty,)
+
+
+def _canonical(value):
+    # values are tagged with their type, so params that serialize
+    # differently, eg [1] and [true], stay different
+    if value is _empty:
+        return _EMPTY_KEY
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((k, _canonical(v)) for k, v in value.items())))
+    if isinstance(value, list):
+        return (list, tuple(_canonical(v) for v in value))
+    return (value.__class__, value)
 
 
-@functools.lru_cache(8192)
 def _parse_jrpc_method(jrpc_method: str) -> ParsedRequestDict:
     return JRPC_METHOD_REGEX.match(jrpc_method).groupdict(default=_empty)
 
-# pylint: disable=too-many-branches
+
+# jsonrpc method -> (namespace, api, method), None for "call" whose parts
+# depend on its params. Filled the first time a method is seen so the regex
+# only runs for unknown methods
+_METHODS = dict()
+MAX_METHODS = 8192
+
+
+def _method_parts(jrpc_method: str) -> Optional[tuple]:
+    try:
+        return _METHODS[jrpc_method]
+    except KeyError:
+        pass
+    matched = _parse_jrpc_method(jrpc_method)
+    if matched.get('appbase_api'):
+        parts = ('appbase', matched['appbase_api'], matched['appbase_method'])
+    elif matched.get('namespace'):
+        if matched['namespace'] == 'jsonrpc':
+            parts = ('appbase', 'jsonrpc', matched['method'])
+        else:
+            parts = (matched['namespace'], matched.get('api'), matched['method'])
+    elif matched['bare_method']:
+        if matched['bare_method'] == 'call':
+            parts = None
+        else:
+            parts = ('steemd', 'database_api', matched['bare_method'])
+    else:
+        raise InvalidNamespaceError(namespace=jrpc_method, matched=matched)
+    if len(_METHODS) < MAX_METHODS:
+        _METHODS[jrpc_method] = parts
+    return parts
 
 
 def _parse_jrpc(single_jsonrpc_request) -> dict:
+    return dict(zip(FIELD_KEYS, _parse_jrpc_parts(single_jsonrpc_request)))
+
+
+def _parse_jrpc_parts(single_jsonrpc_request) -> tuple:
+    """(namespace, api, method, params) of a jsonrpc request"""
     try:
-        method = single_jsonrpc_request['method']
         params = single_jsonrpc_request.get('params', _empty)
-        matched = _parse_jrpc_method(method)
-
-        if matched.get('appbase_api'):
-            return {
-                'namespace': 'appbase',
-                'api': matched['appbase_api'],
-                'method': matched['appbase_method'],
-                'params': params
-            }
-        if matched.get('namespace'):
-            if matched['namespace'] == 'jsonrpc':
-                return {
-                    'namespace': 'appbase',
-                    'api': 'jsonrpc',
-                    'method': matched['method'],
-                    'params': params
-                }
-            return {
-                'namespace': matched['namespace'],
-                'api': matched.get('api'),
-                'method': matched['method'],
-                'params': params
-            }
-        if matched['bare_method']:
-            method = matched['bare_method']
-
-            if method != 'call':
-                return {
-                    'namespace': 'steemd',
-                    'api': 'database_api',
-                    'method': method,
-                    'params': params
-                }
-
-            if len(params) != 3:
+        parts = _method_parts(single_jsonrpc_request['method'])
+        if parts is not None:
+            return parts + (params,)
+
+        if len(params) != 3:
+            namespace = 'appbase'
+            api, method = params
+            _params = _empty
+        else:
+            api, method, _params = params
+            if api == 'condenser_api' or isinstance(_params, dict) or api == 'jsonrpc':
                 namespace = 'appbase'
-                api, method = params
-                _params = _empty
             else:
-                api, method, _params = params
-                if api == 'condenser_api' or isinstance(_params, dict) or api == 'jsonrpc':
-                    namespace = 'appbase'
-                else:
-                    namespace = 'steemd'
-            if isinstance(api, int):
-                try:
-                    api = STEEMD_NUMERIC_API_MAPPING[api]
-                except IndexError:
-                    raise InvalidNamespaceAPIError(namespace='steemd',
-                                                   api=api)
-
-            return {
-                'namespace': namespace,
-                'api': api,
-                'method': method,
-                'params': _params
-            }
-        else:
-            raise InvalidNamespaceError(jrpc_request=single_jsonrpc_request,
-                                        namespace=single_jsonrpc_request['method'],
-                                        matched=matched, params=params)
+                namespace = 'steemd'
+        if isinstance(api, int):
+            try:
+                api = STEEMD_NUMERIC_API_MAPPING[api]
+            except IndexError:
+                raise InvalidNamespaceAPIError(namespace='steemd',
+                                               api=api)
+        return namespace, api, method, _params
     except InvalidNamespaceAPIError as e:
         raise e
     except InvalidNamespaceError as e:
@@ -157,14 +193,22 @@ def _parse_jrpc(single_jsonrpc_request) -> dict:
     except Exception as e:
         raise InvalidNamespaceError(namespace=single_jsonrpc_request['method'],
                                     exception=e)
-    # pylint: enable=too-many-branches
+
+
+# urns of calls without params, eg get_dynamic_global_properties, keyed on
+# method. Urns with params, even [], aren't interned: their params are the
+# request's own, mutable, list
+_INTERNED_URNS = dict()
+MAX_INTERNED_URNS = 1024
 
 
 def from_request(single_jsonrpc_request: dict) -> URN:
-    parsed = _parse_jrpc(single_jsonrpc_request)
-    if isinstance(parsed['params'], dict):
-        parsed['params'] = dict(sorted(parsed['params'].items()))
-    return URN(parsed['namespace'],
-               parsed['api'],
-               parsed['method'],
-               parsed['params'])
+    if 'params' not in single_jsonrpc_request:
+        urn = _INTERNED_URNS.get(single_jsonrpc_request['method'])
+        if urn is not None:
+            return urn
+        urn = URN(*_parse_jrpc_parts(single_jsonrpc_request))
+        if len(_INTERNED_URNS) < MAX_INTERNED_URNS:
+            _INTERNED_URNS[single_jsonrpc_request['method']] = urn
+        return urn
+    return URN(*_parse_jrpc_parts(single_jsonrpc_request))
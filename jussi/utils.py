@@ -24,5 +24,20 @@ def async_nowait_middleware(middleware_func: Callable) -> Callable:
     """
     @functools.wraps(middleware_func)
     async def f(request: HTTPRequest, response: Optional[HTTPResponse]=None) -> None:
-        asyncio.ensure_future(asyncio.shield(middleware_func(request, response)))
+        NOWAIT_TASKS['pending'] += 1
+        task = asyncio.ensure_future(asyncio.shield(middleware_func(request, response)))
+        task.add_done_callback(_nowait_task_done)
     return f
+
+
+# post-response middleware tasks, see async_nowait_middleware
+NOWAIT_TASKS = {'pending': 0, 'done': 0}
+
+
+def _nowait_task_done(task: asyncio.Future) -> None:
+    NOWAIT_TASKS['pending'] -= 1
+    NOWAIT_TASKS['done'] += 1
+
+
+def nowait_task_stats() -> dict:
+    return dict(NOWAIT_TASKS)
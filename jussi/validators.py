@@ -1,18 +1,22 @@
 # -*- coding: utf-8 -*-
 import itertools as it
+import re
 from typing import NoReturn
 
 import structlog
 
+from jussi import json
 from jussi.request.jsonrpc import JSONRPCRequest
 
 #from .errors import InvalidRequest
 from .errors import JussiCustomJsonOpLengthError
 from .errors import JussiLimitsError
 from .errors import JussiAccountHistoryLimitsError
+from .scanner import scan_response
 from .typedefs import JrpcRequest
 from .typedefs import JrpcResponse
 from .typedefs import RawRequest
+from .typedefs import SingleRawRequest
 from .typedefs import SingleJrpcResponse
 
 logger = structlog.get_logger(__name__)
@@ -28,6 +32,8 @@ GET_BLOCK_RESULT_KEYS = {"previous",
                          "signing_key",
                          "transaction_ids"}
 
+RAW_BLOCK_ID_PATTERN = re.compile(rb'"block_id"\s*:\s*"([0-9a-fA-F]{8})')
+
 JSONRPC_REQUEST_KEYS = {'id', 'jsonrpc', 'method', 'params'}
 JSONRPC_RESPONSE_KEYS = {'id', 'jsonrpc', 'result', 'error'}
 
@@ -52,24 +58,23 @@ BROADCAST_TRANSACTION_METHODS = {
 def validate_jsonrpc_request(request: RawRequest) -> NoReturn:
     from .errors import InvalidRequest
     if isinstance(request, dict):
-        assert JSONRPC_REQUEST_KEYS.issuperset(request.keys()) and \
-            request['jsonrpc'] == '2.0' and \
-            isinstance(request['method'], str) and \
-            isinstance(request.get('id', None), ID_TYPES) and \
-            isinstance(request.get('params', None), (list, dict, type(None)))
+        validate_single_jsonrpc_request(request)
     elif isinstance(request, list) and request:
         for r in request:
-            assert JSONRPC_REQUEST_KEYS.issuperset(r.keys()) and \
-                r['jsonrpc'] == '2.0' and \
-                isinstance(r['method'], str) and \
-                isinstance(r.get('id'), ID_TYPES) and \
-                isinstance(r.get('params'), PARAMS_TYPES)
+            validate_single_jsonrpc_request(r)
     elif isinstance(request, JSONRPCRequest):
         pass  # already be validated
     else:
         raise InvalidRequest(request=request)
 
 
+def validate_single_jsonrpc_request(request: SingleRawRequest) -> NoReturn:
+    assert JSONRPC_REQUEST_KEYS.issuperset(request.keys()) and \
+        request['jsonrpc'] == '2.0' and \
+        isinstance(request['method'], str) and \
+        isinstance(request.get('id'), ID_TYPES) and \
+        isinstance(request.get('params'), PARAMS_TYPES)
+
 #
 # is_valid_* methods return True or False, but they don't raise
 #
@@ -172,6 +177,46 @@ def is_valid_get_block_response(
     return False
 
 
+def is_valid_get_block_response_raw(
+        request: JSONRPCRequest,
+        raw_response: bytes) -> bool:
+    """is_valid_get_block_response for an undecoded response, which only
+    decodes the block_id of the response's result
+    """
+    if not is_get_block_request(request):
+        return False
+    scanned = scan_response(raw_response)
+    if scanned is None:
+        try:
+            return is_valid_get_block_response(request, json.loads(raw_response))
+        except ValueError:
+            return False
+    if scanned.key != b'result':
+        return False
+    try:
+        params = request.urn.params
+        if isinstance(params, list):
+            request_block_num = params[0]
+        elif isinstance(params, dict):
+            request_block_num = params['block_num']
+        else:
+            raise ValueError(f'bad urn params from {request}: {params} ')
+
+        # block_id follows the transactions in both condenser_api and
+        # block_api results, so search backwards from the end of the result
+        pos = raw_response.rfind(b'"block_id"', scanned.value_start, scanned.value_end)
+        if pos == -1:
+            return False  # null result, block does not exist yet
+        match = RAW_BLOCK_ID_PATTERN.match(raw_response, pos, scanned.value_end)
+        if not match:
+            return False
+        return int(request_block_num) == int(match.group(1), base=16)
+    except Exception as e:
+        logger.error('is_valid_get_block_response_raw error', e=e,
+                     jid=request.jussi_request_id)
+    return False
+
+
 def is_broadcast_transaction_request(request: JSONRPCRequest) -> bool:
     return request.urn.method in BROADCAST_TRANSACTION_METHODS
 
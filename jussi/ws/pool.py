@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import random
+import socket
 
 import structlog
 # pylint: disable=no-name-in-module
 from websockets import WebSocketClientProtocol as WSConn
 from websockets import connect as websockets_connect
 
+from ..errors import UpstreamUnavailableError
+from ..histogram import Histogram
+from ..scanner import response_id
+from ..upstream import is_unix_socket_url
+from ..upstream import parse_unix_socket_url
+
 # pylint: enable=no-name-in-module
 logger = structlog.get_logger(__name__)
 
@@ -54,6 +62,48 @@ STEEMIT_MAX_BLOCK_SIZE = 65536  # get_dynamic_global_properties['maximum_block_s
 MAX_WEBSOCKET_RECV_SIZE = None  # no limit
 MAX_WEBSOCKET_READ_LIMIT = STEEMIT_MAX_BLOCK_SIZE + 1000
 
+# -------------------
+# Elastic pool sizing
+#
+# Holders for up to ``maxsize`` connections exist from the start, but only
+# ``minsize`` are connected up front. Only holders with an open connection
+# are ever in the pool queue, so acquire never hands out a broken connection
+# or connects inline. Connections are opened by background tasks, retrying
+# with exponential backoff:
+#  - when a connection dies, its holder is reconnected
+#  - when acquire finds the queue empty, a spare holder is connected
+# A maintenance task runs every ``maintenance_interval`` seconds and, for
+# idle connections only:
+#  - closes connections idle for longer than ``idle_timeout``, down to minsize
+#  - pings connections idle for longer than ``ping_interval`` and reconnects
+#    those that don't answer within ``ping_timeout``, so dead connections are
+#    found off the request path
+#  - connects ``GROW_STEP`` more holders ahead of demand while the average
+#    acquire wait is above ``grow_wait``, and keeps at least minsize
+# Holders are taken out of the pool queue while being maintained, so
+# maintenance never touches a connection that is in use.
+#
+# The pool is degraded when it has no open connections and the last attempt
+# to open one failed, acquire then fails immediately instead of waiting.
+#
+# A request cancelled after sending leaves its response in flight. Instead
+# of closing the connection, ``drain`` waits in the background for the late
+# response, matched by upstream id, for up to ``drain_timeout`` seconds and
+# then releases the connection. Only if no response arrives in time is the
+# connection closed, counted as lost to cancellation.
+# -------------------
+DEFAULT_IDLE_TIMEOUT = 300.0
+DEFAULT_PING_INTERVAL = 30.0
+DEFAULT_PING_TIMEOUT = 10.0
+DEFAULT_GROW_WAIT = 0.005
+DEFAULT_MAINTENANCE_INTERVAL = 5.0
+DEFAULT_DRAIN_TIMEOUT = 10.0
+GROW_STEP = 4
+RECONNECT_BACKOFF_BASE = 0.1
+RECONNECT_BACKOFF_MAX = 10.0
+# weight of the latest acquire wait in the average acquire wait
+WAIT_EWMA_ALPHA = 0.1
+
 
 # pylint: disable=protected-access
 class PoolConnectionProxy:
@@ -88,7 +138,10 @@ class PoolConnectionHolder:
                  '_max_queries',
                  '_in_use',
                  '_queries',
-                 '_timeout'
+                 '_timeout',
+                 '_connected_at',
+                 '_released_at',
+                 '_pinged_at'
                  )
 
     def __init__(self, pool, *, max_queries: int):
@@ -100,6 +153,18 @@ class PoolConnectionHolder:
         self._proxy = None
         self._timeout = None
         self._queries = 0
+        self._connected_at = None
+        self._released_at = None
+        self._pinged_at = None
+
+    @property
+    def connected(self) -> bool:
+        return self._con is not None and self._con.open
+
+    @property
+    def last_active(self) -> float:
+        """when the connection was last known to be alive"""
+        return max(self._released_at, self._pinged_at or 0)
 
     async def connect(self):
         if self._con is not None:
@@ -107,11 +172,36 @@ class PoolConnectionHolder:
                 'PoolConnectionHolder.connect() called while another '
                 'connection already exists')
         self._con = await self._pool._get_new_connection()
+        self._connected_at = self._released_at = self._pool._loop.time()
+
+    async def ping(self, timeout: float) -> bool:
+        """ping an idle connection, terminating it if there is no pong"""
+        try:
+            pong_waiter = await self._con.ping()
+            await asyncio.wait_for(pong_waiter, timeout=timeout, loop=self._pool._loop)
+            self._pinged_at = self._pool._loop.time()
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info('terminating unresponsive ws conn', e=e)
+            self.terminate()
+            return False
+
+    async def close_idle(self):
+        """close an idle connection, leaving the holder spare"""
+        con = self._con
+        self._con = None
+        self._connected_at = None
+        try:
+            await con.close()
+        except Exception as e:
+            logger.info('error closing idle ws conn', e=e)
 
     async def acquire(self) -> PoolConnectionProxy:
-        if self._con is None or not self._con.open:
-            self._con = None
-            await self.connect()
+        if not self.connected:
+            raise ValueError(
+                'PoolConnectionHolder.acquire() called without an open connection')
         self._in_use = self._pool._loop.create_future()
         self._proxy = PoolConnectionProxy(self, self._con)
         return self._proxy
@@ -122,17 +212,21 @@ class PoolConnectionHolder:
                 'PoolConnectionHolder.release() called on '
                 'a free connection holder')
 
-        if self._con.closed:
-            # When closing, pool connections perform the necessary
-            # cleanup, so we don't have to do anything else here.
+        if not self.connected:
+            # the connection died while in use, _release() hands the
+            # holder to the pool to reconnect
+            self._con = None
+            self._release()
             return
 
         self._timeout = None
 
         if self._max_queries and self._queries >= self._max_queries:
             # The connection has reached its maximum utilization limit,
-            # so close it.  Connection.close() will call _release().
+            # so close it and have the pool open a new one.
             await self._con.close(timeout=timeout)
+            self._con = None
+            self._release()
             return
 
         # Free this connection holder and invalidate the
@@ -159,8 +253,8 @@ class PoolConnectionHolder:
             self._release_on_close()
 
     def _release_on_close(self):
-        self._release()
         self._con = None
+        self._release()
 
     def _release(self):
         """Release this connection holder."""
@@ -171,9 +265,13 @@ class PoolConnectionHolder:
         if not self._in_use.done():
             self._in_use.set_result(None)
         self._in_use = None
+        self._released_at = self._pool._loop.time()
 
-        # Put ourselves back to the pool queue.
-        self._pool._queue.put_nowait(self)
+        if self.connected:
+            # Put ourselves back to the pool queue.
+            self._pool._queue.put_nowait(self)
+        else:
+            self._pool._reconnect(self)
 
 # pylint: disable=too-many-instance-attributes,too-many-arguments,protected-access
 
@@ -191,10 +289,29 @@ class Pool:
                  '_maxsize',
                  '_connect_url',
                  '_connect_kwargs',
+                 '_unix_socket_path',
                  '_holders',
                  '_initialized',
                  '_closing',
-                 '_closed')
+                 '_closed',
+                 '_idle_timeout',
+                 '_ping_interval',
+                 '_ping_timeout',
+                 '_grow_wait',
+                 '_maintenance_interval',
+                 '_maintenance_task',
+                 '_spare',
+                 '_connecting',
+                 '_connect_failures',
+                 '_connect_failed',
+                 '_drain_timeout',
+                 '_draining',
+                 '_wait_ewma',
+                 'acquire_wait',
+                 'reaped_count',
+                 'ping_failure_count',
+                 'drained_count',
+                 'cancel_lost_count')
 
     def __init__(self,
                  pool_min_size: int,
@@ -202,6 +319,12 @@ class Pool:
                  pool_max_queries: int,
                  pool_loop,
                  connect_url: str,
+                 pool_idle_timeout: float=DEFAULT_IDLE_TIMEOUT,
+                 pool_ping_interval: float=DEFAULT_PING_INTERVAL,
+                 pool_ping_timeout: float=DEFAULT_PING_TIMEOUT,
+                 pool_grow_wait: float=DEFAULT_GROW_WAIT,
+                 pool_maintenance_interval: float=DEFAULT_MAINTENANCE_INTERVAL,
+                 pool_drain_timeout: float=DEFAULT_DRAIN_TIMEOUT,
                  **connect_kwargs):
 
         if pool_loop is None:
@@ -221,8 +344,31 @@ class Pool:
         if pool_max_queries < 0:
             raise ValueError('max_queries is expected to be greater than or equal zero')
 
+        if pool_maintenance_interval <= 0:
+            raise ValueError('maintenance_interval is expected to be greater than zero')
+
         self._minsize = pool_min_size
         self._maxsize = pool_max_size
+        # 0 disables idle reaping, pings and growth respectively
+        self._idle_timeout = pool_idle_timeout
+        self._ping_interval = pool_ping_interval
+        self._ping_timeout = pool_ping_timeout
+        self._grow_wait = pool_grow_wait
+        self._maintenance_interval = pool_maintenance_interval
+        self._maintenance_task = None
+        self._spare = []
+        self._connecting = {}
+        self._connect_failures = 0
+        # set by the next failed connection attempt, see wait_connected()
+        self._connect_failed = None
+        self._drain_timeout = pool_drain_timeout
+        self._draining = {}
+        self._wait_ewma = 0.0
+        self.acquire_wait = Histogram()
+        self.reaped_count = 0
+        self.ping_failure_count = 0
+        self.drained_count = 0
+        self.cancel_lost_count = 0
 
         self._holders = []
         self._initialized = False
@@ -233,11 +379,15 @@ class Pool:
 
         self._connect_url = connect_url
         self._connect_kwargs = connect_kwargs
+        self._unix_socket_path = None
+        if is_unix_socket_url(connect_url):
+            self._unix_socket_path, self._connect_url = parse_unix_socket_url(
+                connect_url)
 
         for _ in range(pool_max_size):
             ch = PoolConnectionHolder(self, max_queries=pool_max_queries)
             self._holders.append(ch)
-            self._queue.put_nowait(ch)
+            self._spare.append(ch)
 
     async def _async__init__(self):
         if self._initialized:
@@ -246,37 +396,192 @@ class Pool:
             raise ValueError('pool is closed')
 
         if self._minsize:
-            # Since we use a LIFO queue, the first items in the queue will be
-            # the last ones in `self._holders`.  We want to pre-connect the
-            # first few connections in the queue, therefore we want to walk
-            # `self._holders` in reverse.
-
-            if self._minsize > 1:
-                connect_tasks = []
-                for i, ch in enumerate(reversed(self._holders)):
-                    if i >= self._minsize:
-                        break
-                    connect_tasks.append(ch.connect())
-                await asyncio.gather(*connect_tasks, loop=self._loop)
+            holders = self._spare[:self._minsize]
+            del self._spare[:self._minsize]
+            await asyncio.gather(*[ch.connect() for ch in holders], loop=self._loop)
+            for ch in holders:
+                self._queue.put_nowait(ch)
         self._initialized = True
+        if self._idle_timeout or self._ping_interval or self._grow_wait:
+            self._maintenance_task = self._loop.create_task(self._maintain())
         return self
 
+    def start(self) -> None:
+        """initialize the pool without waiting for its minsize connections,
+        which are opened in the background, see wait_connected()
+        """
+        if self._initialized:
+            return
+        if self._closed:
+            raise ValueError('pool is closed')
+
+        for ch in self._spare[:self._minsize]:
+            self._reconnect(ch)
+        self._initialized = True
+        if self._idle_timeout or self._ping_interval or self._grow_wait:
+            self._maintenance_task = self._loop.create_task(self._maintain())
+
+    async def wait_connected(self) -> None:
+        """wait until the connections being opened are in the pool, or
+        until an attempt to open one fails. The pool keeps retrying in the
+        background, it's degraded until one succeeds
+        """
+        while self._connecting and not self._connect_failures:
+            if self._connect_failed is None or self._connect_failed.done():
+                self._connect_failed = self._loop.create_future()
+            await asyncio.wait(list(self._connecting.values()) + [self._connect_failed],
+                               loop=self._loop, return_when=asyncio.FIRST_COMPLETED)
+
+    @property
+    def size(self) -> int:
+        """number of open connections"""
+        return sum(1 for ch in self._holders if ch.connected)
+
+    @property
+    def degraded(self) -> bool:
+        return self._connect_failures > 0 and not any(
+            ch.connected for ch in self._holders)
+
+    def _reconnect(self, ch: PoolConnectionHolder) -> None:
+        """open a new connection for a holder in the background, the
+        holder is put in the pool queue once it is connected
+        """
+        if self._closing or self._closed or ch in self._connecting:
+            return
+        try:
+            self._spare.remove(ch)
+        except ValueError:
+            pass
+        self._connecting[ch] = self._loop.create_task(self._connect_holder(ch))
+
+    async def _connect_holder(self, ch: PoolConnectionHolder) -> None:
+        attempt = 0
+        try:
+            while True:
+                ch._con = None
+                try:
+                    await ch.connect()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._connect_failures += 1
+                    if self._connect_failed is not None and not self._connect_failed.done():
+                        self._connect_failed.set_result(None)
+                    delay = min(RECONNECT_BACKOFF_MAX,
+                                RECONNECT_BACKOFF_BASE * 2 ** attempt)
+                    attempt += 1
+                    logger.warning('ws conn failed, retrying', url=self._connect_url,
+                                   attempt=attempt, delay=delay, e=e)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0), loop=self._loop)
+                    continue
+                self._connect_failures = 0
+                self._queue.put_nowait(ch)
+                return
+        finally:
+            del self._connecting[ch]
+
+    def _checkout_idle(self, ch: PoolConnectionHolder) -> bool:
+        # take an idle holder out of the queue so it can't be acquired
+        # while it is being maintained
+        try:
+            self._queue._queue.remove(ch)
+        except ValueError:
+            return False
+        self._queue.task_done()
+        return True
+
+    async def _maintain(self):
+        while not (self._closing or self._closed):
+            await asyncio.sleep(self._maintenance_interval, loop=self._loop)
+            try:
+                await self._maintain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('error maintaining ws pool', url=self._connect_url, e=e)
+
+    async def _maintain_once(self):
+        now = self._loop.time()
+        # connections that closed while idle
+        for ch in list(self._queue._queue):
+            if not ch.connected and self._checkout_idle(ch):
+                self._reconnect(ch)
+
+        idle = sorted((ch for ch in self._queue._queue),
+                      key=lambda ch: ch._released_at)
+        size = self.size + len(self._connecting)
+
+        if self._idle_timeout:
+            for ch in idle[:max(size - self._minsize, 0)]:
+                if now - ch._released_at < self._idle_timeout:
+                    break
+                if self._checkout_idle(ch):
+                    await ch.close_idle()
+                    self._spare.append(ch)
+                    self.reaped_count += 1
+                    size -= 1
+
+        if self._ping_interval:
+            stale = [ch for ch in idle
+                     if ch.connected and now - ch.last_active >= self._ping_interval
+                     and self._checkout_idle(ch)]
+            if stale:
+                results = await asyncio.gather(
+                    *[ch.ping(self._ping_timeout) for ch in stale], loop=self._loop)
+                for ch, ok in zip(stale, results):
+                    if ok:
+                        self._queue.put_nowait(ch)
+                    else:
+                        self.ping_failure_count += 1
+                        self._reconnect(ch)
+
+        target = self._minsize
+        if self._grow_wait and self._wait_ewma > self._grow_wait:
+            target = size + GROW_STEP
+        spare = self._spare[:max(target - size, 0)]
+        for ch in spare:
+            self._reconnect(ch)
+        if spare:
+            # the pool is growing, give it time to lower the acquire wait
+            self._wait_ewma = 0.0
+
     async def _get_new_connection(self) -> WSConn:
         # First connection attempt on this pool.
         logger.debug('spawning new ws conn')
+        if self._unix_socket_path:
+            return await websockets_connect(self._connect_url, loop=self._loop,
+                                            sock=await self._connect_unix_socket(),
+                                            **self._connect_kwargs)
         return await websockets_connect(self._connect_url, loop=self._loop,
                                         **self._connect_kwargs)
 
+    async def _connect_unix_socket(self) -> socket.socket:
+        # websockets.connect has no unix socket support, so hand it
+        # an already connected socket instead
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await self._loop.sock_connect(sock, self._unix_socket_path)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
     async def acquire(self, timeout: int=None) -> PoolConnectionProxy:
         async def _acquire_impl(timeout=None) -> PoolConnectionProxy:
-            ch = await self._queue.get()  # type: PoolConnectionHolder
-            self._queue.task_done()
-            try:
+            while True:
+                if (self._queue.empty() and self._spare and
+                        len(self._connecting) <= len(self._queue._getters)):
+                    # connect a spare holder for this request, in the
+                    # background so it isn't lost if the request is cancelled
+                    self._reconnect(self._spare[-1])
+                ch = await self._queue.get()  # type: PoolConnectionHolder
+                self._queue.task_done()
+                if not ch.connected:
+                    # closed while idle
+                    self._reconnect(ch)
+                    continue
                 proxy = await ch.acquire()  # type: # type: PoolConnectionProxy
-            except Exception:
-                self._queue.put_nowait(ch)
-                raise
-            else:
                 # Record the timeout, as we will apply it by default
                 # in release().
                 ch._timeout = timeout
@@ -288,12 +593,20 @@ class Pool:
             raise ValueError('pool is not initialized')
         if self._closed:
             raise ValueError('pool is closed')
+        if self.degraded:
+            raise UpstreamUnavailableError(url=self._connect_url,
+                                           connect_failures=self._connect_failures)
 
+        start = self._loop.time()
         if timeout is None:
-            return await _acquire_impl()
+            proxy = await _acquire_impl()
         else:
-            return await asyncio.wait_for(
+            proxy = await asyncio.wait_for(
                 _acquire_impl(), timeout=timeout, loop=self._loop)
+        wait = self._loop.time() - start
+        self.acquire_wait.observe(wait)
+        self._wait_ewma += WAIT_EWMA_ALPHA * (wait - self._wait_ewma)
+        return proxy
 
     async def release(self, connection: PoolConnectionProxy, *, timeout: int=None):
         """Release a connection back to the pool.
@@ -315,6 +628,36 @@ class Pool:
         # pool properly.
         return await asyncio.shield(ch.release(timeout), loop=self._loop)
 
+    def drain(self, connection: PoolConnectionProxy, upstream_id: int) -> None:
+        """release a connection whose request was cancelled after it was
+        sent, once its late response has been received and discarded
+        """
+        ch = connection._holder
+        if ch in self._draining:
+            return
+        self._draining[ch] = self._loop.create_task(self._drain(ch, upstream_id))
+
+    async def _drain(self, ch: PoolConnectionHolder, upstream_id: int) -> None:
+        try:
+            async def discard_until_response():
+                while response_id(await ch._con.recv()) != upstream_id:
+                    pass
+            await asyncio.wait_for(discard_until_response(),
+                                   timeout=self._drain_timeout, loop=self._loop)
+        except asyncio.CancelledError:
+            ch.terminate()
+            raise
+        except Exception as e:
+            logger.info('closing ws conn without response to cancelled request',
+                        url=self._connect_url, upstream_id=upstream_id, e=e)
+            self.cancel_lost_count += 1
+            ch.terminate()
+        else:
+            self.drained_count += 1
+            await ch.release(ch._timeout)
+        finally:
+            del self._draining[ch]
+
     async def close(self):
         """Attempt to gracefully close all connections in the pool.
         Wait until all pool connections are released, close them and
@@ -336,6 +679,7 @@ class Pool:
             raise ValueError('pool is closed')
 
         self._closing = True
+        self._cancel_maintenance()
 
         try:
             release_coros = [
@@ -362,9 +706,43 @@ class Pool:
             raise ValueError('pool is not initialized')
         if self._closed:
             raise ValueError('pool is closed')
+        self._cancel_maintenance()
+        # mark the pool closed first, so terminated holders aren't reconnected
+        self._closed = True
         for ch in self._holders:
             ch.terminate()
-        self._closed = True
+
+    def _cancel_maintenance(self):
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        for task in list(self._connecting.values()):
+            task.cancel()
+        for task in list(self._draining.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        now = self._loop.time()
+        return {
+            'url': self._connect_url,
+            'minsize': self._minsize,
+            'maxsize': self._maxsize,
+            'size': self.size,
+            'state': 'degraded' if self.degraded else 'ok',
+            'connecting': len(self._connecting),
+            'connect_failures': self._connect_failures,
+            'queue': self._queue.qsize(),
+            'in_use': len([ch for ch in self._holders if ch._in_use is not None]),
+            'connection_ages': [now - ch._connected_at for ch in self._holders
+                                if ch.connected and ch._connected_at is not None],
+            'acquire_wait': self.acquire_wait.to_dict(),
+            'reaped': self.reaped_count,
+            'ping_failures': self.ping_failure_count,
+            'draining': len(self._draining),
+            'drained': self.drained_count,
+            'lost_to_cancellation': self.cancel_lost_count,
+            'ws_read_q_sizes': [ch._con.messages.qsize() for ch in self._holders if ch._con]
+        }
 
     def __await__(self):
         return self._async__init__().__await__()
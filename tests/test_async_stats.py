@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from jussi.async_stats import AsyncStatsClient
+from jussi.async_stats import parse_sample_rates
+
+
+class FakeTransport:
+    def __init__(self):
+        self.packets = []
+
+    def sendto(self, data):
+        self.packets.append(data)
+
+
+def make_client(**kwargs):
+    client = AsyncStatsClient(prefix='jussi', **kwargs)
+    client._transport = FakeTransport()
+    return client
+
+
+def sent(client):
+    return b'\n'.join(client._transport.packets).decode().split('\n')
+
+
+def test_stats_are_aggregated_until_flush():
+    client = make_client()
+    client.incr('jrpc.inflight', 3)
+    client.decr('jrpc.inflight')
+    client.from_timings([(1.0, 'http_create'), (1.5, 'fetch_ws.enter'), (2.0, 'fetch_ws.exit')])
+    client.from_timings([(1.0, 'http_create'), (1.1, 'fetch_ws.enter')])
+    client.gauge('tasks', 10)
+    client.gauge('tasks', 12)
+    client.set('users', 'a')
+    client.set('users', 'a')
+    assert client._transport.packets == []
+
+    client.flush()
+    assert sent(client) == [
+        'jussi.jrpc.inflight:2|c',
+        'jussi.fetch_ws.enter:300.000000|ms|@0.5',
+        'jussi.fetch_ws.enter.max:500.000000|g',
+        'jussi.fetch_ws.exit:500.000000|ms|@1',
+        'jussi.fetch_ws.exit.max:500.000000|g',
+        'jussi.tasks:12|g',
+        'jussi.users:a|s',
+    ]
+    client._transport.packets = []
+    client.flush()
+    assert client._transport.packets == []
+
+
+def test_flush_splits_packets():
+    client = make_client(maxudpsize=64)
+    for i in range(10):
+        client.incr(f'counter{i}')
+    client.flush()
+    assert len(client._transport.packets) > 1
+    assert all(len(packet) < 64 for packet in client._transport.packets)
+    assert len(sent(client)) == 10
+
+
+def test_gauges():
+    client = make_client()
+    client.gauge('negative', -5)
+    client.gauge('delta', 2, delta=True)
+    client.gauge('delta', -3, delta=True)
+    client.gauge_callback('tasks', lambda: 7)
+    client.flush()
+    assert sent(client) == ['jussi.negative:0|g', 'jussi.negative:-5|g',
+                            'jussi.tasks:7|g', 'jussi.delta:-1|g']
+
+
+def test_sample_rates(mocker):
+    client = make_client(sample_rates={'fetch': 0.5, 'fetch_ws.exit': 0.25})
+    assert client.sample_rate('fetch_ws.enter') == 0.5
+    assert client.sample_rate('fetch_ws.exit') == 0.25
+    assert client.sample_rate('http_create') == 1
+
+    mocker.patch('jussi.async_stats.random', side_effect=[0.1, 0.9, 0.1])
+    client.incr('fetch.count')
+    client.incr('fetch.count')
+    client.timing('fetch_ws.exit', 10)
+    client.incr('other')
+    client.flush()
+    assert sent(client) == ['jussi.fetch.count:1|c|@0.5',
+                            'jussi.other:1|c',
+                            'jussi.fetch_ws.exit:10.000000|ms|@0.25',
+                            'jussi.fetch_ws.exit.max:10.000000|g']
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates('fetch_ws=0.1, jrpc.inflight=1') == {
+        'fetch_ws': 0.1, 'jrpc.inflight': 1.0}
+    assert parse_sample_rates('') == {}
+
+
+@pytest.mark.parametrize('value', ['fetch_ws', 'fetch_ws=0', 'fetch_ws=2', '=0.5'])
+def test_parse_sample_rates_invalid(value):
+    with pytest.raises(ValueError):
+        parse_sample_rates(value)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from jussi.concurrency import AIMDConcurrencyLimiter
+from jussi.errors import UpstreamOverloadedError
+
+
+async def test_limiter_acquire_under_limit():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=2, min_limit=1)
+    await limiter.acquire()
+    await limiter.acquire()
+    assert limiter.inflight == 2
+    assert limiter.queued == 0
+
+
+async def test_limiter_queues_over_limit():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=1, min_limit=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+    assert not waiter.done()
+
+    limiter.release(0.01)
+    await asyncio.sleep(0)
+    assert waiter.done()
+    assert limiter.inflight == 1
+    assert limiter.queued == 0
+
+
+async def test_limiter_sheds_when_queue_full():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=1, min_limit=1,
+                                     max_queue_size=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(UpstreamOverloadedError):
+        await limiter.acquire()
+    assert limiter.shed_count == 1
+    waiter.cancel()
+
+
+async def test_limiter_cancelled_waiter_is_removed():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=1, min_limit=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    assert limiter.queued == 0
+    limiter.release(0.01)
+    assert limiter.inflight == 0
+
+
+def test_limiter_additive_increase():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=4, min_limit=1)
+    limiter._inflight = 4
+    limiter.release(0.01)
+    assert limiter.limit == 5
+
+
+def test_limiter_multiplicative_decrease_on_drop():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=100, min_limit=1)
+    limiter._inflight = 1
+    limiter.release(0.01, dropped=True)
+    assert limiter.limit == 90
+    assert limiter.drop_count == 1
+
+
+def test_limiter_decrease_on_latency():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=100, min_limit=1,
+                                     latency_tolerance=2.0, window_size=100, short_window=10)
+    limiter._inflight = 60
+    limiter.release(0.01)
+    assert limiter.limit == 101
+    limiter._limit = 100
+    for _ in range(20):
+        limiter._inflight = 1
+        limiter.release(0.1)
+    # once per short window
+    assert limiter.drop_count == 2
+    assert limiter.limit == 81
+
+
+def test_limiter_method_mix_is_not_congestion():
+    # a cheap and an expensive method on a healthy upstream
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=32, min_limit=4)
+    for i in range(2000):
+        limiter._inflight = limiter.limit
+        limiter.release(0.002 if i % 2 else 0.02)
+    assert limiter.drop_count == 0
+    assert limiter.limit == 512
+
+
+def test_limiter_respects_min_and_max():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=2, min_limit=2, max_limit=3)
+    limiter._inflight = 1
+    limiter.release(0.01, dropped=True)
+    assert limiter.limit == 2
+    for _ in range(5):
+        limiter._inflight = 3
+        limiter.release(0.01)
+    assert limiter.limit == 3
+
+
+async def test_limiter_run_releases_slot():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=1, min_limit=1)
+
+    async def fetch():
+        return 'result'
+
+    result = await limiter.run(fetch())
+    assert result == 'result'
+    assert limiter.inflight == 0
+
+
+async def test_limiter_run_counts_timeouts_as_drops():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=10, min_limit=1)
+
+    async def fetch():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await limiter.run(fetch())
+    assert limiter.inflight == 0
+    assert limiter.drop_count == 1
+    assert limiter.limit == 9
+
+
+async def test_limiter_run_cancel_leaves_limit():
+    limiter = AIMDConcurrencyLimiter('ws://test', initial_limit=10, min_limit=1)
+    tasks = [asyncio.ensure_future(limiter.run(asyncio.sleep(10))) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert limiter.inflight == 5
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert limiter.inflight == 0
+    assert limiter.limit == 10
+    assert limiter.drop_count == 0
+    assert limiter.stats()['long_rtt'] is None
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(min_limit=0),
+    dict(min_limit=10, max_limit=5),
+    dict(max_queue_size=-1),
+    dict(backoff_ratio=1.5),
+    dict(short_window=0),
+    dict(window_size=10, short_window=10)
+])
+def test_limiter_invalid_args(kwargs):
+    with pytest.raises(ValueError):
+        AIMDConcurrencyLimiter('ws://test', **kwargs)
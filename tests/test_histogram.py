@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from jussi.histogram import Histogram
+
+
+def test_histogram_observe():
+    histogram = Histogram([0.1, 1, 10])
+    for value in [0.05, 0.1, 0.5, 5, 50]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(55.65)
+
+
+def test_histogram_cumulative_counts():
+    histogram = Histogram([0.1, 1, 10])
+    for value in [0.05, 0.1, 0.5, 5, 50]:
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [(0.1, 2), (1, 3), (10, 4), (float('inf'), 5)]
+    assert histogram.to_dict() == {
+        'count': 5,
+        'sum': pytest.approx(55.65),
+        'buckets': {'0.1': 2, '1': 3, '10': 4, '+Inf': 5}
+    }
+
+
+@pytest.mark.parametrize('q,expected', [
+    (0.0, 0.1),
+    (0.4, 0.1),
+    (0.5, 1),
+    (0.8, 10),
+    (1.0, float('inf')),
+])
+def test_histogram_quantile(q, expected):
+    histogram = Histogram([0.1, 1, 10])
+    for value in [0.05, 0.1, 0.5, 5, 50]:
+        histogram.observe(value)
+    assert histogram.quantile(q) == expected
+
+
+def test_histogram_empty_quantile():
+    assert Histogram().quantile(0.99) == 0.0
+
+
+def test_histogram_unsorted_bounds():
+    with pytest.raises(ValueError):
+        Histogram([1, 0.1])
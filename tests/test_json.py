@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from jussi import json
+
+AVAILABLE_ENGINES = json.available_engines()
+
+DOCUMENT = {'jsonrpc': '2.0', 'id': 1, 'method': 'get_block',
+            'params': [1000, {'a': [1.5, None, True, 'ü']}]}
+
+
+@pytest.fixture(params=AVAILABLE_ENGINES)
+def engine(request):
+    json.set_engine(request.param)
+    yield request.param
+    json.set_engine(json.DEFAULT_ENGINE)
+
+
+def test_default_engine():
+    assert json.engine == json.DEFAULT_ENGINE
+    assert json.DEFAULT_ENGINE in AVAILABLE_ENGINES
+
+
+def test_set_engine(engine):
+    assert json.engine == engine
+
+
+def test_loads(engine):
+    raw = '{"jsonrpc":"2.0","id":1,"method":"get_block","params":[1000,{"a":[1.5,null,true,"ü"]}]}'
+    assert json.loads(raw) == DOCUMENT
+    assert json.loads(raw.encode()) == DOCUMENT
+
+
+def test_dumps(engine):
+    dumped = json.dumps(DOCUMENT)
+    assert isinstance(dumped, str)
+    assert 'ü' in dumped
+    assert ' ' not in dumped
+    assert json.loads(dumped) == DOCUMENT
+
+
+def test_dumps_bytes(engine):
+    dumped = json.dumps_bytes(DOCUMENT)
+    assert isinstance(dumped, bytes)
+    assert 'ü'.encode() in dumped
+    assert json.loads(dumped) == DOCUMENT
+
+
+def test_set_engine_unknown():
+    with pytest.raises(ValueError):
+        json.set_engine('nope')
+    assert json.engine == json.DEFAULT_ENGINE
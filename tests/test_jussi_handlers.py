@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import json
 import ujson
+import asynctest
 import pytest
 
+from .conftest import AttrDict
+
 correct_get_block_1000_response = {
     "id": 1,
     "result":
@@ -104,3 +108,265 @@ async def test_content_encoding(mocker, mocked_app_test_cli, jsonrpc_request,
     assert json.loads(test_request) == utf8_request
     assert json.loads(test_request)[
         'params'][2][0]['operations'][0][1]['body'] == "「又遲到了！」年輕人醒來的時候，已時八時三十分。"
+
+
+async def test_gather_or_cancel():
+    from jussi.handlers import gather_or_cancel
+
+    async def item(value, delay=0):
+        await asyncio.sleep(delay)
+        return value
+
+    assert await gather_or_cancel([item(1, 0.01), item(2), item(3)]) == [1, 2, 3]
+
+
+async def test_gather_or_cancel_cancels_siblings():
+    from jussi.handlers import gather_or_cancel
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fails():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await gather_or_cancel([slow(), fails(), slow()])
+    await asyncio.sleep(0)
+    assert cancelled == [True, True]
+
+
+async def test_run_until_deadline():
+    from time import perf_counter
+    from jussi.handlers import run_until_deadline
+    jrpc_request = AttrDict(deadline=perf_counter() + 0.01, timings=[])
+    jrpc_request.remaining = jrpc_request.deadline - perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        await run_until_deadline(jrpc_request, asyncio.sleep(1))
+
+    jrpc_request = AttrDict(deadline=perf_counter() - 1, remaining=-1, timings=[])
+    with pytest.raises(asyncio.TimeoutError):
+        await run_until_deadline(jrpc_request, asyncio.sleep(1))
+
+
+async def test_fetch_ws_cancelled_drains_connection(mocker):
+    from jussi.handlers import fetch_ws
+    conn = AttrDict(send=asynctest.CoroutineMock(),
+                    recv=asynctest.CoroutineMock(side_effect=asyncio.CancelledError()),
+                    terminate=mocker.MagicMock())
+    pool = AttrDict(acquire=asynctest.CoroutineMock(return_value=conn),
+                    release=asynctest.CoroutineMock(),
+                    drain=mocker.MagicMock())
+    http_request = AttrDict(app=AttrDict(config=AttrDict(websocket_pools={'ws://test': pool})))
+    jrpc_request = AttrDict(upstream=AttrDict(url='ws://test'), upstream_id=123, id=1,
+                            timings=[], to_upstream_request=lambda: '{}')
+    with pytest.raises(asyncio.CancelledError):
+        await fetch_ws(http_request, jrpc_request)
+    pool.drain.assert_called_once_with(conn, 123)
+    conn.terminate.assert_not_called()
+    pool.release.assert_not_called()
+
+
+async def test_fetch_ws_error_terminates_connection(mocker):
+    from jussi.handlers import fetch_ws
+    conn = AttrDict(send=asynctest.CoroutineMock(),
+                    recv=asynctest.CoroutineMock(side_effect=ValueError()),
+                    terminate=mocker.MagicMock())
+    pool = AttrDict(acquire=asynctest.CoroutineMock(return_value=conn),
+                    release=asynctest.CoroutineMock(),
+                    drain=mocker.MagicMock())
+    http_request = AttrDict(app=AttrDict(config=AttrDict(websocket_pools={'ws://test': pool})))
+    jrpc_request = AttrDict(upstream=AttrDict(url='ws://test'), upstream_id=123, id=1,
+                            timings=[], to_upstream_request=lambda: '{}')
+    with pytest.raises(ValueError):
+        await fetch_ws(http_request, jrpc_request)
+    conn.terminate.assert_called_once_with()
+    pool.drain.assert_not_called()
+
+
+async def test_dispatch_batch_deduplicates_identical_requests(mocker):
+    from jussi.handlers import dispatch_batch
+    from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+    from .conftest import make_request
+    dummy_request = make_request()
+    batch = [
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1000]},
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'get_dynamic_global_properties'},
+        {'id': 'three', 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1000]},
+        {'id': 4, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1001]},
+        {'id': 5, 'jsonrpc': '2.0', 'method': 'get_dynamic_global_properties'},
+    ]
+    http_request = AttrDict(jsonrpc=[jsonrpc_from_request(dummy_request, i, r)
+                                     for i, r in enumerate(batch)])
+    dispatched = []
+
+    async def dispatch_single(http_request, jrpc_request):
+        dispatched.append(jrpc_request.id)
+        return ujson.dumps({'id': jrpc_request.id, 'jsonrpc': '2.0',
+                            'result': str(jrpc_request.urn)}).encode()
+    mocker.patch('jussi.handlers.dispatch_single', side_effect=dispatch_single)
+
+    responses = [json.loads(r) for r in await dispatch_batch(http_request)]
+    assert dispatched == [1, 2, 4]
+    assert [r['id'] for r in responses] == [1, 2, 'three', 4, 5]
+    assert responses[2]['result'] == responses[0]['result']
+    assert responses[4]['result'] == responses[1]['result']
+
+
+async def test_dispatch_batch_does_not_deduplicate_uncacheable_requests(mocker):
+    from jussi.handlers import dispatch_batch
+    from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+    from .conftest import make_request
+    dummy_request = make_request()
+    broadcast = {'jsonrpc': '2.0', 'method': 'call',
+                 'params': ['network_broadcast_api', 'broadcast_transaction',
+                            [{'ref_block_num': 1}]]}
+    http_request = AttrDict(jsonrpc=[jsonrpc_from_request(dummy_request, i, dict(broadcast, id=i))
+                                     for i in range(2)])
+    dispatch_single = asynctest.CoroutineMock(return_value=b'{"id":0,"result":1}')
+    mocker.patch('jussi.handlers.dispatch_single', new=dispatch_single)
+    await dispatch_batch(http_request)
+    assert dispatch_single.call_count == 2
+
+
+async def test_dispatch_batch_merges_vector_requests(mocker):
+    from jussi.handlers import dispatch_batch
+    from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+    from .conftest import make_request
+    dummy_request = make_request()
+    batch = [
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_accounts', 'params': [['alice']]},
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1000]},
+        {'id': 3, 'jsonrpc': '2.0', 'method': 'get_accounts', 'params': [['bob']]},
+        {'id': 4, 'jsonrpc': '2.0', 'method': 'get_accounts', 'params': [['alice']]},
+    ]
+    http_request = AttrDict(jsonrpc=[jsonrpc_from_request(dummy_request, i, r)
+                                     for i, r in enumerate(batch)])
+    dispatched = []
+
+    async def dispatch_single(http_request, jrpc_request):
+        dispatched.append(jrpc_request.params)
+        if jrpc_request.method == 'get_accounts':
+            result = [{'name': name} for name in jrpc_request.params[0]]
+        else:
+            result = 'block'
+        return ujson.dumps({'id': jrpc_request.id, 'jsonrpc': '2.0',
+                            'result': result}).encode()
+    mocker.patch('jussi.handlers.dispatch_single', side_effect=dispatch_single)
+
+    responses = [json.loads(r) for r in await dispatch_batch(http_request)]
+    assert dispatched == [[['alice', 'bob']], [1000]]
+    assert responses == [
+        {'id': 1, 'jsonrpc': '2.0', 'result': [{'name': 'alice'}]},
+        {'id': 2, 'jsonrpc': '2.0', 'result': 'block'},
+        {'id': 3, 'jsonrpc': '2.0', 'result': [{'name': 'bob'}]},
+        {'id': 4, 'jsonrpc': '2.0', 'result': [{'name': 'alice'}]},
+    ]
+
+
+async def test_dispatch_batch_failure_leaves_upstream_limit(mocker):
+    from jussi.concurrency import AIMDConcurrencyLimiter
+    from jussi.handlers import dispatch_batch
+    from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+    from .conftest import make_request
+    dummy_request = make_request()
+    jrpc_requests = [jsonrpc_from_request(dummy_request, i, {
+        'id': i, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [i]}) for i in range(50)]
+    url = jrpc_requests[0].upstream.url
+    limiter = AIMDConcurrencyLimiter(url, initial_limit=256, max_limit=256)
+    http_request = AttrDict(jsonrpc=jrpc_requests, app=AttrDict(config=AttrDict(
+        upstream_limiters={url: limiter}, upstream_scheduler=None)))
+
+    async def fetch(http_request, jrpc_request, **kwargs):
+        if jrpc_request.id == 0:
+            raise ValueError('upstream error')
+        await asyncio.sleep(10)
+    mocker.patch('jussi.handlers.fetch_ws', side_effect=fetch)
+    mocker.patch('jussi.handlers.fetch_http', side_effect=fetch)
+
+    with pytest.raises(ValueError):
+        await dispatch_batch(http_request)
+    await asyncio.sleep(0)
+    # the cancelled siblings of the failed item aren't upstream congestion
+    assert limiter.inflight == 0
+    assert limiter.drop_count == 0
+    assert limiter.limit == 256
+
+
+async def test_ready_once_warm(mocked_app_test_cli):
+    _, test_cli = mocked_app_test_cli
+    app = test_cli.server.app
+    for _ in range(50):
+        if app.config.ready:
+            break
+        await asyncio.sleep(0.01)
+    response = await test_cli.get('/ready')
+    assert response.status == 200
+    assert (await response.json())['ready_after'] > 0
+
+    app.config.ready = False
+    response = await test_cli.get('/ready')
+    assert response.status == 503
+    assert (await response.json())['status'] == 'starting'
+
+
+async def test_ready_with_unreachable_ws_upstream(app, test_client):
+    app.config.args.websocket_pool_minsize = 1
+    with asynctest.patch('jussi.ws.pool.Pool._get_new_connection',
+                         side_effect=ConnectionRefusedError()):
+        test_cli = await test_client(app)
+        for _ in range(100):
+            if app.config.ready:
+                break
+            await asyncio.sleep(0.01)
+        response = await test_cli.get('/ready')
+        assert response.status == 200
+        pools = app.config.websocket_pools.values()
+        assert pools
+        assert all(pool.degraded for pool in pools)
+
+
+async def test_warmups_time_out(app, test_client):
+    app.config.args.warmup_timeout = 0.05
+
+    @app.listener('before_server_start')
+    def add_stuck_warmup(app, loop):
+        app.config.warmups.append(asyncio.Event(loop=loop).wait())
+
+    with asynctest.patch('jussi.ws.pool.Pool._get_new_connection'):
+        test_cli = await test_client(app)
+        for _ in range(100):
+            if app.config.ready:
+                break
+            await asyncio.sleep(0.01)
+        response = await test_cli.get('/ready')
+        assert response.status == 200
+
+
+async def test_metrics_route(mocked_app_test_cli):
+    _, test_cli = mocked_app_test_cli
+    response = await test_cli.post('/', data=b'not json')
+    assert (await response.json())['error']['code'] == -32700
+    response = await test_cli.get('/metrics')
+    assert response.status == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = await response.text()
+    assert 'jussi_errors_total{code="-32700"} 1' in text
+    assert '# TYPE jussi_request_duration_seconds histogram' in text
+
+
+async def test_monitor_route(mocked_app_test_cli):
+    _, test_cli = mocked_app_test_cli
+    response = await test_cli.get('/monitor')
+    assert response.status == 200
+    data = await response.json()
+    for name in ('server', 'asyncio', 'post_response_tasks', 'cache', 'ws_pools',
+                 'http_pools', 'upstream_limits', 'micro_batches', 'upstream_scheduler',
+                 'rate_limits'):
+        assert name in data
+    assert data['cache']['memory']['max_size'] > 0
+    assert data['asyncio']['tasks'] > 0
@@ -2,6 +2,7 @@
 from urllib.parse import urlunparse
 
 import pytest
+import ujson
 
 from jussi.errors import InvalidRequest
 from jussi.errors import ParseError
@@ -32,6 +33,12 @@ def test_jsonrpc_ignore_for_not_post(req):
     assert req._parsed_jsonrpc is _empty
 
 
+def test_jsonrpc_ignore_for_admin_routes():
+    req = make_request(url_bytes=b'/admin/reload', body=b'')
+    assert req.jsonrpc is None
+    assert req._parsed_json is _empty
+
+
 def test_jsonrpc_lazy_parsing():
     request = make_request(body=b'[{')
     assert request._parsed_jsonrpc is _empty
@@ -71,6 +78,30 @@ def test_jsonrpc():
     pass
 
 
+def test_jsonrpc_batch():
+    req = make_request(body=ujson.dumps([
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1000]},
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'condenser_api.get_dynamic_global_properties'}
+    ]).encode())
+    assert req.is_batch_jrpc is False
+    assert [r.id for r in req.jsonrpc] == [1, 2]
+    assert [r.batch_index for r in req.jsonrpc] == [0, 1]
+    assert req.is_batch_jrpc is True
+    assert req.is_single_jrpc is False
+
+
+@pytest.mark.parametrize('body', [
+    [{'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1]}, 1],
+    [{'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1]},
+     {'id': 2, 'jsonrpc': '1.0', 'method': 'get_block', 'params': [1]}],
+    [{'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': 1}],
+])
+def test_jsonrpc_batch_invalid_item(body):
+    req = make_request(body=ujson.dumps(body).encode())
+    with pytest.raises(InvalidRequest):
+        _ = req.jsonrpc
+
+
 def test_ip():
     req = make_request()
     assert req.ip is None
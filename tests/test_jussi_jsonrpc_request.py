@@ -45,7 +45,7 @@ def test_request_urn(urn_test_request_dict):
     jsonrpc_request, urn, url, ttl, timeout = urn_test_request_dict
     dummy_request = make_request()
     jussi_request = jsonrpc_from_request(dummy_request, 0, jsonrpc_request)
-    assert jussi_request.urn == urn
+    assert str(jussi_request.urn) == urn
 
 
 def test_request_upstream(urn_test_request_dict):
@@ -105,6 +105,18 @@ def test_upstream_headers(urn_test_request_dict):
     }
 
 
+def test_request_deadline(urn_test_request_dict):
+    jsonrpc_request, urn, url, ttl, timeout = urn_test_request_dict
+    dummy_request = make_request()
+    jussi_request = jsonrpc_from_request(dummy_request, 0, jsonrpc_request)
+    if timeout:
+        assert jussi_request.deadline == dummy_request.request_start_time + timeout
+        assert 0 < jussi_request.remaining <= timeout
+    else:
+        assert jussi_request.deadline is None
+        assert jussi_request.remaining is None
+
+
 def upstream_request(urn_test_request_dict):
     jsonrpc_request, urn, url, ttl, timeout = urn_test_request_dict
     dummy_request = make_request()
@@ -132,3 +144,18 @@ def test_log_extra():
 def test_request_hash():
     # TODO
     pass
+
+
+def test_from_http_batch():
+    from jussi.request.jsonrpc import from_http_batch
+    dummy_request = make_request(headers={})
+    batch = [
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1000]},
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1001]},
+    ]
+    jussi_requests = from_http_batch(dummy_request, batch)
+    assert [r.to_dict() for r in jussi_requests] == batch
+    assert [r.batch_index for r in jussi_requests] == [0, 1]
+    # generated once for the whole batch
+    assert jussi_requests[0].jussi_request_id == jussi_requests[1].jussi_request_id
+    assert jussi_requests[0].deadline == jussi_requests[1].deadline
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+import time
+
+import pytest
+
+from jussi.looplag import LoopLagMonitor
+from jussi.looplag import find_request
+from jussi.metrics import LOOP_LAG
+from jussi.metrics import LOOP_STALLS
+from jussi.metrics import METRICS
+from jussi.metrics import Metrics
+from jussi.metrics import render
+from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+from .conftest import make_request
+
+
+@pytest.fixture
+def metrics():
+    METRICS.clear()
+    yield METRICS
+    METRICS.clear()
+
+
+def make_jsonrpc_request():
+    return jsonrpc_from_request(make_request(), 0, {
+        'id': 1, 'jsonrpc': '2.0', 'method': 'condenser_api.get_block', 'params': [1]})
+
+
+def blocking_handler(jsonrpc_request, seconds):
+    time.sleep(seconds)
+
+
+def test_record(metrics, loop):
+    monitor = LoopLagMonitor(loop, interval=0.1, threshold=0.25)
+    monitor.record(0.002)
+    monitor.record(0.5)
+    assert monitor.lag is metrics.histograms[(LOOP_LAG,)]
+    assert monitor.lag_max == 0.5
+    assert monitor.stalls == 1
+    assert metrics.histograms[(LOOP_LAG,)].count == 2
+    assert metrics.counters == {(LOOP_STALLS,): 1}
+
+
+@pytest.mark.parametrize('interval,threshold', [(0, 0.25), (0.1, 0), (-1, 1)])
+def test_invalid_settings(loop, interval, threshold):
+    with pytest.raises(ValueError):
+        LoopLagMonitor(loop, interval=interval, threshold=threshold)
+
+
+def test_find_request():
+    jsonrpc_request = make_jsonrpc_request()
+
+    def inner():
+        return find_request(sys._getframe())  # pylint: disable=protected-access
+
+    def handler(request):
+        return inner()
+    assert handler(jsonrpc_request) == (jsonrpc_request.jussi_request_id,
+                                        'appbase.condenser_api.get_block')
+
+    http_request = make_request(headers={'x-jussi-request-id': '123'})
+    assert handler(http_request) == ('123', None)
+    del jsonrpc_request, http_request
+    assert inner() == (None, None)
+
+
+async def test_watchdog_captures_blocking_stack(metrics, loop):
+    monitor = LoopLagMonitor(loop, interval=0.01, threshold=0.05)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        jsonrpc_request = make_jsonrpc_request()
+        blocking_handler(jsonrpc_request, 0.5)
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+    assert monitor.stalls >= 1
+    stall = monitor.last_stall
+    assert stall['request_id'] == jsonrpc_request.jussi_request_id
+    assert stall['method'] == 'appbase.condenser_api.get_block'
+    assert 'blocking_handler' in stall['stack']
+    assert monitor.stats()['stalls'] == monitor.stalls
+
+
+def test_render_unlabelled_families():
+    metrics = Metrics(bounds=(0.01,))
+    metrics.observe((LOOP_LAG,), 0.002)
+    metrics.incr((LOOP_STALLS,))
+    text = render([metrics.snapshot()])
+    assert 'jussi_event_loop_lag_seconds_bucket{le="0.01"} 1' in text
+    assert 'jussi_event_loop_lag_seconds_count 1' in text
+    assert 'jussi_event_loop_stalls_total 1' in text
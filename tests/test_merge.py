@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from jussi.merge import group_vector_requests
+from jussi.merge import is_vector_request
+from jussi.merge import merge_requests
+from jussi.merge import split_response
+from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+from .conftest import make_request
+
+dummy_request = make_request()
+
+
+def jrpc(request, batch_index=0):
+    return jsonrpc_from_request(dummy_request, batch_index,
+                                dict(request, jsonrpc='2.0'))
+
+
+def get_accounts(_id, *names):
+    return jrpc({'id': _id, 'method': 'get_accounts', 'params': [list(names)]}, _id)
+
+
+@pytest.mark.parametrize('request_dict,expected', [
+    ({'id': 1, 'method': 'get_accounts', 'params': [['alice']]}, True),
+    ({'id': 1, 'method': 'condenser_api.get_accounts', 'params': [['alice', 'bob']]}, True),
+    ({'id': 1, 'method': 'call',
+      'params': ['database_api', 'lookup_account_names', [['alice']]]}, True),
+    ({'id': 1, 'method': 'get_accounts', 'params': [[1]]}, False),
+    ({'id': 1, 'method': 'get_accounts', 'params': ['alice']}, False),
+    ({'id': 1, 'method': 'get_block', 'params': [1]}, False),
+])
+def test_is_vector_request(request_dict, expected):
+    assert is_vector_request(jrpc(request_dict)) is expected
+
+
+def test_group_vector_requests():
+    requests = [
+        get_accounts(0, 'alice'),
+        jrpc({'id': 1, 'method': 'get_block', 'params': [1]}),
+        get_accounts(2, 'bob', 'carol'),
+        jrpc({'id': 3, 'method': 'lookup_account_names', 'params': [['alice']]}),
+        get_accounts(4, 'dave'),
+    ]
+    assert group_vector_requests(requests) == [[0, 2, 4], [1], [3]]
+    assert group_vector_requests(requests, max_names=3) == [[0, 2], [1], [3], [4]]
+
+
+def test_merge_requests():
+    merged = merge_requests([get_accounts(1, 'alice'), get_accounts(2, 'bob', 'alice')])
+    assert merged.params == [['alice', 'bob']]
+    assert merged.id == 1
+    assert str(merged.urn) == 'steemd.database_api.get_accounts.params=[["alice","bob"]]'
+
+    call = jrpc({'id': 3, 'method': 'call',
+                 'params': ['database_api', 'get_accounts', [['carol']]]})
+    merged = merge_requests([call, get_accounts(4, 'dave')])
+    assert merged.to_dict()['params'] == ['database_api', 'get_accounts', [['carol', 'dave']]]
+
+
+def test_split_response_by_name():
+    requests = [get_accounts(1, 'alice'), get_accounts(2, 'missing'),
+                get_accounts(3, 'bob', 'alice')]
+    merged = merge_requests(requests)
+    raw = json.dumps({'id': 1, 'jsonrpc': '2.0',
+                      'result': [{'name': 'bob', 'id': 22}, {'name': 'alice', 'id': 11}]})
+    responses = [json.loads(r) for r in split_response(merged, requests, raw)]
+    assert responses == [
+        {'id': 1, 'jsonrpc': '2.0', 'result': [{'name': 'alice', 'id': 11}]},
+        {'id': 2, 'jsonrpc': '2.0', 'result': []},
+        {'id': 3, 'jsonrpc': '2.0', 'result': [{'name': 'bob', 'id': 22},
+                                               {'name': 'alice', 'id': 11}]},
+    ]
+
+
+def test_split_response_by_position():
+    requests = [jrpc({'id': 1, 'method': 'lookup_account_names', 'params': [['alice']]}),
+                jrpc({'id': 2, 'method': 'lookup_account_names', 'params': [['missing']]})]
+    merged = merge_requests(requests)
+    raw = json.dumps({'id': 1, 'jsonrpc': '2.0', 'result': [{'name': 'alice'}, None]})
+    responses = [json.loads(r) for r in split_response(merged, requests, raw)]
+    assert [r['result'] for r in responses] == [[{'name': 'alice'}], [None]]
+
+    with pytest.raises(ValueError):
+        split_response(merged, requests, json.dumps({'id': 1, 'result': [None]}))
+
+
+def test_split_error_response():
+    requests = [get_accounts(1, 'alice'), get_accounts(2, 'bob')]
+    merged = merge_requests(requests)
+    raw = json.dumps({'id': 1, 'jsonrpc': '2.0', 'error': {'code': -32000}})
+    responses = [json.loads(r) for r in split_response(merged, requests, raw)]
+    assert responses == [{'id': 1, 'jsonrpc': '2.0', 'error': {'code': -32000}},
+                         {'id': 2, 'jsonrpc': '2.0', 'error': {'code': -32000}}]
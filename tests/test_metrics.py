@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+import ujson
+
+from jussi.cache import CacheGroupItem
+from jussi.cache import SpeedTier
+from jussi.cache.cache_group import CacheGroup
+from jussi.errors import InvalidRequest
+from jussi.metrics import CACHE_REQUESTS
+from jussi.metrics import ERRORS
+from jussi.metrics import METRICS
+from jussi.metrics import OVERFLOW_LABEL
+from jussi.metrics import REQUEST_DURATION
+from jussi.metrics import STAGE_DURATION
+from jussi.metrics import Metrics
+from jussi.metrics import read_snapshots
+from jussi.metrics import render
+from jussi.metrics import snapshot_path
+from jussi.middlewares.metrics import record_metrics
+from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
+from .conftest import build_mocked_cache
+from .conftest import make_request
+
+
+@pytest.fixture
+def metrics():
+    METRICS.clear()
+    yield METRICS
+    METRICS.clear()
+
+
+def test_metrics_observe():
+    metrics = Metrics(bounds=(0.1, 1, 10))
+    for value in [0.05, 0.1, 0.5, 5, 50]:
+        metrics.observe(('h', 'm'), value)
+    assert metrics.histograms[('h', 'm')].counts == [2, 1, 1, 1]
+    assert metrics.histograms[('h', 'm')].sum == pytest.approx(55.65)
+    assert metrics.histogram(('h', 'm')) is metrics.histograms[('h', 'm')]
+
+
+def test_metrics_observe_timings():
+    metrics = Metrics(bounds=(0.1, 1, 10))
+    metrics.observe_timings('m', [(1.0, 'create'), (1.5, 'fetch.enter'), (3.5, 'fetch.exit')])
+    assert {key: (histogram.counts, histogram.sum)
+            for key, histogram in metrics.histograms.items()} == {
+        (STAGE_DURATION, 'm', 'fetch.enter'): ([0, 1, 0, 0], 0.5),
+        (STAGE_DURATION, 'm', 'fetch.exit'): ([0, 0, 1, 0], 2.0)
+    }
+
+
+def test_metrics_overflow_series():
+    metrics = Metrics(bounds=(1,), max_series=2)
+    metrics.observe((STAGE_DURATION, 'a', 'exit'), 1)
+    metrics.observe((STAGE_DURATION, 'b', 'exit'), 1)
+    metrics.observe((STAGE_DURATION, 'c', 'exit'), 1)
+    metrics.observe((STAGE_DURATION, 'd', 'exit'), 1)
+    metrics.observe((STAGE_DURATION, 'a', 'exit'), 1)
+    assert metrics.histograms[(STAGE_DURATION, OVERFLOW_LABEL, 'exit')].count == 2
+    assert metrics.histograms[(STAGE_DURATION, 'a', 'exit')].count == 2
+    assert len(metrics.histograms) == 3
+
+
+def test_render_merges_workers():
+    worker1 = Metrics(bounds=(0.1, 1))
+    worker1.observe((REQUEST_DURATION, 'appbase.condenser_api.get_block'), 0.05)
+    worker1.incr((ERRORS, '1100'))
+    worker2 = Metrics(bounds=(0.1, 1))
+    worker2.observe((REQUEST_DURATION, 'appbase.condenser_api.get_block'), 0.5)
+    worker2.observe((REQUEST_DURATION, 'appbase.condenser_api.get_block'), 5)
+    worker2.incr((ERRORS, '1100'), 2)
+    worker2.incr((CACHE_REQUESTS, 'memory', 'hit'))
+
+    text = render([worker1.snapshot(), worker2.snapshot()])
+    labels = 'method="appbase.condenser_api.get_block"'
+    assert f'jussi_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'jussi_request_duration_seconds_bucket{{{labels},le="1"}} 2' in text
+    assert f'jussi_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f'jussi_request_duration_seconds_sum{{{labels}}} 5.55' in text
+    assert f'jussi_request_duration_seconds_count{{{labels}}} 3' in text
+    assert 'jussi_errors_total{code="1100"} 3' in text
+    assert 'jussi_cache_requests_total{tier="memory",result="hit"} 1' in text
+    assert '# TYPE jussi_stage_duration_seconds histogram' in text
+    assert '# TYPE jussi_errors_total counter' in text
+    assert text.endswith('\n')
+
+
+def test_render_escapes_label_values():
+    metrics = Metrics(bounds=(1,))
+    metrics.observe((REQUEST_DURATION, 'a"b\\c\nd'), 1)
+    assert 'method="a\\"b\\\\c\\nd"' in render([metrics.snapshot()])
+
+
+def test_read_snapshots(tmpdir):
+    metrics = Metrics(bounds=(1,))
+    metrics.incr((ERRORS, '1100'))
+    metrics.write_snapshot(snapshot_path(str(tmpdir), 1))
+    metrics.write_snapshot(snapshot_path(str(tmpdir), 2))
+    assert read_snapshots(str(tmpdir), exclude_pid=2) == [metrics.snapshot()]
+    assert not [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp')]
+    assert read_snapshots(None) == []
+
+
+async def test_record_metrics(metrics):
+    request = make_request(body={'id': 1, 'jsonrpc': '2.0',
+                                 'method': 'condenser_api.get_block', 'params': [1]})
+    _ = request.jsonrpc
+    request.jsonrpc.timings.append((request.jsonrpc.timings[0][0] + 0.01, 'fetch_ws.exit'))
+    await record_metrics(request, None)
+    method = 'appbase.condenser_api.get_block'
+    assert metrics.histograms[(REQUEST_DURATION, method)].sum > 0
+    assert (STAGE_DURATION, method, 'fetch_ws.exit') in metrics.histograms
+
+    batch = [{'id': i, 'jsonrpc': '2.0', 'method': 'condenser_api.get_block',
+              'params': [i]} for i in range(2)]
+    request = make_request(body=ujson.dumps(batch).encode())
+    _ = request.jsonrpc
+    await record_metrics(request, None)
+    assert metrics.histograms[(REQUEST_DURATION, 'batch')].count == 1
+
+
+def test_error_responses_are_counted(metrics):
+    InvalidRequest().to_sanic_response()
+    InvalidRequest().to_sanic_response()
+    assert metrics.counters == {(ERRORS, '-32600'): 2}
+
+
+async def test_cache_group_counts_tiers(metrics):
+    cache_group = CacheGroup([CacheGroupItem(build_mocked_cache(), True, True,
+                                             SpeedTier.SLOW)])
+    request = jsonrpc_from_request(make_request(), 0, {
+        'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [1]})
+    response = {'id': 1, 'jsonrpc': '2.0', 'result': {'block_id': '1'}}
+    assert await cache_group.get_single_jsonrpc_response(request) is None
+    await cache_group.set('last_irreversible_block_num', 15_000_000, 180)
+    await cache_group.cache_single_jsonrpc_response(request, response)
+    assert await cache_group.get_single_jsonrpc_response(request) is not None
+    cache_group._memory_cache.clears()
+    assert await cache_group.get_single_jsonrpc_response(request) is not None
+    assert await cache_group.get_batch_jsonrpc_responses([request]) is not None
+    assert metrics.counters == {
+        (CACHE_REQUESTS, 'memory', 'miss'): 3,
+        (CACHE_REQUESTS, 'memory', 'hit'): 1,
+        (CACHE_REQUESTS, 'redis', 'miss'): 1,
+        (CACHE_REQUESTS, 'redis', 'hit'): 2,
+    }
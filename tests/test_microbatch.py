@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from json import dumps
+from time import perf_counter
+
+import pytest
+
+from jussi.microbatch import MicroBatcher
+
+
+class FakeResponse:
+    def __init__(self, body, delay=0):
+        self.body = body
+        self.delay = delay
+
+    async def read(self):
+        return self.body
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, respond=None, delay=0):
+        self.posts = []
+        self.respond = respond or (lambda requests: list(reversed(
+            [{'id': r['id'], 'jsonrpc': '2.0', 'result': r['params']} for r in requests])))
+        self.delay = delay
+
+    def post(self, url, json=None, headers=None):
+        self.posts.append((url, json, headers))
+        return FakeResponse(dumps(self.respond(json)).encode(), delay=self.delay)
+
+
+def upstream_request(params):
+    return {'id': 123, 'jsonrpc': '2.0', 'method': 'get_block', 'params': params}
+
+
+async def test_micro_batcher_batches_requests_within_window():
+    session = FakeSession()
+    batcher = MicroBatcher('http://test', session, window=0.01)
+    futures = [batcher.fetch(upstream_request([i]), jussi_request_id='abc')
+               for i in range(3)]
+    await asyncio.sleep(0)
+    assert not session.posts
+    results = await asyncio.gather(*futures)
+    assert len(session.posts) == 1
+    url, requests, headers = session.posts[0]
+    assert url == 'http://test'
+    assert [r['id'] for r in requests] == [0, 1, 2]
+    assert headers == {'x-jussi-request-id': 'abc'}
+    # responses are matched by id, whatever their order
+    assert [json.loads(r) for r in results] == [
+        {'id': i, 'jsonrpc': '2.0', 'result': [i]} for i in range(3)]
+    assert batcher.stats()['batch_sizes']['count'] == 1
+
+
+async def test_micro_batcher_passes_through_raw_responses():
+    def respond(requests):
+        return [{'jsonrpc': '2.0', 'result': {'id': r['id'], 'ops': [{'jsonrpc': 1}]},
+                 'id': r['id']} for r in reversed(requests)]
+    session = FakeSession(respond=respond)
+    batcher = MicroBatcher('http://test', session, window=0.01)
+    futures = [batcher.fetch(upstream_request([i])) for i in range(3)]
+    results = await asyncio.gather(*futures)
+    # split from the batch as the upstream encoded them, not re-encoded
+    assert results == [dumps(response).encode()
+                       for response in reversed(respond(session.posts[0][1]))]
+
+
+async def test_micro_batcher_sends_full_batch_immediately():
+    session = FakeSession()
+    batcher = MicroBatcher('http://test', session, window=10, max_size=2)
+    futures = [batcher.fetch(upstream_request([i])) for i in range(3)]
+    await asyncio.gather(*futures[:2])
+    assert len(session.posts) == 1
+    assert len(session.posts[0][1]) == 2
+    batcher.flush()
+    await futures[2]
+    assert len(session.posts) == 2
+
+
+async def test_micro_batcher_sends_timeout_header():
+    session = FakeSession()
+    batcher = MicroBatcher('http://test', session, window=0)
+    deadline = perf_counter() + 1
+    await asyncio.gather(batcher.fetch(upstream_request([1]), deadline=deadline - 0.5),
+                         batcher.fetch(upstream_request([2]), deadline=deadline))
+    timeout_ms = int(session.posts[0][2]['x-jussi-timeout-ms'])
+    assert 900 <= timeout_ms <= 1000
+
+
+async def test_micro_batcher_leaves_out_cancelled_requests():
+    session = FakeSession()
+    batcher = MicroBatcher('http://test', session, window=0.01)
+    cancelled = batcher.fetch(upstream_request([1]))
+    future = batcher.fetch(upstream_request([2]))
+    cancelled.cancel()
+    assert json.loads(await future)['result'] == [2]
+    assert session.posts[0][1] == [dict(upstream_request([2]), id=0)]
+
+
+async def test_micro_batcher_missing_response():
+    session = FakeSession(respond=lambda requests: [
+        {'id': 0, 'jsonrpc': '2.0', 'result': 1}])
+    batcher = MicroBatcher('http://test', session, window=0)
+    first = batcher.fetch(upstream_request([1]))
+    second = batcher.fetch(upstream_request([2]))
+    assert json.loads(await first)['result'] == 1
+    with pytest.raises(ValueError):
+        await second
+
+
+async def test_micro_batcher_non_batch_response_fails_all():
+    session = FakeSession(respond=lambda requests: {
+        'id': None, 'jsonrpc': '2.0', 'error': {'code': -32700}})
+    batcher = MicroBatcher('http://test', session, window=0)
+    futures = [batcher.fetch(upstream_request([i])) for i in range(2)]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert batcher.error_count == 1
+
+
+async def test_micro_batcher_close():
+    session = FakeSession(delay=10)
+    batcher = MicroBatcher('http://test', session, window=0.01)
+    queued = batcher.fetch(upstream_request([1]))
+    batcher.close()
+    assert queued.cancelled()
+    assert batcher.stats()['queued'] == 0
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'window': -1},
+    {'max_size': 0},
+])
+def test_micro_batcher_invalid_settings(kwargs):
+    with pytest.raises(ValueError):
+        MicroBatcher('http://test', FakeSession(), **kwargs)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import os
+import sys
+import time
+
+import pytest
+
+from jussi.handlers import profile
+from jussi.profiler import Profiler
+from jussi.profiler import ProfilerBusy
+from jussi.profiler import collapse
+from jussi.profiler import format_collapsed
+from .conftest import make_request
+
+
+def busy_function(seconds):
+    time.sleep(seconds)
+
+
+def test_collapse():
+    def inner():
+        return collapse(sys._getframe(), dict())  # pylint: disable=protected-access
+    stack = inner().split(';')
+    assert stack[-1] == f'inner (test_profiler.py:{inner.__code__.co_firstlineno})'
+    assert stack[-2].startswith('test_collapse (test_profiler.py:')
+
+
+def test_format_collapsed():
+    stacks = collections.Counter({'a;b': 1, 'a;c': 3})
+    assert format_collapsed(stacks) == 'a;c 3\na;b 1\n'
+
+
+async def test_profile(loop):
+    profiler = Profiler(loop)
+    future = asyncio.ensure_future(profiler.profile(0.3, 0.005), loop=loop)
+    await asyncio.sleep(0.02)
+    assert profiler.running
+    with pytest.raises(ProfilerBusy):
+        await profiler.profile(0.1, 0.005)
+    busy_function(0.2)
+    stacks = await future
+    assert not profiler.running
+    assert any(stack.split(';')[-1].startswith('busy_function') for stack in stacks)
+
+
+async def test_profile_workers(loop, mocker, tmpdir):
+    profiler = Profiler(loop, str(tmpdir))
+    kill = mocker.patch('jussi.profiler.os.kill',
+                        side_effect=lambda pid, signum: loop.call_soon(profiler.on_profile_signal))
+    stacks = await profiler.profile_workers(0.1, 0.005, workers=1)
+    assert kill.call_count == 1
+    assert sum(stacks.values()) > 0
+    assert os.listdir(str(tmpdir)) == ['profile.request']
+
+
+async def test_profile_route():
+    request = make_request(url_bytes=b'/admin/profile?seconds=0.05&interval=0.005', method='GET')
+    request.app.config.profiler = Profiler(asyncio.get_event_loop())
+    response = await profile(request)
+    assert response.status == 200
+    assert all(line.rsplit(' ', 1)[1].isdigit()
+               for line in response.body.decode().splitlines())
+
+
+@pytest.mark.parametrize('query', [b'seconds=0', b'seconds=100', b'seconds=x',
+                                   b'interval=0.00001'])
+async def test_profile_route_invalid(query):
+    request = make_request(url_bytes=b'/admin/profile?' + query, method='GET')
+    request.app.config.profiler = Profiler(asyncio.get_event_loop())
+    response = await profile(request)
+    assert response.status == 400
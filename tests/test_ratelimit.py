@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+import pytest
+import ujson
+
+from jussi.middlewares.limits import check_rate_limits
+from jussi.ratelimit import RateLimiter
+from jussi.ratelimit import RateLimitRule
+from jussi.ratelimit import SharedTokenBuckets
+from jussi.ratelimit import parse_rate_limits
+from .conftest import make_request
+
+
+def rule(**kwargs):
+    return RateLimitRule(**dict(dict(name='test', key='ip', rate=1.0, burst=2.0), **kwargs))
+
+
+def request(body=None, headers=None):
+    headers = dict({'x-jussi-request-id': '123', 'X-Real-IP': '1.2.3.4'}, **(headers or {}))
+    body = body or {'id': 1, 'jsonrpc': '2.0', 'method': 'condenser_api.get_block',
+                    'params': [1]}
+    req = make_request(headers=headers,
+                       body=ujson.dumps(body).encode() if isinstance(body, list) else body)
+    _ = req.jsonrpc
+    return req
+
+
+def test_parse_rate_limits():
+    rules = parse_rate_limits([
+        {'name': 'per_ip', 'key': 'ip', 'rate': 10, 'burst': 20},
+        {'key': 'header', 'header': 'X-API-Key', 'rate': 5},
+        {'key': 'global', 'prefix': 'appbase.condenser_api.get_account_history', 'rate': 1}
+    ])
+    assert rules[0] == RateLimitRule('per_ip', 'ip', 10.0, 20.0)
+    assert rules[1] == RateLimitRule('rule1', 'header', 5.0, 5.0, header='x-api-key')
+    assert rules[2].prefix == 'appbase.condenser_api.get_account_history'
+    assert parse_rate_limits(None) == ()
+
+
+@pytest.mark.parametrize('config', [
+    [{'key': 'method', 'rate': 1}],
+    [{'key': 'ip', 'rate': 0}],
+    [{'key': 'ip', 'rate': 1, 'burst': 0.5}],
+    [{'key': 'header', 'rate': 1}],
+])
+def test_parse_rate_limits_invalid(config):
+    with pytest.raises(ValueError):
+        parse_rate_limits(config)
+
+
+def test_shared_token_buckets():
+    buckets = SharedTokenBuckets(slots=64)
+    assert buckets.take(b'a', rate=1, burst=2, now=100) == 0
+    assert buckets.take(b'a', rate=1, burst=2, now=100) == 0
+    assert buckets.take(b'a', rate=1, burst=2, now=100) == 1
+    # other keys have their own bucket
+    assert buckets.take(b'b', rate=1, burst=2, now=100) == 0
+    # refilled at rate, up to burst
+    assert buckets.take(b'a', rate=1, burst=2, now=100.5) == 0.5
+    assert buckets.take(b'a', rate=1, burst=2, count=2, now=110) == 0
+    assert buckets.take(b'a', rate=1, burst=2, now=110) == 1
+
+
+def test_shared_token_buckets_replace_least_recently_used():
+    buckets = SharedTokenBuckets(slots=8)
+    for i in range(8):
+        buckets.take(str(i).encode(), rate=1, burst=1, now=100 + i)
+    # the set is full, the bucket of key 0 is replaced
+    assert buckets.take(b'new', rate=1, burst=1, now=200) == 0
+    assert buckets.take(b'0', rate=1, burst=1, now=200) == 0
+    assert buckets.take(b'7', rate=1, burst=1, now=107) == 1
+
+
+def _take_in_child(buckets):
+    buckets.take(b'a', rate=0.001, burst=2, now=100)
+
+
+def test_shared_token_buckets_are_shared_with_forked_processes():
+    buckets = SharedTokenBuckets(slots=64)
+    process = multiprocessing.get_context('fork').Process(target=_take_in_child,
+                                                          args=(buckets,))
+    process.start()
+    process.join()
+    assert buckets.take(b'a', rate=0.001, burst=2, now=100) == 0
+    assert buckets.take(b'a', rate=0.001, burst=2, now=100) > 0
+
+
+def test_rate_limiter_keys():
+    limiter = RateLimiter((rule(name='ip'),
+                           rule(name='key', key='header', header='x-api-key'),
+                           rule(name='history', key='global',
+                                prefix='appbase.condenser_api.get_account_history')),
+                          SharedTokenBuckets(slots=64))
+    assert limiter.keys(request()) == [(limiter.rules[0], b'ip\x001.2.3.4', 1)]
+
+    batch = [{'id': i, 'jsonrpc': '2.0', 'method': method, 'params': []}
+             for i, method in enumerate(['condenser_api.get_account_history',
+                                         'condenser_api.get_account_history',
+                                         'condenser_api.get_block'])]
+    keys = limiter.keys(request(batch, headers={'x-api-key': 'secret'}))
+    assert keys == [(limiter.rules[0], b'ip\x001.2.3.4', 3),
+                    (limiter.rules[1], b'key\x00secret', 3),
+                    (limiter.rules[2], b'history\x00', 2)]
+
+
+def test_rate_limiter_keys_namespace_only_prefix():
+    limiter = RateLimiter((rule(name='yo', key='global', prefix='yo.get_notifications'),),
+                          SharedTokenBuckets(slots=64))
+    req = request({'id': 1, 'jsonrpc': '2.0', 'method': 'yo.get_notifications'})
+    assert limiter.keys(req) == [(limiter.rules[0], b'yo\x00', 1)]
+
+
+async def test_rate_limiter_check():
+    limiter = RateLimiter((rule(),), SharedTokenBuckets(slots=64))
+    assert await limiter.check(request()) is None
+    assert await limiter.check(request()) is None
+    exceeded_rule, wait = await limiter.check(request())
+    assert exceeded_rule is limiter.rules[0]
+    assert 0 < wait <= 1
+    # other clients aren't limited
+    assert await limiter.check(request(headers={'X-Real-IP': '5.6.7.8'})) is None
+    assert limiter.stats()['rejected'] == {'test': 1}
+
+
+def test_shared_token_buckets_refund():
+    buckets = SharedTokenBuckets(slots=64)
+    assert buckets.take(b'a', rate=1, burst=2, count=2, now=100) == 0
+    buckets.refund(b'a', burst=2, count=1)
+    assert buckets.take(b'a', rate=1, burst=2, now=100) == 0
+    assert buckets.take(b'a', rate=1, burst=2, now=100) == 1
+    # capped at burst
+    buckets.refund(b'a', burst=2, count=5)
+    assert buckets.take(b'a', rate=1, burst=2, count=3, now=100) == 1
+
+
+async def test_rate_limiter_check_charges_no_rule_when_one_is_exceeded():
+    limiter = RateLimiter((rule(name='ip', burst=10.0),
+                           rule(name='block', key='global', burst=1.0,
+                                prefix='appbase.condenser_api.get_block')),
+                          SharedTokenBuckets(slots=64))
+    assert await limiter.check(request()) is None
+    for _ in range(5):
+        exceeded_rule, _ = await limiter.check(request())
+        assert exceeded_rule.name == 'block'
+    # the refused requests didn't take from the per ip bucket
+    other = {'id': 1, 'jsonrpc': '2.0', 'method': 'condenser_api.get_accounts', 'params': [[]]}
+    for _ in range(9):
+        assert await limiter.check(request(other)) is None
+    exceeded_rule, _ = await limiter.check(request(other))
+    assert exceeded_rule.name == 'ip'
+
+
+class FakeRedisBuckets:
+    def __init__(self, result):
+        self.result = result
+        self.takes = None
+
+    async def take_all(self, takes):
+        self.takes = takes
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+async def test_rate_limiter_check_redis():
+    rules = (rule(name='ip'), rule(name='global', key='global'))
+    redis_buckets = FakeRedisBuckets((1, 0.5))
+    limiter = RateLimiter(rules, SharedTokenBuckets(slots=64), redis_buckets)
+    assert await limiter.check(request()) == (rules[1], 0.5)
+    assert redis_buckets.takes == [(b'ip\x001.2.3.4', 1.0, 2.0, 1), (b'global\x00', 1.0, 2.0, 1)]
+
+    # local buckets when redis fails
+    limiter = RateLimiter(rules, SharedTokenBuckets(slots=64), FakeRedisBuckets(OSError()))
+    assert await limiter.check(request()) is None
+    assert limiter.stats()['redis_errors'] == 1
+
+
+async def test_check_rate_limits_middleware():
+    limiter = RateLimiter((rule(burst=1.0),), SharedTokenBuckets(slots=64))
+    req = request()
+    req.app.config.rate_limiter = limiter
+    assert await check_rate_limits(req) is None
+    response = await check_rate_limits(req)
+    assert response.headers['Retry-After'] == '1'
+    assert ujson.loads(response.body) == {
+        'jsonrpc': '2.0',
+        'id': 1,
+        'error': {'code': 1702,
+                  'message': 'Rate limit test of 1 requests per second exceeded'}}
+
+
+async def test_check_rate_limits_middleware_batch():
+    limiter = RateLimiter((rule(burst=2.0),), SharedTokenBuckets(slots=64))
+    batch = [{'id': i, 'jsonrpc': '2.0', 'method': 'condenser_api.get_block', 'params': [i]}
+             for i in ('a', 2)]
+    req = request(batch)
+    req.app.config.rate_limiter = limiter
+    assert await check_rate_limits(req) is None
+    response = await check_rate_limits(req)
+    error = {'code': 1702, 'message': 'Rate limit test of 1 requests per second exceeded'}
+    assert ujson.loads(response.body) == [
+        {'jsonrpc': '2.0', 'id': 'a', 'error': error},
+        {'jsonrpc': '2.0', 'id': 2, 'error': error}]
+
+
+async def test_check_rate_limits_middleware_without_rules():
+    req = request()
+    req.app.config.rate_limiter = None
+    assert await check_rate_limits(req) is None
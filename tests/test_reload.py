@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import copy
+from types import SimpleNamespace
+
+import pytest
+import ujson
+
+import jussi.reload
+from jussi.reload import diff_upstreams
+from jussi.ratelimit import SharedTokenBuckets
+from jussi.reload import reload_upstreams
+from jussi.serve import parse_args
+from jussi.upstream import _Upstreams
+from jussi.urn import URN
+
+CONFIG = {
+    "limits": {},
+    "upstreams": [
+        {
+            "name": "test",
+            "urls": [["test", "http://jussi-test.invalid"]],
+            "ttls": [["test", 1]],
+            "timeouts": [["test", 1]]
+        },
+        {
+            "name": "test2",
+            "urls": [["test2", "http://jussi-test2.invalid"]],
+            "ttls": [["test2", 1]],
+            "timeouts": [["test2", 1]]
+        }
+    ]
+}
+
+
+def changed_config(changes):
+    config = copy.deepcopy(CONFIG)
+    changes(config)
+    return config
+
+
+def args():
+    return parse_args(args=[])
+
+
+def test_diff_upstreams_unchanged():
+    changes = diff_upstreams(_Upstreams(CONFIG, validate=False),
+                             _Upstreams(copy.deepcopy(CONFIG), validate=False),
+                             args())
+    assert changes.to_dict() == {
+        'added': [],
+        'removed': [],
+        'http_pools': [],
+        'micro_batches': [],
+        'priority_classes': False
+    }
+
+
+def test_diff_upstreams():
+    def changes(config):
+        config['upstreams'][0]['urls'] = [["test", "http://jussi-test3.invalid"]]
+        config['upstreams'][1]['micro_batch'] = {'window_ms': 2}
+        config['priority_classes'] = {'default': {'weight': 2}, 'heavy': {'weight': 1}}
+
+    changes = diff_upstreams(_Upstreams(CONFIG, validate=False),
+                             _Upstreams(changed_config(changes), validate=False),
+                             args())
+    assert changes.added == {'http://jussi-test3.invalid'}
+    assert changes.removed == {'http://jussi-test.invalid'}
+    assert changes.http_pools == frozenset()
+    assert changes.micro_batches == {'http://jussi-test2.invalid'}
+    assert changes.priority_classes is True
+
+
+def test_diff_upstreams_http_pool_replaces_micro_batch():
+    def changes(config):
+        config['upstreams'][1]['http_pool'] = {'limit': 10}
+        config['upstreams'][1]['micro_batch'] = {'window_ms': 2}
+
+    changes = diff_upstreams(_Upstreams(CONFIG, validate=False),
+                             _Upstreams(changed_config(changes), validate=False),
+                             args())
+    assert changes.http_pools == {'http://jussi-test2.invalid'}
+    # the new session gets a new micro batcher anyway
+    assert changes.micro_batches == frozenset()
+
+
+def make_app(config_file):
+    app_args = args()
+    app_args.upstream_config_file = str(config_file)
+    app_args.test_upstream_urls = False
+    upstreams = _Upstreams(CONFIG, validate=False)
+    sessions = {url: SimpleNamespace(url=url) for url in upstreams.urls}
+    config = SimpleNamespace(args=app_args,
+                             upstreams=upstreams,
+                             limits={},
+                             websocket_pools=dict(),
+                             upstream_limiters=dict(),
+                             upstream_scheduler=None,
+                             rate_limiter=None,
+                             rate_limit_buckets=SharedTokenBuckets(slots=64),
+                             rate_limit_redis=None,
+                             aiohttp=dict(sessions=sessions,
+                                          request_urls=dict(),
+                                          batchers=dict()))
+    return SimpleNamespace(config=config)
+
+
+async def test_reload_upstreams(tmpdir, monkeypatch):
+    monkeypatch.setattr(jussi.reload, 'RETIRE_DELAY', 0)
+
+    def changes(config):
+        config['upstreams'][0]['urls'] = [["test", "http://jussi-test3.invalid"]]
+        config['upstreams'][1]['micro_batch'] = {'window_ms': 2}
+        config['limits'] = {'account_history_limit': 10,
+                            'rate_limits': [{'name': 'per_ip', 'key': 'ip', 'rate': 10}]}
+
+    config_file = tmpdir.join('config.json')
+    config_file.write(ujson.dumps(changed_config(changes)))
+    app = make_app(config_file)
+    old_upstreams = app.config.upstreams
+    aio = app.config.aiohttp
+    kept_session = aio['sessions']['http://jussi-test2.invalid']
+
+    changes = await reload_upstreams(app)
+    assert changes.added == {'http://jussi-test3.invalid'}
+    assert app.config.upstreams is not old_upstreams
+    urn = URN('test', 'api', 'method', False)
+    assert app.config.upstreams.url(urn) == 'http://jussi-test3.invalid'
+    assert app.config.limits['account_history_limit'] == 10
+    assert [rule.name for rule in app.config.rate_limiter.rules] == ['per_ip']
+
+    # kept urls keep their session, the micro batcher is added to it
+    assert aio['sessions']['http://jussi-test2.invalid'] is kept_session
+    assert aio['batchers']['http://jussi-test2.invalid'].url == 'http://jussi-test2.invalid'
+    new_session = aio['sessions']['http://jussi-test3.invalid']
+
+    # the removed url stays available to requests in flight until it's retired
+    assert 'http://jussi-test.invalid' in aio['sessions']
+    await asyncio.sleep(0.01)
+    assert 'http://jussi-test.invalid' not in aio['sessions']
+    assert set(aio['sessions']) == {'http://jussi-test2.invalid',
+                                    'http://jussi-test3.invalid'}
+    await new_session.close()
+
+
+async def test_reload_upstreams_bad_config_keeps_current(tmpdir):
+    config_file = tmpdir.join('config.json')
+    config_file.write(ujson.dumps(changed_config(
+        lambda config: config['upstreams'][0].update(name='test_api'))))
+    app = make_app(config_file)
+    upstreams = app.config.upstreams
+    sessions = dict(app.config.aiohttp['sessions'])
+    with pytest.raises(AssertionError):
+        await reload_upstreams(app)
+    assert app.config.upstreams is upstreams
+    assert app.config.aiohttp['sessions'] == sessions
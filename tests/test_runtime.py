@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+
+from sanic.server import HttpProtocol
+from sanic.server import Signal
+
+from jussi.cache.backends.max_ttl import SimplerMaxTTLMemoryCache
+from jussi.runtime import CountingHttpProtocol
+from jussi.runtime import RuntimeStats
+from jussi.runtime import server_stats
+from jussi.utils import async_nowait_middleware
+from jussi.utils import nowait_task_stats
+
+
+class FakeTransport:
+    def close(self):
+        pass
+
+
+def test_runtime_stats_collect():
+    runtime_stats = RuntimeStats()
+    runtime_stats.register('a', lambda: {'count': 1})
+    runtime_stats.register('broken', lambda: 1 / 0)
+    runtime_stats.register('b', lambda: [])
+    assert runtime_stats.collect() == {'a': {'count': 1}, 'broken': None, 'b': []}
+    runtime_stats.unregister('broken')
+    assert list(runtime_stats.collect()) == ['a', 'b']
+
+
+async def test_counting_http_protocol(loop):
+    # HttpProtocol's slots must not be shadowed by the counters
+    assert not set(vars(CountingHttpProtocol)) & set(HttpProtocol.__slots__)
+    open_connections = CountingHttpProtocol.open_connections
+    connections_total = CountingHttpProtocol.connections_total
+    # built as sanic.server.serve builds it
+    connections = set()
+    protocol = functools.partial(
+        CountingHttpProtocol, loop=loop, connections=connections, signal=Signal(),
+        request_handler=None, error_handler=None, request_timeout=60,
+        response_timeout=60, keep_alive_timeout=5, request_max_size=None,
+        request_class=None, access_log=False, keep_alive=True,
+        is_request_stream=False, router=None, websocket_max_size=None,
+        websocket_max_queue=None, websocket_read_limit=2 ** 16,
+        websocket_write_limit=2 ** 16, state={}, debug=False)()
+    protocol.connection_made(FakeTransport())
+    assert connections == {protocol}
+    assert server_stats()['connections'] == open_connections + 1
+    protocol.connection_lost(None)
+    assert not connections
+    assert server_stats()['connections'] == open_connections
+    assert server_stats()['connections_total'] == connections_total + 1
+
+
+async def test_nowait_task_stats():
+    done = asyncio.Event()
+
+    @async_nowait_middleware
+    async def middleware(request, response):
+        await done.wait()
+
+    before = nowait_task_stats()
+    await middleware(None, None)
+    assert nowait_task_stats()['pending'] == before['pending'] + 1
+    done.set()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert nowait_task_stats() == {'pending': before['pending'],
+                                   'done': before['done'] + 1}
+
+
+def test_memory_cache_stats_after_clear():
+    cache = SimplerMaxTTLMemoryCache(max_size=10)
+    cache.sets('a', 1, 60)
+    cache.sets('b', 2, 60)
+    assert cache.stats() == {'keys': 2, 'max_size': 10, 'max_ttl': 180}
+    cache.clears()
+    cache.sets('c', 3, 60)
+    assert cache.stats()['keys'] == 1
+    assert list(cache._keys) == ['c']
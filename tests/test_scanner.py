@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import pytest
+import ujson
+
+from jussi.empty import _empty
+from jussi.scanner import join_batch
+from jussi.scanner import response_id
+from jussi.scanner import rewrite_id
+from jussi.scanner import scan_response
+from jussi.scanner import split_batch
+
+RESULT = {'block_id': '000003e8b922f4906a45af8e99d86b3511acd7a5',
+          'transactions': [{'id': 1, 'ops': ['vote', {'id': 2}]}],
+          'transaction_ids': []}
+
+
+@pytest.mark.parametrize('raw,key,value', [
+    (b'{"jsonrpc":"2.0","result":{"id":1},"id":123}', b'result', b'{"id":1}'),
+    (b'{"jsonrpc": "2.0", "result": [1, 2], "id": 123}', b'result', b'[1, 2]'),
+    (b'{"id":123,"jsonrpc":"2.0","result":null}', b'result', b'null'),
+    (b'{"jsonrpc":"2.0","id":123,"result":"x"}', b'result', b'"x"'),
+    (b'{"jsonrpc":"2.0","error":{"code":-32000},"id":123}', b'error', b'{"code":-32000}'),
+    (b'{"result":1,"id":123}', b'result', b'1'),
+    (b' {\n "jsonrpc":"2.0",\n "result":1,\n "id":123\n}\n', b'result', b'1'),
+])
+def test_scan_response(raw, key, value):
+    scanned = scan_response(raw)
+    assert scanned.key == key
+    assert scanned.value(raw) == value
+    assert scanned.id(raw) == b'123'
+    assert ujson.loads(scanned.value(raw)) == ujson.loads(raw)[key.decode()]
+
+
+@pytest.mark.parametrize('raw', [
+    b'',
+    b'[]',
+    b'<html>502 Bad Gateway</html>',
+    b'{"jsonrpc":"2.0","result":1}',
+    b'{"jsonrpc":"2.0","result":{"id":1}}',
+    b'{"jsonrpc":"2.0","result":{"a":1,"id":1}}',
+])
+def test_scan_response_unrecognized(raw):
+    assert scan_response(raw) is None
+
+
+@pytest.mark.parametrize('response', [
+    {'jsonrpc': '2.0', 'result': RESULT, 'id': 123},
+    {'id': 123, 'jsonrpc': '2.0', 'result': RESULT},
+    {'jsonrpc': '2.0', 'error': {'code': 1, 'message': 'id'}, 'id': 123},
+    {'result': RESULT, 'jsonrpc': '2.0', 'id': 123, 'extra': 1},
+])
+@pytest.mark.parametrize('jrpc_id', [1, -1, 'abc', 'ü', 1.5, None, _empty])
+def test_rewrite_id(response, jrpc_id):
+    raw = ujson.dumps(response).encode()
+    expected = dict(response, id=None if jrpc_id is _empty else jrpc_id)
+    assert ujson.loads(rewrite_id(raw, jrpc_id, upstream_id=123)) == expected
+    assert ujson.loads(rewrite_id(raw.decode(), jrpc_id)) == expected
+
+
+@pytest.mark.parametrize('raw', [
+    b'{"jsonrpc":"2.0","result":1,"id":124}',
+    b'{"jsonrpc":"2.0","result":1,"id":null}',
+    b'{"jsonrpc":"2.0","result":1,"id":"123"}',
+    b'{"jsonrpc":"2.0","result":1,"other":2}',
+    b'[{"jsonrpc":"2.0","result":1,"id":123}]',
+    b'not json',
+])
+def test_rewrite_id_raises(raw):
+    with pytest.raises(ValueError):
+        rewrite_id(raw, 1, upstream_id=123)
+
+
+def test_rewrite_id_without_upstream_id():
+    raw = b'{"jsonrpc":"2.0","error":{"code":-32700},"id":null}'
+    assert rewrite_id(raw, 7) == b'{"jsonrpc":"2.0","error":{"code":-32700},"id":7}'
+
+
+@pytest.mark.parametrize('responses', [
+    [{'jsonrpc': '2.0', 'result': RESULT, 'id': 0}],
+    [{'jsonrpc': '2.0', 'result': RESULT, 'id': 1},
+     {'jsonrpc': '2.0', 'error': {'code': 1, 'message': '},{"jsonrpc":'}, 'id': 0},
+     {'jsonrpc': '2.0', 'result': [{'id': 1}, {'id': 2}], 'id': 2}],
+])
+def test_split_batch(responses):
+    raw_responses = [ujson.dumps(response).encode() for response in responses]
+    split = split_batch(b' [ ' + b' , '.join(raw_responses) + b' ] ', len(responses))
+    assert split == [raw_response for _, raw_response in sorted(
+        zip([response['id'] for response in responses], raw_responses))]
+
+
+@pytest.mark.parametrize('raw,size', [
+    (b'{"jsonrpc":"2.0","result":1,"id":0}', 1),
+    (b'[{"jsonrpc":"2.0","result":1,"id":0}]', 2),
+    (b'[{"jsonrpc":"2.0","result":1,"id":1}]', 1),
+    (b'[{"jsonrpc":"2.0","result":1,"id":0},{"jsonrpc":"2.0","result":1,"id":0}]', 2),
+    (b'[{"jsonrpc":"2.0","result":1,"id":0},{"id":1,"jsonrpc":"2.0","result":1}]', 2),
+    (b'[{"id":0,"jsonrpc":"2.0","result":1},{"id":1,"jsonrpc":"2.0","result":1}]', 2),
+    # a result nesting what looks like the next response
+    (b'[{"jsonrpc":"2.0","result":[{"a":1},{"jsonrpc":"2.0","result":1,"id":1}],"id":0}]', 1),
+    (b'[{"id":0,"jsonrpc":"2.0","result":[{"a":1},{"jsonrpc":"2.0","result":1,"id":1}]}]', 2),
+])
+def test_split_batch_unsplittable(raw, size):
+    assert split_batch(raw, size) is None
+
+
+def test_join_batch():
+    responses = [b'{"id":1,"result":1}', b'{"id":2,"result":2}']
+    assert ujson.loads(join_batch(responses)) == [
+        {'id': 1, 'result': 1}, {'id': 2, 'result': 2}]
+
+
+@pytest.mark.parametrize('raw,expected', [
+    (b'{"jsonrpc":"2.0","result":{"id":1},"id":123}', 123),
+    (b'{"id":-5,"jsonrpc":"2.0","result":null}', -5),
+    ('{"jsonrpc":"2.0","result":1,"id":"abc"}', 'abc'),
+    (b'{"jsonrpc":"2.0","result":1,"id":null}', None),
+    (b'{"jsonrpc":"2.0","result":1,"other":2}', None),
+    (b'{"jsonrpc":"2.0","method":"notice","params":[]}', None),
+    (b'[{"jsonrpc":"2.0","result":1,"id":123}]', None),
+    (b'not json', None),
+])
+def test_response_id(raw, expected):
+    assert response_id(raw) == expected
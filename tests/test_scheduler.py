@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from jussi.errors import PriorityQueueFullError
+from jussi.scheduler import PriorityScheduler
+
+CLASSES = {
+    'light': {'weight': 4},
+    'default': {'weight': 2},
+    'heavy': {'weight': 1, 'max_concurrency': 1}
+}
+
+
+async def test_scheduler_acquire_under_limit():
+    scheduler = PriorityScheduler(CLASSES, concurrency=2)
+    await scheduler.acquire('light')
+    await scheduler.acquire('default')
+    assert scheduler.inflight == 2
+    assert scheduler.queued == 0
+
+
+async def test_scheduler_unknown_class_is_default():
+    scheduler = PriorityScheduler(CLASSES, concurrency=2)
+    priority_class = await scheduler.acquire('nonexistent')
+    assert priority_class.name == 'default'
+
+
+def test_scheduler_adds_default_class():
+    scheduler = PriorityScheduler({'heavy': {'weight': 1}})
+    assert set(scheduler.stats()['classes']) == {'heavy', 'default'}
+
+
+@pytest.mark.parametrize('config', [
+    {'weight': 0},
+    {'weight': 1, 'max_concurrency': 0},
+])
+def test_scheduler_invalid_class(config):
+    with pytest.raises(ValueError):
+        PriorityScheduler({'test': config})
+
+
+async def test_scheduler_class_cap():
+    scheduler = PriorityScheduler(CLASSES, concurrency=10)
+    heavy = await scheduler.acquire('heavy')
+    waiter = asyncio.ensure_future(scheduler.acquire('heavy'))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    # other classes aren't held up by the capped class
+    await scheduler.acquire('light')
+    assert scheduler.inflight == 2
+
+    scheduler.release(heavy)
+    await asyncio.sleep(0)
+    assert waiter.done()
+    assert scheduler.inflight == 2
+
+
+async def test_scheduler_weighted_fair_queuing():
+    scheduler = PriorityScheduler(
+        {'light': {'weight': 4}, 'default': {'weight': 1}}, concurrency=1)
+    first = await scheduler.acquire('default')
+    order = ['default']
+
+    async def request(name):
+        priority_class = await scheduler.acquire(name)
+        order.append(name)
+        scheduler.release(priority_class)
+
+    tasks = [asyncio.ensure_future(request('default')) for _ in range(5)]
+    tasks += [asyncio.ensure_future(request('light')) for _ in range(10)]
+    await asyncio.sleep(0)
+    assert scheduler.queued == 15
+
+    scheduler.release(first)
+    await asyncio.gather(*tasks)
+    # light gets 4 slots for every default slot while both are queued
+    assert order[:5].count('light') == 4
+    assert sorted(order) == sorted(['default'] * 6 + ['light'] * 10)
+
+
+async def test_scheduler_idle_class_gets_no_credit():
+    scheduler = PriorityScheduler(
+        {'light': {'weight': 1}, 'default': {'weight': 1}}, concurrency=1)
+    for _ in range(10):
+        scheduler.release(await scheduler.acquire('default'))
+    first = await scheduler.acquire('default')
+    order = ['default']
+
+    async def request(name):
+        priority_class = await scheduler.acquire(name)
+        order.append(name)
+        scheduler.release(priority_class)
+
+    tasks = [asyncio.ensure_future(request(name)) for name in ['light'] * 4 + ['default'] * 4]
+    await asyncio.sleep(0)
+    scheduler.release(first)
+    await asyncio.gather(*tasks)
+    # instead of all of them
+    assert order[:4].count('light') == 2
+
+
+async def test_scheduler_sheds_when_queue_full():
+    scheduler = PriorityScheduler(CLASSES, concurrency=1, max_queue_size=1)
+    await scheduler.acquire('light')
+    waiter = asyncio.ensure_future(scheduler.acquire('heavy'))
+    await asyncio.sleep(0)
+    with pytest.raises(PriorityQueueFullError):
+        await scheduler.acquire('heavy')
+    assert scheduler.stats()['classes']['heavy']['shed'] == 1
+    # other classes have their own queues
+    light_waiter = asyncio.ensure_future(scheduler.acquire('light'))
+    await asyncio.sleep(0)
+    assert scheduler.queued == 2
+    waiter.cancel()
+    light_waiter.cancel()
+
+
+async def test_scheduler_cancelled_waiter_is_removed():
+    scheduler = PriorityScheduler(CLASSES, concurrency=1)
+    priority_class = await scheduler.acquire('light')
+    waiter = asyncio.ensure_future(scheduler.acquire('light'))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.queued == 0
+    scheduler.release(priority_class)
+    assert scheduler.inflight == 0
+
+
+async def test_scheduler_run():
+    scheduler = PriorityScheduler(CLASSES, concurrency=1)
+
+    async def coro():
+        assert scheduler.inflight == 1
+        return 1
+
+    assert await scheduler.run('light', coro()) == 1
+    assert scheduler.inflight == 0
+    assert scheduler.stats()['classes']['light']['dispatched'] == 1
+
+
+async def test_scheduler_run_releases_on_error():
+    scheduler = PriorityScheduler(CLASSES, concurrency=1)
+
+    async def coro():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        await scheduler.run('heavy', coro())
+    assert scheduler.inflight == 0
+    assert scheduler.stats()['classes']['heavy']['inflight'] == 0
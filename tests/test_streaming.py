@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pytest
+import ujson
+
+from jussi.empty import _empty
+from jussi.streaming import HEAD_SIZE
+from jussi.streaming import TAIL_SIZE
+from jussi.streaming import JsonRpcIdRewriter
+
+LARGE_RESULT = {'items': [{'id': i, 'name': 'x' * 10} for i in range(100)]}
+
+
+def rewrite(body: bytes, upstream_id, jrpc_id, chunk_size=None) -> bytes:
+    rewriter = JsonRpcIdRewriter(upstream_id, jrpc_id)
+    chunk_size = chunk_size or len(body)
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    return b''.join([rewriter.feed(chunk) for chunk in chunks] + [rewriter.finish()])
+
+
+@pytest.mark.parametrize('body', [
+    {'jsonrpc': '2.0', 'result': LARGE_RESULT, 'id': 123},
+    {'id': 123, 'jsonrpc': '2.0', 'result': LARGE_RESULT},
+    {'jsonrpc': '2.0', 'id': 123, 'result': LARGE_RESULT},
+    {'jsonrpc': '2.0', 'result': 1, 'id': 123},
+    {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'id'}, 'id': 123},
+])
+@pytest.mark.parametrize('jrpc_id', [1, 'abc', None, _empty])
+@pytest.mark.parametrize('chunk_size', [1, 7, HEAD_SIZE, TAIL_SIZE + 1, None])
+def test_rewriter(body, jrpc_id, chunk_size):
+    raw = ujson.dumps(body).encode()
+    result = ujson.loads(rewrite(raw, 123, jrpc_id, chunk_size))
+    expected = dict(body, id=None if jrpc_id is _empty else jrpc_id)
+    assert result == expected
+
+
+def test_rewriter_keeps_nested_ids():
+    raw = b'{"jsonrpc": "2.0", "result": {"id": 123}, "id": 123}'
+    assert rewrite(raw, 123, 'a', 3) == \
+        b'{"jsonrpc": "2.0", "result": {"id": 123}, "id": "a"}'
+
+
+@pytest.mark.parametrize('raw', [
+    b'{"jsonrpc":"2.0","result":1,"id":124}',
+    b'{"jsonrpc":"2.0","result":{"id":123}}',
+    b'{"jsonrpc":"2.0","result":{"a":1,"id":123}}',
+    b'',
+])
+def test_rewriter_raises_without_upstream_id(raw):
+    with pytest.raises(ValueError):
+        rewrite(raw, 123, 1)
+
+
+def test_rewriter_bounded_memory():
+    rewriter = JsonRpcIdRewriter(1, 2)
+    rewriter.feed(b'{"jsonrpc":"2.0","result":[')
+    for _ in range(1000):
+        assert rewriter.feed(b'1,' * 100)
+        assert len(rewriter._tail) <= TAIL_SIZE
+    assert rewriter.feed(b'1],"id":1}')
+    assert rewriter.finish().endswith(b'"id":2}')
@@ -208,3 +208,118 @@ def test_hash_ineq():
     upstreams1 = _Upstreams(SIMPLE_CONFIG, validate=False)
     upstreams2 = _Upstreams(VALID_HOSTNAME_CONFIG, validate=False)
     assert hash(upstreams1) != hash(upstreams2)
+
+
+def test_http_pool():
+    import copy
+    config = copy.deepcopy(SIMPLE_CONFIG)
+    config['upstreams'][1]['http_pool'] = {'limit': 10, 'prewarm': 2}
+    upstreams = _Upstreams(config, validate=False)
+    assert upstreams.http_pool('http://jussi-test.invalid') == {}
+    assert upstreams.http_pool('http://jussi-test2.invalid') == {'limit': 10, 'prewarm': 2}
+
+
+def test_micro_batch():
+    import copy
+    config = copy.deepcopy(SIMPLE_CONFIG)
+    config['upstreams'][1]['micro_batch'] = {'window_ms': 2, 'max_size': 16}
+    upstreams = _Upstreams(config, validate=False)
+    assert upstreams.micro_batch('http://jussi-test.invalid') == {}
+    assert upstreams.micro_batch('http://jussi-test2.invalid') == {'window_ms': 2, 'max_size': 16}
+
+
+def test_priority():
+    import copy
+    from jussi.urn import URN
+    config = copy.deepcopy(SIMPLE_CONFIG)
+    config['upstreams'][0]['priorities'] = [['test.api', 'heavy'],
+                                            ['test.api.cheap', 'light']]
+    upstreams = _Upstreams(config, validate=False)
+    assert upstreams.priority(URN('test', 'api', 'method', False)) == 'heavy'
+    assert upstreams.priority(URN('test', 'api', 'cheap', False)) == 'light'
+    assert upstreams.priority(URN('test', 'api2', 'method', False)) == 'default'
+    assert upstreams.priority(URN('test2', 'api', 'method', False)) == 'default'
+
+
+def test_priority_unknown_class():
+    import copy
+    config = copy.deepcopy(SIMPLE_CONFIG)
+    config['priority_classes'] = {'default': {'weight': 1}}
+    config['upstreams'][0]['priorities'] = [['test.api', 'heavy']]
+    with pytest.raises(AssertionError):
+        _Upstreams(config, validate=False)
+
+
+@pytest.mark.parametrize('url,expected', [
+    ('http+unix://%2Frun%2Fsteemd.sock', ('/run/steemd.sock', 'http://localhost/')),
+    ('http+unix://%2Frun%2Fsteemd.sock/rpc', ('/run/steemd.sock', 'http://localhost/rpc')),
+    ('ws+unix://%2Frun%2Fsteemd.sock/', ('/run/steemd.sock', 'ws://localhost/')),
+])
+def test_parse_unix_socket_url(url, expected):
+    from jussi.upstream import parse_unix_socket_url
+    assert parse_unix_socket_url(url) == expected
+
+
+def test_validate_unix_socket_urls(tmpdir):
+    import copy
+    import socket
+    from urllib.parse import quote
+    socket_path = str(tmpdir.join('steemd.sock'))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    config = copy.deepcopy(VALID_HOSTNAME_CONFIG)
+    url = 'http+unix://' + quote(socket_path, safe='')
+    config['upstreams'][0]['urls'] = [['test', url]]
+    try:
+        upstreams = _Upstreams(config, validate=True)
+        assert upstreams.urls == frozenset([url])
+    finally:
+        sock.close()
+
+
+def test_validate_unix_socket_urls_raises(tmpdir):
+    import copy
+    from urllib.parse import quote
+    not_a_socket = tmpdir.join('steemd.sock')
+    not_a_socket.write('')
+    for path in (str(not_a_socket), str(tmpdir.join('missing.sock'))):
+        config = copy.deepcopy(VALID_HOSTNAME_CONFIG)
+        config['upstreams'][0]['urls'] = [['test', 'ws+unix://' + quote(path, safe='')]]
+        with pytest.raises(InvalidUpstreamURL):
+            _Upstreams(config, validate=True)
+
+
+def test_route_param_prefix():
+    import copy
+    from jussi.urn import URN
+    config = copy.deepcopy(SIMPLE_CONFIG)
+    config['upstreams'][0]['ttls'].append(['test.api.method.params=[1]', 10])
+    upstreams = _Upstreams(config, validate=False)
+    assert upstreams.ttl(URN('test', 'api', 'method', [1])) == 10
+    assert upstreams.ttl(URN('test', 'api', 'method', [2])) == 1
+    assert upstreams.ttl(URN('test', 'api', 'other', [1])) == 1
+    route = upstreams.route(URN('test', 'api', 'method', [1]))
+    assert route.url == 'http://jussi-test.invalid'
+    assert route.timeout == 1
+
+
+def test_route_no_matching_url():
+    from jussi.urn import URN
+    from jussi.upstream import Upstream
+    upstreams = _Upstreams(SIMPLE_CONFIG, validate=False)
+    urn = URN('nonexistent', 'api', 'method', False)
+    with pytest.raises(InvalidUpstreamURL):
+        upstreams.url(urn)
+    with pytest.raises(InvalidUpstreamURL):
+        Upstream.from_urn(urn, upstreams=upstreams)
+
+
+def test_route_account_transfer_url(monkeypatch):
+    from jussi.urn import URN
+    monkeypatch.setenv('JUSSI_ACCOUNT_TRANSFER_STEEMD_URL', 'http://transfers.invalid')
+    upstreams = _Upstreams(SIMPLE_CONFIG, validate=False)
+    transfers = URN('test', 'condenser_api', 'get_state', ['/@alice/transfers'])
+    trending = URN('test', 'condenser_api', 'get_state', ['/trending'])
+    assert upstreams.url(transfers) == 'http://transfers.invalid'
+    assert upstreams.url(trending) == 'http://jussi-test.invalid'
+    assert upstreams.ttl(transfers) == 1
@@ -3,8 +3,10 @@
 import pytest
 from jussi.errors import InvalidNamespaceError
 from jussi.errors import InvalidNamespaceAPIError
+from jussi.urn import URN
 from jussi.urn import _empty
 from jussi.urn import from_request
+from jussi.urn import method_name
 from jussi.urn import _parse_jrpc
 
 
@@ -63,13 +65,15 @@ def test_urn_str(full_urn_test_request_dict):
 def test_urn_hash(full_urn_test_request_dict):
     jsonrpc_request, urn_parsed, urn, url, ttl, timeout = full_urn_test_request_dict
     result_urn = from_request(jsonrpc_request)
-    assert hash(result_urn) == hash(urn)
+    assert hash(result_urn) == hash(from_request(dict(jsonrpc_request)))
+    assert hash(result_urn) == hash(result_urn.key)
 
 
 def test_urn_eq(full_urn_test_request_dict):
     jsonrpc_request, urn_parsed, urn, url, ttl, timeout = full_urn_test_request_dict
     result_urn = from_request(jsonrpc_request)
-    assert result_urn == urn
+    assert result_urn == from_request(dict(jsonrpc_request))
+    assert result_urn != urn
 
 
 def test_urn_not_eq(full_urn_test_request_dict):
@@ -94,3 +98,52 @@ def test_urn_not_eq(full_urn_test_request_dict):
 def test_urn_params_serialization(jsonrpc_request, expected):
     result_urn = from_request(jsonrpc_request)
     assert str(result_urn) == expected
+
+
+@pytest.mark.parametrize('params1,params2', [
+    ([1], [True]),
+    ([1], [1.0]),
+    ([1], ['1']),
+    ([[1]], [1]),
+    ({'a': 1}, [['a', 1]]),
+    (_empty, []),
+    (_empty, None),
+])
+def test_urn_params_not_eq(params1, params2):
+    urn1 = URN('appbase', 'condenser_api', 'get_block', params1)
+    urn2 = URN('appbase', 'condenser_api', 'get_block', params2)
+    assert urn1 != urn2
+    assert str(urn1) != str(urn2)
+
+
+def test_urn_dict_params_order():
+    urn1 = from_request({'jsonrpc': '2.0', 'method': 'tags_api.get_discussions_by_blog',
+                         'params': {'tag': 'steemit', 'limit': 1}})
+    urn2 = from_request({'jsonrpc': '2.0', 'method': 'tags_api.get_discussions_by_blog',
+                         'params': {'limit': 1, 'tag': 'steemit'}})
+    assert urn1 == urn2
+    assert hash(urn1) == hash(urn2)
+    assert str(urn1) == str(urn2) == \
+        'appbase.tags_api.get_discussions_by_blog.params={"limit":1,"tag":"steemit"}'
+
+
+def test_urn_interned():
+    request = {'jsonrpc': '2.0', 'method': 'get_dynamic_global_properties'}
+    assert from_request(request) is from_request(dict(request, id=2))
+    assert from_request(dict(request, params=[])) != from_request(request)
+    params = []
+    urn = from_request(dict(request, params=params))
+    assert urn.params is params
+    assert from_request(dict(request, params=[])) is not urn
+    assert from_request({'jsonrpc': '2.0', 'method': 'get_block', 'params': [1]}) is not \
+        from_request({'jsonrpc': '2.0', 'method': 'get_block', 'params': [1]})
+
+
+@pytest.mark.parametrize('jsonrpc_method,expected', [
+    ('condenser_api.get_block', 'appbase.condenser_api.get_block'),
+    ('get_block', 'steemd.database_api.get_block'),
+    ('foo.bar', 'foo.bar'),
+])
+def test_method_name(jsonrpc_method, expected):
+    urn = from_request({'id': 1, 'jsonrpc': '2.0', 'method': jsonrpc_method, 'params': [1]})
+    assert method_name(urn) == expected
@@ -7,7 +7,7 @@ from .conftest import TEST_UPSTREAM_CONFIG
 upstreams = _Upstreams(TEST_UPSTREAM_CONFIG, validate=False)
 namespaces = upstreams.namespaces
 from jussi.urn import from_request
-from jussi.urn import _parse_jrpc_method
+from jussi.urn import _METHODS
 
 
 def test_urns(urn_test_request_dict):
@@ -127,7 +127,7 @@ def test_urn_params_empty_dict(jsonrpc_request, expected):
     ),
 ])
 def test_urn_params_no_params(jsonrpc_request, expected):
-    _parse_jrpc_method.cache_clear()
+    _METHODS.clear()
     result = str(from_request(jsonrpc_request))
     assert result == expected
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import pytest
+import ujson
 from .conftest import TEST_UPSTREAM_CONFIG
 from jussi.errors import JsonRpcError
 from jussi.errors import JussiLimitsError
@@ -11,6 +12,7 @@ from jussi.request.jsonrpc import from_http_request as jsonrpc_from_request
 from jussi.validators import is_get_block_header_request
 from jussi.validators import is_get_block_request
 from jussi.validators import is_valid_get_block_response
+from jussi.validators import is_valid_get_block_response_raw
 from jussi.validators import is_valid_non_error_jussi_response
 from jussi.validators import is_valid_non_error_single_jsonrpc_response
 from jussi.validators import is_valid_single_jsonrpc_response
@@ -156,6 +158,26 @@ def test_is_valid_get_block_response(req, response, expected):
     assert is_valid_get_block_response(req, response) is expected
 
 
+@pytest.mark.parametrize('req,raw_response,expected', [
+    (request, ujson.dumps(response).encode(), True),
+    (request2, ujson.dumps(response).encode(), True),
+    (request, ujson.dumps(dict(jsonrpc='2.0', **response)).encode(), True),
+    (request, ujson.dumps(dict(response, jsonrpc='2.0', id=1)).encode(), True),
+    (request, ujson.dumps(dict(jsonrpc='2.0', result={'block': response['result']}, id=1)).encode(), True),
+    (request, ujson.dumps(dict(jsonrpc='2.0', result=None, id=1)).encode(), False),
+    (request, ujson.dumps(bad_response1).encode(), False),
+    (request, ujson.dumps(bad_response2).encode(), False),
+    (request, ujson.dumps(error_response).encode(), False),
+    (request, b'', False),
+    (request, b'[]', False),
+    (dict(jsonrpc='2.0', method='m'), ujson.dumps(response).encode(), False),
+])
+def test_is_valid_get_block_response_raw(req, raw_response, expected):
+    if not isinstance(req, JSONRPCRequest):
+        req = jsonrpc_from_request(dummy_request, 0, req)
+    assert is_valid_get_block_response_raw(req, raw_response) is expected
+
+
 @pytest.mark.parametrize('req,resp,expected', [
     (request, response, True),
     (request2, response, True),
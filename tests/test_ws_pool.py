@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from jussi.errors import UpstreamUnavailableError
+from jussi.ws.pool import GROW_STEP
+from jussi.ws.pool import Pool
+
+
+class FakeConn:
+    def __init__(self, answers_pings=True):
+        self.open = True
+        self.closed = False
+        self.answers_pings = answers_pings
+        self.pings = 0
+        self.messages = asyncio.Queue()
+
+    async def ping(self):
+        self.pings += 1
+        pong_waiter = asyncio.get_event_loop().create_future()
+        if self.answers_pings:
+            pong_waiter.set_result(None)
+        return pong_waiter
+
+    async def recv(self):
+        return await self.messages.get()
+
+    async def close(self, timeout=None):
+        self.open = False
+        self.closed = True
+
+    def fail_connection(self):
+        self.open = False
+        self.closed = True
+
+
+class FakePool(Pool):
+    async def _get_new_connection(self):
+        if self.fail_connects:
+            raise ConnectionRefusedError()
+        conn = FakeConn()
+        self.conns.append(conn)
+        return conn
+
+
+async def make_pool(minsize, maxsize, conns=None, **kwargs):
+    pool = FakePool(minsize, maxsize, 0, None, 'ws://test',
+                    pool_maintenance_interval=3600, **kwargs)
+    pool.conns = conns if conns is not None else []
+    pool.fail_connects = False
+    return await pool
+
+
+async def settle():
+    # let background connects finish
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def test_pool_connects_minsize():
+    conns = []
+    pool = await make_pool(2, 8, conns)
+    assert pool.size == 2
+    assert len(conns) == 2
+    pool.terminate()
+
+
+async def test_pool_start_connects_minsize_in_background():
+    pool = FakePool(2, 8, 0, None, 'ws://test', pool_maintenance_interval=3600)
+    pool.conns = []
+    pool.fail_connects = False
+    pool.start()
+    assert pool.size == 0
+    assert len(pool._connecting) == 2
+    # requests don't have to wait for the pool to be warm
+    conn = await pool.acquire()
+    await pool.release(conn)
+    await pool.wait_connected()
+    assert pool.size == 2
+    assert pool._queue.qsize() == 2
+    pool.terminate()
+
+
+async def test_pool_wait_connected_returns_when_unreachable():
+    pool = FakePool(2, 8, 0, None, 'ws://test', pool_maintenance_interval=3600)
+    pool.conns = []
+    pool.fail_connects = True
+    pool.start()
+    await asyncio.wait_for(pool.wait_connected(), 1)
+    assert pool.degraded
+    # still retrying in the background
+    assert len(pool._connecting) == 2
+    pool.terminate()
+
+
+async def test_pool_acquire_observes_wait():
+    pool = await make_pool(2, 8)
+    conn = await pool.acquire()
+    await pool.release(conn)
+    assert pool.acquire_wait.count == 1
+    stats = pool.stats()
+    assert stats['acquire_wait']['count'] == 1
+    assert stats['size'] == 2
+    assert len(stats['connection_ages']) == 2
+    pool.terminate()
+
+
+async def test_pool_reaps_idle_connections():
+    pool = await make_pool(2, 8, pool_idle_timeout=10)
+    conns = [await pool.acquire() for _ in range(4)]
+    for conn in conns:
+        await pool.release(conn)
+    assert pool.size == 4
+
+    await pool._maintain_once()
+    assert pool.size == 4
+
+    for ch in pool._holders:
+        if ch._released_at is not None:
+            ch._released_at -= 11
+    await pool._maintain_once()
+    assert pool.size == 2
+    assert pool.reaped_count == 2
+    # the connected holders are acquired first
+    conn = await pool.acquire()
+    assert conn._holder.connected
+    await pool.release(conn)
+    pool.terminate()
+
+
+async def test_pool_does_not_reap_in_use_connections():
+    pool = await make_pool(0, 8, pool_idle_timeout=10)
+    conn = await pool.acquire()
+    conn._holder._released_at -= 11
+    await pool._maintain_once()
+    assert conn._holder.connected
+    await pool.release(conn)
+    pool.terminate()
+
+
+async def test_pool_pings_idle_connections():
+    pool = await make_pool(2, 8, pool_idle_timeout=0, pool_ping_interval=10,
+                           pool_ping_timeout=0.01)
+    holders = [ch for ch in pool._holders if ch.connected]
+    dead_conn = holders[0]._con
+    dead_conn.answers_pings = False
+    for ch in holders:
+        ch._released_at -= 11
+
+    await pool._maintain_once()
+    assert dead_conn.closed
+    assert holders[1]._con.pings == 1
+    assert pool.ping_failure_count == 1
+    # the dead connection is replaced in the background
+    await settle()
+    assert holders[0].connected
+    assert holders[0]._con is not dead_conn
+    assert pool.size == 2
+    assert pool._queue.qsize() == 2
+    pool.terminate()
+
+
+async def test_pool_pings_do_not_prevent_reaping():
+    pool = await make_pool(0, 8, pool_idle_timeout=10, pool_ping_interval=1)
+    conn = await pool.acquire()
+    await pool.release(conn)
+    conn._holder._released_at -= 5
+    await pool._maintain_once()
+    assert conn._holder._con.pings == 1
+    conn._holder._released_at -= 6
+    await pool._maintain_once()
+    assert pool.size == 0
+    pool.terminate()
+
+
+async def test_pool_grows_when_acquire_wait_rises():
+    pool = await make_pool(2, 8, pool_idle_timeout=0, pool_grow_wait=0.01)
+    await pool._maintain_once()
+    assert pool.size == 2
+
+    pool._wait_ewma = 0.1
+    await pool._maintain_once()
+    await settle()
+    assert pool.size == 2 + GROW_STEP
+    assert pool._wait_ewma == 0
+    assert pool._queue.qsize() == 2 + GROW_STEP
+    pool.terminate()
+
+
+async def test_pool_does_not_grow_past_maxsize():
+    pool = await make_pool(2, 3, pool_idle_timeout=0, pool_grow_wait=0.01)
+    pool._wait_ewma = 0.1
+    await pool._maintain_once()
+    await settle()
+    assert pool.size == 3
+    pool.terminate()
+
+
+async def test_pool_reconnects_broken_connection_in_background():
+    pool = await make_pool(2, 2)
+    conn = await pool.acquire()
+    holder = conn._holder
+    conn.terminate()
+    assert not holder.connected
+    assert pool._queue.qsize() == 1
+    assert holder in pool._connecting
+
+    await settle()
+    assert holder.connected
+    assert pool._queue.qsize() == 2
+    assert not pool._connecting
+    pool.terminate()
+
+
+async def test_pool_acquire_skips_connections_closed_while_idle():
+    pool = await make_pool(2, 2)
+    closed_conn = pool._queue._queue[-1]._con
+    closed_conn.open = False
+    conn = await pool.acquire()
+    assert conn._con is not closed_conn
+    assert conn._holder.connected
+    await pool.release(conn)
+    await settle()
+    assert pool.size == 2
+    pool.terminate()
+
+
+async def test_pool_connects_spare_when_exhausted():
+    pool = await make_pool(1, 2)
+    first = await pool.acquire()
+    second = await pool.acquire()
+    assert first._holder is not second._holder
+    assert pool.size == 2
+    await pool.release(first)
+    await pool.release(second)
+    pool.terminate()
+
+
+async def test_pool_reconnect_backoff_and_degraded(mocker):
+    sleep = mocker.patch('jussi.ws.pool.asyncio.sleep', side_effect=asyncio.sleep)
+    pool = await make_pool(1, 1, pool_idle_timeout=0, pool_ping_interval=0, pool_grow_wait=0)
+    conn = await pool.acquire()
+    pool.fail_connects = True
+    conn.terminate()
+    await settle()
+    assert pool.degraded
+    assert pool.stats()['state'] == 'degraded'
+    with pytest.raises(UpstreamUnavailableError):
+        await pool.acquire()
+
+    pool.fail_connects = False
+    for _ in range(10):
+        if not pool.degraded:
+            break
+        await asyncio.sleep(0.05)
+    await settle()
+    assert not pool.degraded
+    assert pool.stats()['connect_failures'] == 0
+    # the pool's own sleeps pass loop=
+    delays = [call[0][0] for call in sleep.call_args_list if 'loop' in call[1]]
+    assert 0.05 <= delays[0] <= 0.1
+    conn = await pool.acquire()
+    await pool.release(conn)
+    pool.terminate()
+
+
+async def test_pool_drain_releases_connection_after_late_response():
+    pool = await make_pool(1, 1, pool_drain_timeout=1)
+    conn = await pool.acquire()
+    holder = conn._holder
+    pool.drain(conn, 124)
+    await settle()
+    assert pool.stats()['draining'] == 1
+    assert pool._queue.qsize() == 0
+
+    # responses to other requests are discarded
+    holder._con.messages.put_nowait('{"jsonrpc":"2.0","result":1,"id":123}')
+    await settle()
+    assert pool._queue.qsize() == 0
+    holder._con.messages.put_nowait('{"jsonrpc":"2.0","result":1,"id":124}')
+    await settle()
+    assert pool._queue.qsize() == 1
+    assert holder.connected
+    assert pool.drained_count == 1
+    assert pool.cancel_lost_count == 0
+    assert pool.stats()['draining'] == 0
+    pool.terminate()
+
+
+async def test_pool_drain_timeout_closes_connection():
+    pool = await make_pool(1, 1, pool_drain_timeout=0.01,
+                           pool_idle_timeout=0, pool_ping_interval=0, pool_grow_wait=0)
+    conn = await pool.acquire()
+    lost_conn = conn._holder._con
+    pool.drain(conn, 124)
+    await asyncio.sleep(0.05)
+    assert lost_conn.closed
+    assert pool.cancel_lost_count == 1
+    assert pool.stats()['lost_to_cancellation'] == 1
+    # and the holder is reconnected
+    await settle()
+    assert pool.size == 1
+    pool.terminate()
+
+
+async def test_pool_close_cancels_maintenance():
+    pool = await make_pool(1, 2)
+    task = pool._maintenance_task
+    assert task is not None
+    await pool.close()
+    await asyncio.sleep(0)
+    assert task.cancelled()
+
+
+def test_pool_invalid_maintenance_interval():
+    with pytest.raises(ValueError):
+        Pool(1, 2, 0, None, 'ws://test', pool_maintenance_interval=0)